@@ -0,0 +1,342 @@
+"""
+Offline benchmarks for the add-on hot paths.
+
+Runs without camera, network or AWS: PTZ moves go to a fake PTZ service,
+/capture reads from a generated local video file instead of RTSP, plate
+detection runs on synthetic plate images and stop-motion renders a generated
+image set. ONVIF round trips go through the local simulator (onvif_sim.py). Results are written as JSON so runs can be compared:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import contextlib
+from datetime import datetime, timedelta
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import cv2
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import ptz_commands
+from ptz_commands import PTZCommands
+from plate_format import extract_plate
+from streams import StreamManager
+
+
+class FakePTZService:
+    """Records ONVIF PTZ calls instead of sending them to a camera."""
+
+    def __init__(self):
+        self.calls = []
+
+    def create_type(self, name):
+        return SimpleNamespace()
+
+    def ContinuousMove(self, req):
+        self.calls.append(("ContinuousMove", getattr(req, "Velocity", None)))
+
+    def Stop(self, req):
+        self.calls.append(("Stop", req))
+
+    def GetStatus(self, req):
+        # Reports IDLE so wait_settled returns at once instead of sleeping SETTLE_FALLBACK_S
+        return SimpleNamespace(Position=None, MoveStatus=SimpleNamespace(PanTilt="IDLE", Zoom="IDLE"))
+
+
+def fake_profile():
+    return SimpleNamespace(token="bench_profile", PTZConfiguration=SimpleNamespace(token="bench_ptz"))
+
+
+def summarize(samples):
+    samples_ms = sorted(s * 1000 for s in samples)
+    return {
+        "n": len(samples_ms),
+        "mean_ms": statistics.fmean(samples_ms),
+        "median_ms": statistics.median(samples_ms),
+        "p95_ms": samples_ms[min(len(samples_ms) - 1, int(round(0.95 * (len(samples_ms) - 1))))],
+        "min_ms": samples_ms[0],
+        "max_ms": samples_ms[-1],
+    }
+
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def recorded_sleeps():
+    """Make timed PTZ moves return immediately, recording the planned durations."""
+    planned = []
+
+    def drive(control, axis, amount):
+        planned.append(control.move_time(axis, amount))
+        return amount
+
+    with mock.patch.object(ptz_commands.time, "sleep", side_effect=lambda s: planned.append(s)), \
+            mock.patch.object(PTZCommands, "_drive", drive):
+        yield planned
+
+
+def load_presets():
+    with open(os.path.join(HERE, "locations.json"), "r") as f:
+        return json.load(f)
+
+
+def bench_ptz_move_planning(workdir, repeat):
+    presets = load_presets()
+    ptz = FakePTZService()
+    control = PTZCommands(ptz, fake_profile())
+
+    def tour():
+        for preset in presets.values():
+            control.abs_zoom(preset["zoom"])
+            control.abs_pantilt((preset["pan"], preset["tilt"]))
+
+    with quiet(), recorded_sleeps() as planned:
+        result = measure(tour, repeat)
+        planned.clear()
+        ptz.calls.clear()
+        tour()
+    result.update({
+        "presets": len(presets),
+        "planned_motion_s": sum(planned),
+        "onvif_calls": len(ptz.calls),
+    })
+    return result
+
+
+def write_synthetic_video(path, frames=30, size=(1280, 720), fps=25):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    for i in range(frames):
+        writer.write(np.roll(base, i * 8, axis=1))
+    writer.release()
+
+
+def bench_capture(workdir, repeat):
+    video_path = os.path.join(workdir, "stream.avi")
+    write_synthetic_video(video_path)
+    pictures_path = os.path.join(workdir, "pictures")
+    app_dir = os.path.join(workdir, "app")
+    os.makedirs(app_dir, exist_ok=True)
+    with open(os.path.join(app_dir, "environ.json"), "w") as f:
+        json.dump({"pictures_path": pictures_path}, f)
+    shutil.copy(os.path.join(HERE, "locations.json"), app_dir)
+
+    # main.py reads environ.json and locations.json from the working directory
+    previous_cwd = os.getcwd()
+    os.chdir(app_dir)
+    try:
+        import main
+    finally:
+        os.chdir(previous_cwd)
+    camera = main.cameras.get()
+    camera.streams = StreamManager.single(video_path)
+    camera.ptz_control = PTZCommands(FakePTZService(), fake_profile())
+
+    with quiet():
+        result = measure(lambda: asyncio.run(main.take_picture("bench")), repeat)
+    result["source"] = "local video file"
+    return result
+
+
+def synthetic_plate_image(text="1234ABC", size=(1280, 720), seed=0):
+    rng = np.random.default_rng(seed)
+    img = rng.integers(60, 120, (size[1], size[0]), dtype=np.uint8)
+    img = cv2.GaussianBlur(img, (7, 7), 0)
+    x, y = size[0] // 2 - 130, size[1] // 2 - 30
+    cv2.rectangle(img, (x, y), (x + 260, y + 60), 235, -1)
+    cv2.rectangle(img, (x, y), (x + 260, y + 60), 20, 3)
+    cv2.putText(img, text, (x + 12, y + 45), cv2.FONT_HERSHEY_SIMPLEX, 1.5, 15, 4)
+    return img
+
+
+def bench_plate_detection(workdir, repeat):
+    cascade = cv2.CascadeClassifier(os.path.join(HERE, "haarcascade_russian_plate_number.xml"))
+    images = [synthetic_plate_image(seed=i) for i in range(4)]
+    results = {}
+
+    results["cascade_full_frame"] = measure(
+        lambda: [cascade.detectMultiScale(img, scaleFactor=1.1, minNeighbors=5) for img in images], repeat)
+    results["cascade_full_frame"]["images"] = len(images)
+
+    from detection_region import DetectionRegion
+    region = DetectionRegion(polygon=[[340, 260], [940, 260], [940, 460], [340, 460]],
+                             min_plate=[180, 40], max_plate=[400, 120])
+    results["cascade_region"] = measure(lambda: [region.detect(cascade, img) for img in images], repeat)
+    results["cascade_region"]["images"] = len(images)
+
+    ocr_outputs = ["1234 ABC", "12345ABC", "1234ABCD", "I234ABC", "1234AB", "BCD 1234ABC"] * 50
+    with quiet():
+        results["extract_plate"] = measure(lambda: [extract_plate(t) for t in ocr_outputs], repeat)
+    results["extract_plate"]["strings"] = len(ocr_outputs)
+
+    try:
+        import easyocr
+        with quiet():
+            reader = easyocr.Reader(["en"], gpu=False, download_enabled=False, verbose=False)
+        roi = images[0][300:420, 480:800]
+        results["ocr"] = measure(
+            lambda: reader.readtext(roi, detail=0, allowlist='BCDFGHJKLMNPQRSTVWXYZ0123456789'), repeat)
+    except Exception as e:
+        results["ocr"] = {"skipped": f"easyocr unavailable offline: {e}"}
+    return results
+
+
+def bench_stopmotion(workdir, repeat, images=60, size=(640, 360)):
+    import stopmotion
+
+    folder = os.path.join(workdir, "stopmotion")
+    os.makedirs(os.path.join(folder, "pictures"), exist_ok=True)
+    rng = np.random.default_rng(1)
+    start = datetime(2025, 7, 2, 14, 0, 0)
+    for i in range(images):
+        frame = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+        name = (start + timedelta(seconds=3 * i)).strftime("%Y%m%d_%H%M%S.jpg")
+        cv2.imwrite(os.path.join(folder, "pictures", name), frame)
+
+    with quiet():
+        result = measure(lambda: stopmotion.create_stopmotion_video(folder, fps=30), repeat)
+    result.update({"images": images, "frame_size": list(size)})
+    return result
+
+
+def bench_onvif_roundtrip(workdir, repeat, latency_s=0.02):
+    from onvif import ONVIFCamera
+    from onvif_sim import ONVIFSimulator
+    from onvif_transport import make_transport
+
+    with ONVIFSimulator(port=0, latency_s=latency_s) as sim, quiet():
+        cam = ONVIFCamera("127.0.0.1", sim.port, "admin", "admin", wsdl_dir=os.path.join(HERE, "wsdl"),
+                          transport=make_transport())
+        media = cam.create_media_service()
+        ptz = cam.create_ptz_service()
+        control = PTZCommands(ptz, media.GetProfiles()[0])
+
+        results = {
+            "start_move": measure(lambda: control.pan_speed("right").result(), repeat),
+            # Through the sender thread, as the GUI buttons and timed moves issue it
+            "start_move_queued": measure(lambda: control.pan_right().result(), repeat),
+            "stop": measure(control.stop_ptz, repeat),
+            "get_status": measure(lambda: ptz.GetStatus({"ProfileToken": control.profile.token}), repeat),
+        }
+
+        # End to end: timed relative moves against the kinematic model
+        errors = []
+
+        def small_move():
+            before = sim.camera.status()["pan"]
+            control.rel_pan(10)
+            errors.append(abs(sim.camera.status()["pan"] - before - 10))
+
+        control.stop_ptz()
+        control.hard_origin(blocking=True)
+        results["rel_pan_10deg"] = measure(small_move, repeat, warmup=0)
+        results["rel_pan_10deg"]["mean_abs_error_deg"] = statistics.fmean(errors)
+    results["injected_latency_ms"] = latency_s * 1000
+    return results
+
+
+BENCHMARKS = {
+    "ptz_move_planning": bench_ptz_move_planning,
+    "capture": bench_capture,
+    "plate_detection": bench_plate_detection,
+    "stopmotion": bench_stopmotion,
+    "onvif_roundtrip": bench_onvif_roundtrip,
+}
+
+
+def run(names, repeat):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="cam_api_bench_") as workdir:
+        for name in names:
+            print(f"Running {name}...", file=sys.stderr)
+            case_dir = os.path.join(workdir, name)
+            os.makedirs(case_dir, exist_ok=True)
+            try:
+                results[name] = BENCHMARKS[name](case_dir, repeat)
+            except Exception as e:
+                results[name] = {"error": f"{type(e).__name__}: {e}"}
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            if "median_ms" in value:
+                flat[prefix + key] = value["median_ms"]
+            else:
+                flat.update(flatten(value, prefix + key + "."))
+    return flat
+
+
+def compare(current, baseline):
+    now, before = flatten(current["results"]), flatten(baseline["results"])
+    print(f"{'benchmark':40} {'before ms':>12} {'after ms':>12} {'speed-up':>9}")
+    for key in sorted(now):
+        if key in before and now[key] > 0:
+            print(f"{key:40} {before[key]:12.3f} {now[key]:12.3f} {before[key] / now[key]:8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for cam_api hot paths")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repetitions per benchmark")
+    parser.add_argument("--output", help="Write results JSON to this file (default: stdout)")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    args = parser.parse_args()
+
+    report = run(args.only or list(BENCHMARKS), args.repeat)
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
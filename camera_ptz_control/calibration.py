@@ -0,0 +1,326 @@
+"""
+Speed calibration by visual odometry.
+
+The camera makes timed moves at each speed and zoom level. The frames grabbed
+before and after each move are reprojected to angles with the field of view,
+and the rotation between them is measured with phase correlation. A straight-line
+fit of degrees against move time gives degrees per second per axis, speed and
+zoom level, plus a constant offset from start/stop lag or coasting.
+
+Zoom is stepped from the wide end to the tele end. The scale change between
+frames, from log-polar phase correlation, gives the time the full zoom range
+takes and the magnification at each level. The magnification also narrows the
+field of view used for pan/tilt at that zoom level.
+
+The result is saved as a JSON calibration profile that PTZCommands loads.
+"""
+import bisect
+from datetime import datetime
+import json
+import math
+
+import cv2
+import numpy as np
+
+import ptz_commands
+
+DEFAULT_HFOV_DEG = 60.0
+CALIBRATION_POSITION = (180, -30)  # pan, tilt: the home view, away from the end stops
+ANALYSIS_WIDTH = 640
+TARGET_SHIFT = 0.15         # fraction of the field of view covered by the shorter move
+MIN_RESPONSE = 0.05         # weaker phase correlation peaks mean the frames don't overlap
+ZOOM_STEPS = 8              # steps expected across the zoom range
+MIN_ZOOM_STEP_SCALE = 1.01  # less scale change than this means the zoom reached its end stop
+
+
+class CalibrationError(Exception):
+    """Raised when the moves can't be measured (frames don't overlap, zoom doesn't change)."""
+
+
+def _gray(frame, width=ANALYSIS_WIDTH):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    scale = min(1.0, width / gray.shape[1])
+    if scale < 1.0:
+        gray = cv2.resize(gray, (width, round(gray.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    return np.float32(gray), scale
+
+
+def _angular(gray, focal, tilt_deg):
+    """Reproject a frame onto a pan/tilt grid (one pixel per 1/focal radian) around its centre."""
+    height, width = gray.shape
+    cx, cy = (width - 1) / 2, (height - 1) / 2
+    step = 1 / focal
+    half_w = 0.9 * math.atan(cx / focal)
+    half_h = 0.9 * math.atan(cy / focal)
+    lon, lat = np.meshgrid(np.arange(-half_w, half_w, step), np.arange(half_h, -half_h, -step))
+    t = math.radians(tilt_deg)
+    lat = lat + t
+    x = np.cos(lat) * np.sin(lon)
+    y_world, z_world = np.sin(lat), np.cos(lat) * np.cos(lon)
+    y = y_world * math.cos(t) - z_world * math.sin(t)
+    z = y_world * math.sin(t) + z_world * math.cos(t)
+    return cv2.remap(gray, (cx + focal * x / z).astype(np.float32), (cy - focal * y / z).astype(np.float32),
+                     cv2.INTER_LINEAR)
+
+
+def _vertical_cylinder(gray, focal):
+    """Reproject a frame so a pure tilt becomes a pure vertical shift of focal pixels per radian."""
+    height, width = gray.shape
+    cx, cy = (width - 1) / 2, (height - 1) / 2
+    u, v = np.meshgrid(np.arange(width, dtype=np.float32) - cx, np.arange(height, dtype=np.float32) - cy)
+    theta = v / focal
+    return cv2.remap(gray, (u / np.cos(theta) + cx).astype(np.float32), (focal * np.tan(theta) + cy).astype(np.float32),
+                     cv2.INTER_LINEAR)
+
+
+def _correlate(a, b):
+    window = cv2.createHanningWindow((a.shape[1], a.shape[0]), cv2.CV_32F)
+    return cv2.phaseCorrelate(a, b, window)
+
+
+def angle_shift(before, after, focal, tilt_deg):
+    """
+    Camera rotation between two frames as (pan degrees, tilt degrees, response),
+    positive to the right and up. focal is in full-size pixels and tilt_deg is
+    the (approximate) tilt of `before`. The frames are compared in pan/tilt
+    coordinates, so pan is measured exactly at any tilt; tilt to within ~1%.
+    """
+    a, scale = _gray(before)
+    b, _ = _gray(after)
+    focal = focal * scale
+    (dx, dy), response = _correlate(_angular(a, focal, tilt_deg), _angular(b, focal, tilt_deg))
+    return -math.degrees(dx / focal), math.degrees(dy / focal), response
+
+
+def tilt_shift(before, after, focal):
+    """Tilt between two frames in degrees (positive up) and the response, exact for a pure tilt."""
+    a, scale = _gray(before)
+    b, _ = _gray(after)
+    focal = focal * scale
+    (_, dy), response = _correlate(_vertical_cylinder(a, focal), _vertical_cylinder(b, focal))
+    return math.degrees(dy / focal), response
+
+
+def image_scale(before, after):
+    """Zoom of `after` relative to `before` (> 1 when zoomed in), as (scale, response)."""
+    a, _ = _gray(before)
+    b, _ = _gray(after)
+    height, width = a.shape
+    center = (width / 2, height / 2)
+    max_radius = min(center)
+    size = (512, 512)  # log-radius x angle
+    flags = cv2.INTER_LINEAR + cv2.WARP_POLAR_LOG
+    polar_a = cv2.warpPolar(a, size, center, max_radius, flags)
+    polar_b = cv2.warpPolar(b, size, center, max_radius, flags)
+    (shift, _), response = cv2.phaseCorrelate(polar_a, polar_b)
+    return math.exp(shift * math.log(max_radius) / size[0]), response
+
+
+def focal_px(size_px, fov_deg):
+    return (size_px / 2) / math.tan(math.radians(fov_deg) / 2)
+
+
+class Calibration:
+    """Measured motion rates of one camera, as loaded by PTZCommands."""
+
+    def __init__(self, hfov_deg=DEFAULT_HFOV_DEG, frame_size=None, rates=None, zoom=None, created=None):
+        self.hfov_deg = hfov_deg
+        self.frame_size = tuple(frame_size) if frame_size else None
+        # {"pan": [{"speed", "zoom", "deg_per_s", "offset_deg"}, ...], "tilt": [...]}
+        self.rates = rates or {"pan": [], "tilt": []}
+        # {"full_range_s": ..., "magnification": [[level, magnification], ...]}
+        self.zoom = zoom
+        self.created = created or datetime.now().isoformat()
+
+    @classmethod
+    def load(cls, path):
+        """Calibration saved at path, or None if there is none yet."""
+        try:
+            with open(path, "r") as f:
+                return cls(**json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def to_dict(self):
+        return {
+            "hfov_deg": self.hfov_deg,
+            "frame_size": list(self.frame_size) if self.frame_size else None,
+            "rates": self.rates,
+            "zoom": self.zoom,
+            "created": self.created,
+        }
+
+    def add_rate(self, axis, speed, zoom, deg_per_s, offset_deg):
+        samples = [s for s in self.rates.setdefault(axis, []) if (s["speed"], s["zoom"]) != (speed, zoom)]
+        samples.append({"speed": speed, "zoom": zoom, "deg_per_s": deg_per_s, "offset_deg": offset_deg})
+        self.rates[axis] = sorted(samples, key=lambda s: (s["speed"], s["zoom"]))
+
+    def rate(self, axis, speed, zoom):
+        """
+        (degrees per second, offset degrees) for axis at speed and zoom level,
+        interpolated between the calibrated ones, or None if axis isn't calibrated.
+        Outside the calibrated speeds the rate is scaled linearly from the nearest.
+        """
+        samples = self.rates.get(axis)
+        if not samples:
+            return None
+        by_speed = {}
+        for sample in samples:
+            by_speed.setdefault(sample["speed"], []).append(sample)
+
+        def at_zoom(group):
+            zooms = [s["zoom"] for s in group]
+            return (float(np.interp(zoom, zooms, [s["deg_per_s"] for s in group])),
+                    float(np.interp(zoom, zooms, [s["offset_deg"] for s in group])))
+
+        speeds = sorted(by_speed)
+        if speed <= speeds[0] or speed >= speeds[-1]:
+            nearest = speeds[0] if speed <= speeds[0] else speeds[-1]
+            rate, offset = at_zoom(by_speed[nearest])
+            return rate * speed / nearest, offset
+        high = bisect.bisect_left(speeds, speed)
+        low = high - 1
+        fraction = (speed - speeds[low]) / (speeds[high] - speeds[low])
+        (rate_low, offset_low), (rate_high, offset_high) = at_zoom(by_speed[speeds[low]]), at_zoom(by_speed[speeds[high]])
+        return rate_low + fraction * (rate_high - rate_low), offset_low + fraction * (offset_high - offset_low)
+
+    def zoom_rate(self):
+        """Zoom levels per second, or None if zoom isn't calibrated."""
+        if not self.zoom:
+            return None
+        return 1.0 / self.zoom["full_range_s"]
+
+    def magnification(self, zoom):
+        if not self.zoom:
+            return 1.0
+        levels, magnifications = zip(*self.zoom["magnification"])
+        return float(np.interp(zoom, levels, magnifications))
+
+    def fov(self, zoom=0.0):
+        """(horizontal, vertical) field of view in degrees at a zoom level."""
+        width, height = self.frame_size or (16, 9)
+        half_h = math.tan(math.radians(self.hfov_deg) / 2) / self.magnification(zoom)
+        return math.degrees(2 * math.atan(half_h)), math.degrees(2 * math.atan(half_h * height / width))
+
+
+def _timed_move(control, start, duration):
+    # Same sequence as the timed moves in PTZCommands, so their lag is what gets measured
+    start()
+    interrupted = control.interrupted.wait(duration)
+    control.stop_ptz()
+    if interrupted:
+        raise ptz_commands.MotionPreempted("Calibration interrupted")
+    control.wait_settled()
+
+
+def calibrate_zoom(control, grab, log=print):
+    """Step the zoom across its range. Returns the calibration's "zoom" entry; ends at the wide end."""
+    full_range = ptz_commands.MAX_ZOOM_LEVEL - ptz_commands.MIN_ZOOM_LEVEL
+    control.rel_zoom(-1.2 * full_range)
+    control.wait_settled()
+    rate, _ = control.axis_rate('zoom')
+    step_s = full_range / rate / ZOOM_STEPS
+
+    previous = grab()
+    elapsed, magnification = 0.0, 1.0
+    steps = [(0.0, 1.0)]
+    step_scales = []
+    for _ in range(ZOOM_STEPS * 3):
+        _timed_move(control, control.zoom_in, step_s)
+        frame = grab()
+        scale, response = image_scale(previous, frame)
+        if scale < MIN_ZOOM_STEP_SCALE or response < MIN_RESPONSE:
+            break
+        elapsed += step_s
+        magnification *= scale
+        steps.append((elapsed, magnification))
+        step_scales.append(scale)
+        previous = frame
+    if len(step_scales) < 2:
+        raise CalibrationError("Zoom did not change the image")
+
+    # The step that hit the end stop only zoomed for part of its time
+    typical = float(np.median([math.log(s) for s in step_scales[:-1]]))
+    last = math.log(step_scales[-1])
+    if last < 0.9 * typical:
+        elapsed -= step_s * (1 - last / typical)
+        steps[-1] = (elapsed, steps[-1][1])
+    log(f"Zoom: full range in {elapsed:.2f} s, {magnification:.2f}x")
+
+    control.rel_zoom(-1.2 * full_range)
+    control.est_zoom_level = ptz_commands.MIN_ZOOM_LEVEL
+    return {
+        "full_range_s": elapsed,
+        "magnification": [[t / elapsed, m] for t, m in steps],
+    }
+
+
+def calibrate_axis(control, grab, calibration, axis, speed, zoom, tilt_deg, log=print):
+    """Fit (degrees per second, offset degrees) for pan or tilt at the current speed and zoom."""
+    width, height = calibration.frame_size
+    hfov, vfov = calibration.fov(zoom)
+    focal = focal_px(width, hfov)
+    if axis == 'pan':
+        fov, directions = hfov, (control.pan_right, control.pan_left)
+    else:
+        fov, directions = vfov, (control.tilt_down, control.tilt_up)
+    # Guess from the current model, scaled to this speed, so the moves stay within one frame
+    default_rate = {'pan': ptz_commands.pan_speed_degps, 'tilt': ptz_commands.tilt_speed_degps}[axis]
+    guess = default_rate * speed / ptz_commands.DEFAULT_PT_SPEED
+    short = TARGET_SHIFT * fov / guess
+
+    times, angles = [], []
+    for duration in (short, 2 * short):
+        for start in directions:
+            before = grab()
+            _timed_move(control, start, duration)
+            after = grab()
+            if axis == 'pan':
+                angle, _, response = angle_shift(before, after, focal, tilt_deg)
+            else:
+                angle, response = tilt_shift(before, after, focal)
+            if response < MIN_RESPONSE:
+                log(f"    {axis} {duration:.2f} s: frames don't match (response {response:.3f}), skipped")
+                continue
+            times.append(duration)
+            angles.append(abs(angle))
+    if len(set(times)) < 2:
+        raise CalibrationError(f"Could not measure {axis} moves at speed {speed}, zoom {zoom}")
+    rate, offset = np.polyfit(times, angles, 1)
+    log(f"{axis.capitalize()} at speed {speed}, zoom {zoom}: {rate:.2f} deg/s (offset {offset:+.2f} deg)")
+    return float(rate), float(offset)
+
+
+def calibrate(control, grab, hfov_deg=DEFAULT_HFOV_DEG, speeds=(ptz_commands.DEFAULT_PT_SPEED,),
+              zoom_levels=(0.0,), position=CALIBRATION_POSITION, log=print):
+    """
+    Calibrate the camera driven by PTZCommands `control`, grabbing frames with
+    grab(). Zoom first, then pan and tilt at each zoom level and speed, from
+    `position`. Returns a Calibration, which `control` is also switched to.
+    """
+    frame = grab()
+    calibration = Calibration(hfov_deg, frame_size=(frame.shape[1], frame.shape[0]))
+    previous_speed, previous_calibration = control.pt_speed, control.calibration
+    try:
+        calibration.zoom = calibrate_zoom(control, grab, log)
+        control.calibration = calibration
+        control.abs_pantilt(position)
+        for zoom in zoom_levels:
+            control.abs_zoom(zoom)
+            control.wait_settled()
+            for speed in speeds:
+                control.pt_speed = speed
+                for axis in ('pan', 'tilt'):
+                    rate, offset = calibrate_axis(control, grab, calibration, axis, speed, zoom, position[1], log)
+                    calibration.add_rate(axis, speed, zoom, rate, offset)
+    except Exception:
+        control.calibration = previous_calibration
+        raise
+    finally:
+        control.pt_speed = previous_speed
+    control.abs_zoom(ptz_commands.MIN_ZOOM_LEVEL)
+    return calibration
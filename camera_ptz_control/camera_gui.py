@@ -2,26 +2,38 @@ import threading
 import os
 import time
 import cv2
+import numpy as np
 from tkinter import Tk, Label, Button
 from PIL import Image, ImageTk
 from ptz_commands import PTZCommands
+from plate_tracker import PlateTracker
+from streams import LatestFrame
+
+DISPLAY_FPS = 15
 
 
 class CameraGUI(PTZCommands):
-    def __init__(self, master, cap, plate_cascade, reader, extract_plate, show_plate_roi, dynamodb, onvif_camera=None):
+    def __init__(self, master, cap, plate_cascade, reader, extract_plate, show_plate_roi, dynamodb, onvif_camera=None, detection_region=None, streams=None, display_fps=DISPLAY_FPS):
         self.master = master
         self.cap = cap
+        self.streams = streams  # StreamManager for full-resolution stills; None takes them from cap
+        # cap is read on its own thread; the preview shows its newest frame display_fps times a second
+        self.frames = LatestFrame(cap)
+        self.display_interval_ms = max(1, round(1000 / display_fps))
+        self._shown = None      # (frame, width, detection) on screen, to skip redrawing it
+        self._display = None    # display-size BGR and RGB buffers, reused while the size stays
+        self._rgb = None
+        self._photo = None
         self.plate_cascade = plate_cascade
         self.reader = reader
         self.extract_plate = extract_plate
         self.show_plate_roi = show_plate_roi
         self.dynamodb = dynamodb
         self.onvif_camera = onvif_camera
+        self.detection_region = detection_region
         self.ptz = None
         self.media = None
         self.profile = None
-        self.est_pan_angle_deg = 0
-        self.est_tilt_angle_deg = 0
         if self.onvif_camera:
             try:
                 self.ptz = self.onvif_camera.create_ptz_service()
@@ -32,6 +44,9 @@ class CameraGUI(PTZCommands):
                 self.ptz = None
                 self.media = None
                 self.profile = None
+        PTZCommands.__init__(self, self.ptz, self.profile)
+        self.est_pan_angle_deg = 0
+        self.est_tilt_angle_deg = 0
         self.panel = Label(master)
         self.panel.pack()
         # Crosshair layout for PTZ controls with Stop on release
@@ -98,6 +113,7 @@ class CameraGUI(PTZCommands):
         self.last_detection_time = 0
         self.plates = []
         self.plate_texts = []
+        self.plate_tracker = PlateTracker()
         from tkinter import Entry
         angle_frame = Frame(master)
         angle_frame.pack(pady=5)
@@ -130,45 +146,72 @@ class CameraGUI(PTZCommands):
         self.tilt_angle_entry.insert(0, f"{self.est_tilt_angle_deg:.2f}")
 
     def update_frame(self):
-        ret, frame = self.cap.read()
-        if not ret:
-            self.master.after(20, self.update_frame)
+        self.master.after(self.display_interval_ms, self.update_frame)
+        seq, frame = self.frames.get()
+        if frame is None:
             return
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         current_time = time.time()
         if current_time - self.last_detection_time >= 1.0:
-            self.plates = self.plate_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+            if self.detection_region is not None:
+                # Only scan the preset's road area, at the expected plate sizes
+                self.plates = self.detection_region.detect(self.plate_cascade, frame)
+            else:
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                self.plates = self.plate_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+            tracks = self.plate_tracker.update(self.plates, current_time)
             self.plate_texts = []
-            for (x, y, w, h) in self.plates:
-                roi = gray[y:y+h, x:x+w]
-                roi = cv2.resize(roi, (0, 0), fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
-                plate_text = self.reader.readtext(roi, detail=0, allowlist='BCDFGHJKLMNPQRSTVWXYZ0123456789')
-                plate_text = ' '.join(plate_text).strip()
-                valid_plate = self.extract_plate(plate_text)
-                self.plate_texts.append(valid_plate)
-                if valid_plate:
-                    output_path = os.path.join('output', f'{valid_plate}.jpg')
-                    cv2.imwrite(output_path, roi)
-                    print(f"Saved detected plate image to {output_path}")
-                    self.dynamodb.save_plate_to_db(valid_plate)
+            for (x, y, w, h), track in zip(self.plates, tracks):
+                # OCR only a few times per tracked car, reads are voted when the track ends
+                if self.plate_tracker.needs_ocr(track):
+                    roi = cv2.cvtColor(frame[y:y+h, x:x+w], cv2.COLOR_BGR2GRAY)
+                    roi = cv2.resize(roi, (0, 0), fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+                    plate_text = self.reader.readtext(roi, detail=0, allowlist='BCDFGHJKLMNPQRSTVWXYZ0123456789')
+                    plate_text = ' '.join(plate_text).strip()
+                    track.add_read(self.extract_plate(plate_text), roi)
+                self.plate_texts.append(track.vote()[0])
+            self.save_finished_tracks(self.plate_tracker.pop_finished())
             self.last_detection_time = current_time
+        # Use selected resolution for display, never above the stream's own
+        width = min(self.current_resolution, frame.shape[1])
+        shown = (seq, width, self.last_detection_time)
+        if shown == self._shown:
+            return
+        self._shown = shown
+        size = (width, int(frame.shape[0] * width / frame.shape[1]))
+        if self._display is None or self._display.shape[:2] != (size[1], size[0]):
+            self._display = np.empty((size[1], size[0], 3), np.uint8)
+            self._rgb = np.empty_like(self._display)
+            self._photo = None
+        # Overlays are drawn on the display copy, so the shared frame stays untouched
+        cv2.resize(frame, size, dst=self._display, interpolation=cv2.INTER_AREA)
+        scale = width / frame.shape[1]
         for idx, (x, y, w, h) in enumerate(self.plates):
-            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
             self.show_plate_roi(frame, x, y, w, h)
+            x, y, w, h = (round(v * scale) for v in (x, y, w, h))
+            cv2.rectangle(self._display, (x, y), (x+w, y+h), (0, 255, 0), 2)
             if idx < len(self.plate_texts):
                 plate_text = self.plate_texts[idx]
                 if plate_text:
-                    cv2.putText(frame, plate_text, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+                    cv2.putText(self._display, plate_text, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
                     print(f"Detected Plate: {plate_text}")
-        # Use selected resolution for display
-        width = self.current_resolution
-        frame = cv2.resize(frame, (width, int(frame.shape[0] * width / frame.shape[1])))
-        img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(img)
-        imgtk = ImageTk.PhotoImage(image=img)
-        self.panel.imgtk = imgtk
-        self.panel.config(image=imgtk)
-        self.master.after(20, self.update_frame)
+        cv2.cvtColor(self._display, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        img = Image.fromarray(self._rgb)
+        if self._photo is None:
+            self._photo = ImageTk.PhotoImage(image=img)
+            self.panel.config(image=self._photo)
+        else:
+            # Same size: update the Tk image in place instead of creating a new one
+            self._photo.paste(img)
+
+    def save_finished_tracks(self, finished):
+        for track, plate, confidence in finished:
+            roi = track.best_roi(plate)
+            if roi is not None:
+                output_path = os.path.join('output', f'{plate}.jpg')
+                cv2.imwrite(output_path, roi)
+                print(f"Saved detected plate image to {output_path}")
+            print(f"Track {track.track_id}: {plate} ({len(track.reads)} reads, confidence {confidence:.2f})")
+            self.dynamodb.save_plate_to_db(plate)
 
     def set_pt_speed(self, speed):
         self.pt_speed = speed
@@ -178,7 +221,7 @@ class CameraGUI(PTZCommands):
         if not self.ptz or not self.profile:
             return None
         try:
-            status = self.ptz.GetStatus({'ProfileToken': self.profile.token})
+            status = self.onvif_call('GetStatus', {'ProfileToken': self.profile.token})
             return status.Position.PanTilt.x if hasattr(status.Position.PanTilt, 'x') else None
         except Exception as e:
             print(f"Could not get pan position: {e}")
@@ -188,7 +231,7 @@ class CameraGUI(PTZCommands):
         if not self.ptz or not self.profile:
             return None
         try:
-            status = self.ptz.GetStatus({'ProfileToken': self.profile.token})
+            status = self.onvif_call('GetStatus', {'ProfileToken': self.profile.token})
             pan = status.Position.PanTilt.x if hasattr(status.Position.PanTilt, 'x') else 0.0
             tilt = status.Position.PanTilt.y if hasattr(status.Position.PanTilt, 'y') else 0.0
             zoom = status.Position.Zoom.x if hasattr(status.Position.Zoom, 'x') else 0.0
@@ -209,7 +252,7 @@ class CameraGUI(PTZCommands):
             XMIN = ptz_configuration_options.Spaces.AbsolutePanTiltPositionSpace[0].XRange.Min
             YMAX = ptz_configuration_options.Spaces.AbsolutePanTiltPositionSpace[0].YRange.Max
             YMIN = ptz_configuration_options.Spaces.AbsolutePanTiltPositionSpace[0].YRange.Min
-            status = self.ptz.GetStatus({'ProfileToken': self.profile.token})
+            status = self.onvif_call('GetStatus', {'ProfileToken': self.profile.token})
             XNOW = status.Position.PanTilt.x
             YNOW = status.Position.PanTilt.y
             Velocity = ptz_configuration_options.Spaces.PanTiltSpeedSpace[0].XRange.Max
@@ -254,19 +297,31 @@ class CameraGUI(PTZCommands):
             'ForcePersistence': False
         })
 
+    def grab_still(self):
+        """Full-resolution frame from the stills stream (the main stream), or from cap without one."""
+        if self.streams is None:
+            frame = self.frames.get()[1]
+            return frame is not None, frame
+        with self.streams.open("stills") as cap:
+            if not cap.isOpened():
+                return False, None
+            return cap.read()
+
+    def save_still(self, filename, label="Picture"):
+        """Grab a still and write it to filename, off the Tk thread since connecting to the main stream takes a moment."""
+        def save():
+            ret, frame = self.grab_still()
+            if not ret:
+                print("Failed to capture image from camera.")
+                return
+            cv2.imwrite(filename, frame)
+            print(f"{label} saved to {filename} at {frame.shape[1]}x{frame.shape[0]}")
+        threading.Thread(target=save, daemon=True).start()
+
     def take_picture(self):
-        ret, frame = self.cap.read()
-        if not ret:
-            print("Failed to capture image from camera.")
-            return
-        # Save at 3840x2160 regardless of GUI stream resolution
-        target_width, target_height = 3840, 2160
-        frame_highres = cv2.resize(frame, (target_width, target_height), interpolation=cv2.INTER_CUBIC)
         from datetime import datetime
         os.makedirs('output/pictures', exist_ok=True)
-        filename = datetime.now().strftime('output/pictures/%Y%m%d_%H%M%S.jpg')
-        cv2.imwrite(filename, frame_highres)
-        print(f"Picture saved to {filename} at 3840x2160")
+        self.save_still(datetime.now().strftime('output/pictures/%Y%m%d_%H%M%S.jpg'))
 
     def start_stopmotion(self):
         if self.stopmotion_running:
@@ -283,14 +338,8 @@ class CameraGUI(PTZCommands):
     def _stopmotion_loop(self):
         if not self.stopmotion_running:
             return
-        ret, frame = self.cap.read()
-        if ret:
-            from datetime import datetime
-            filename = datetime.now().strftime(f'{self.stopmotion_folder}/pictures/%Y%m%d_%H%M%S.jpg')
-            # Save at 3840x2160
-            frame_highres = cv2.resize(frame, (3840, 2160), interpolation=cv2.INTER_CUBIC)
-            cv2.imwrite(filename, frame_highres)
-            print(f"Stopmotion frame saved to {filename}")
+        from datetime import datetime
+        self.save_still(datetime.now().strftime(f'{self.stopmotion_folder}/pictures/%Y%m%d_%H%M%S.jpg'), "Stopmotion frame")
         self.master.after(3000, self._stopmotion_loop)
 
     def stop_stopmotion(self):
@@ -308,9 +357,12 @@ class CameraGUI(PTZCommands):
     def refresh_ptz_status(self):
         self.ptz_status_var.set(self.get_ptz_status_text())
 
-def start_gui(cap, plate_cascade, reader, extract_plate, show_plate_roi, dynamodb, onvif_camera=None):
+def start_gui(cap, plate_cascade, reader, extract_plate, show_plate_roi, dynamodb, onvif_camera=None, detection_region=None, streams=None, display_fps=DISPLAY_FPS):
     root = Tk()
     root.title("License Plate Detection")
-    CameraGUI(root, cap, plate_cascade, reader, extract_plate, show_plate_roi, dynamodb, onvif_camera)
+    gui = CameraGUI(root, cap, plate_cascade, reader, extract_plate, show_plate_roi, dynamodb, onvif_camera, detection_region, streams, display_fps)
     root.mainloop()
+    gui.frames.stop()
+    # Persist cars still in view when the window is closed
+    gui.save_finished_tracks(gui.plate_tracker.flush())
 
@@ -0,0 +1,330 @@
+"""
+Camera registry: one Camera per configured camera, each with its own frame
+grabber, motion executor, preset store and pictures path, so several cameras
+are served from one process.
+
+Cameras come from the "cameras" list in environ.json (the add-on's "cameras"
+option):
+
+    "cameras": [
+        {"id": "patio", "camera_ip": "192.168.1.139"},
+        {"id": "garage", "camera_ip": "192.168.1.140", "password": "...", "onvif_port": 80}
+    ]
+
+Without that list, a single camera is built from the top-level camera_ip, pw,
+pictures_path and locations.json, as before.
+
+Stored pictures are read from the camera's main stream and everything else
+from its substream; see streams.py for choosing the streams per consumer.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import os
+import subprocess
+import threading
+
+import cv2
+from fastapi import HTTPException
+
+from calibration import DEFAULT_HFOV_DEG, Calibration
+import metrics
+from motion import MotionActor
+from onvif_transport import make_transport
+from picture_index import PictureIndex, dhash
+from picture_store import DEFAULT_LAYOUT, PictureStore, parse_name
+from presets import PresetStore
+from ptz_commands import PTZCommands
+import relocalize
+from scene_change import SceneTracker
+import stability
+from streams import StreamManager
+
+DEFAULT_CAMERA_ID = "default"
+DEFAULT_CAMERA_IP = "192.168.1.139"
+DEFAULT_PICTURES_PATH = "/config/pictures/cam_api"
+ONVIF_PORT = 8080
+RTSP_PORT = 554
+
+# Pictures saved in the background while the capture response is already on its way
+_picture_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="picture-writer")
+_pending_writes = 0
+_pending_lock = threading.Lock()
+
+
+def find_wsdl_dir():
+    """First directory in the expected locations that holds devicemgmt.wsdl."""
+    possible_wsdl_paths = [
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wsdl'),
+        '/app/wsdl',
+        'wsdl'
+    ]
+    for path in possible_wsdl_paths:
+        print(f"Checking WSDL path: {path}")
+        if os.path.exists(path):
+            print(f"Found WSDL directory at: {path}")
+            # Verify that devicemgmt.wsdl exists
+            if os.path.exists(os.path.join(path, 'devicemgmt.wsdl')):
+                return path
+            print(f"devicemgmt.wsdl not found in {path}")
+        else:
+            print(f"Directory not found: {path}")
+    raise Exception("WSDL directory with required files not found in any of the expected locations")
+
+
+class Camera:
+    def __init__(self, camera_id, ip, pw, pictures_path, locations_path, onvif_port=ONVIF_PORT, rtsp_url=None,
+                 calibration_path="calibration.json", hfov_deg=DEFAULT_HFOV_DEG, references_path="references",
+                 pictures_layout=DEFAULT_LAYOUT, pictures_ignore=(), stream_paths=None, stream_consumers=None, stream_hold_s=0.0):
+        self.id = camera_id
+        self.ip = ip
+        self.pw = pw
+        self.onvif_port = onvif_port
+        # A single rtsp_url is read by every consumer, as before stream profiles
+        self.streams = (StreamManager.single(rtsp_url) if rtsp_url else
+                        StreamManager(self.rtsp_url, stream_paths, stream_consumers, stream_hold_s))
+        self.pictures_path = pictures_path
+        self.pictures = PictureStore(pictures_path, pictures_layout, pictures_ignore)
+        self.index = PictureIndex(self.pictures)
+        self.scenes = SceneTracker(self.index)
+        self.presets = PresetStore(locations_path)
+        self.references = relocalize.ReferenceStore(references_path)
+        self.calibration_path = calibration_path
+        self.hfov_deg = hfov_deg
+        self.ptz_control = None
+        # Moves and captures of one camera run one at a time, in order;
+        # each camera has its own thread so cameras don't wait for each other
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"camera-{camera_id}")
+        self._queued = 0  # work items queued or running on the executor
+        self._queued_lock = threading.Lock()
+        # All PTZ moves go through the motion actor (see motion.py)
+        self.motion = MotionActor(self)
+
+    def rtsp_url(self, path):
+        """RTSP URL of one of the camera's stream paths, e.g. "11"."""
+        return f"rtsp://admin:{self.pw}@{self.ip}:{RTSP_PORT}/{path}"
+
+    @property
+    def busy(self):
+        """Work queued or running on this camera, captures and moves."""
+        return self._queued + self.motion.pending()
+
+    def submit(self, fn, *args):
+        """Run blocking work on this camera's executor from any thread. Returns a concurrent future."""
+        # Carry the request trace over to the executor thread
+        context = contextvars.copy_context()
+        with self._queued_lock:
+            self._queued += 1
+        future = self._executor.submit(context.run, fn, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._queued_lock:
+            self._queued -= 1
+
+    def run(self, fn, *args):
+        """Run blocking work on this camera's executor. Returns an awaitable."""
+        return asyncio.wrap_future(self.submit(fn, *args))
+
+    def connect(self):
+        """Connect over ONVIF and set up PTZ control."""
+        from onvif import ONVIFCamera
+        print(f"[{self.id}] Connecting to camera at {self.ip}...")
+        try:
+            wsdl_path = find_wsdl_dir()
+            print(f"Using WSDL directory: {wsdl_path}")
+            cam = ONVIFCamera(self.ip, self.onvif_port, 'admin', self.pw, wsdl_dir=wsdl_path, transport=make_transport())
+            print(f"[{self.id}] Camera connection established")
+        except Exception as e:
+            print(f"[{self.id}] Failed to connect to camera using ONVIF: {str(e)}")
+            print(f"Pinging {self.ip}...")
+
+            # Use ping command compatible with both Windows and Linux
+            if os.name == 'nt':  # Windows
+                ping_cmd = ["ping", "-n", "1", "-w", "2000", self.ip]
+            else:  # Linux/Unix
+                ping_cmd = ["ping", "-c", "1", "-W", "2", self.ip]
+
+            ping = subprocess.run(ping_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if ping.returncode != 0:
+                raise HTTPException(status_code=503, detail="Camera is not reachable")
+            raise HTTPException(status_code=500, detail=f"Failed to connect to camera, although it is reachable. Error: {str(e)}")
+
+        # Create media service object
+        print(f"[{self.id}] Creating media service...")
+        media = cam.create_media_service()
+
+        # Create ptz service object
+        print(f"[{self.id}] Creating PTZ service...")
+        ptz = cam.create_ptz_service()
+
+        # Get target profile
+        print(f"[{self.id}] Getting media profile...")
+        media_profile = media.GetProfiles()[0]
+
+        # Initialize PTZ control, with the measured speeds if the camera has been calibrated
+        calibration = Calibration.load(self.calibration_path)
+        if calibration:
+            print(f"[{self.id}] Using calibration from {calibration.created}")
+        self.ptz_control = PTZCommands(ptz, media_profile, calibration=calibration)
+        print(f"[{self.id}] PTZ control initialized successfully")
+
+    def start(self):
+        """Connect, then go origin + go home."""
+        self.connect()
+        self.motion.call(self._home).result()
+
+    def _home(self):
+        self.ptz_control.hard_origin(blocking=True)
+        self.ptz_control.go_home()
+
+    def position(self):
+        return {
+            "pan": self.ptz_control.est_pan_angle_deg,
+            "tilt": self.ptz_control.est_tilt_angle_deg,
+            "zoom": self.ptz_control.est_zoom_level
+        }
+
+    def relocalize(self, name):
+        """
+        Check the view at preset `name` against its reference image, correcting the
+        estimate and position. Call while zoomed out at the preset's pan/tilt.
+        """
+        with metrics.stage("relocalize"):
+            self.ptz_control.wait_settled()
+            return relocalize.relocalize(self.ptz_control, lambda: self.grab_frame(consumer="analysis")[0], self.references,
+                                         name, self.presets[name], self.hfov_deg)
+
+    def store_reference(self, name):
+        """Take the reference image for preset `name` from the current pan/tilt, zoomed out."""
+        zoom = self.ptz_control.est_zoom_level
+        self.ptz_control.abs_zoom(0)
+        try:
+            self.ptz_control.wait_settled()
+            self.references.save(name, self.grab_frame(consumer="analysis")[0])
+        finally:
+            self.ptz_control.abs_zoom(zoom)
+            self.ptz_control.wait_settled()
+
+    def grab_frame(self, stable=False, max_wait=stability.MAX_WAIT_S, consumer="stills"):
+        """
+        Read one frame from the consumer's RTSP stream (the main stream for stills).
+        With stable=True, keep reading until the image stops changing (up to max_wait
+        seconds). Returns (frame, stability stats or None).
+        """
+        with self.streams.open(consumer) as cap:
+            if not cap.isOpened():
+                metrics.FRAMES_DROPPED.inc()
+                raise HTTPException(status_code=503, detail="Could not connect to camera")
+            stats = None
+            if stable:
+                with metrics.stage("stabilize"):
+                    frame, stats = stability.wait_for_stable(cap.read, max_wait)
+                ret = frame is not None
+                print(f"Image {'stable' if stats['stable'] else 'not stable'} after {stats['waited_ms']} ms ({stats['frames']} frames)")
+            else:
+                with metrics.stage("grab"):
+                    ret, frame = cap.read()
+            if not ret:
+                metrics.FRAMES_DROPPED.inc()
+                raise HTTPException(status_code=500, detail="Could not capture image")
+            metrics.FRAMES_CAPTURED.inc()
+            return frame, stats
+
+    def encode_frame(self, frame):
+        """JPEG bytes of a frame, as stored."""
+        with metrics.stage("encode"):
+            ok, encoded = cv2.imencode(".jpg", frame)
+        if not ok:
+            raise HTTPException(status_code=500, detail="Could not encode image")
+        return encoded.tobytes()
+
+    def save_frame(self, frame, filename, encoded=None):
+        """Write a frame as JPEG (encoded: its bytes, if already encoded) under the camera's pictures path."""
+        if encoded is None:
+            encoded = self.encode_frame(frame)
+        with metrics.stage("write"):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "wb") as f:
+                f.write(encoded)
+        parsed = parse_name(os.path.basename(filename))
+        if parsed:
+            # A failed index update only costs the picture's near-duplicate lookups, not the capture
+            try:
+                with metrics.stage("hash"):
+                    self.index.add(parsed[1], parsed[0], dhash(frame))
+            except Exception as e:
+                print(f"[{self.id}] Could not index {filename}: {e}")
+
+    def save_frame_async(self, frame, filename, encoded=None):
+        """save_frame on a background writer, so the caller doesn't wait for the encode and write."""
+        global _pending_writes
+        with _pending_lock:
+            _pending_writes += 1
+            metrics.WRITER_QUEUE_DEPTH.labels("pictures").set(_pending_writes)
+        future = _picture_writer.submit(contextvars.copy_context().run, self.save_frame, frame, filename, encoded)
+        future.add_done_callback(lambda f: self._saved(f, filename))
+        return future
+
+    def _saved(self, future, filename):
+        global _pending_writes
+        with _pending_lock:
+            _pending_writes -= 1
+            metrics.WRITER_QUEUE_DEPTH.labels("pictures").set(_pending_writes)
+        if future.exception():
+            print(f"[{self.id}] Could not save {filename}: {getattr(future.exception(), 'detail', future.exception())}")
+
+
+class CameraRegistry:
+    def __init__(self, cameras, default_id=None):
+        self._cameras = {camera.id: camera for camera in cameras}
+        self.default_id = default_id or cameras[0].id
+        if self.default_id not in self._cameras:
+            raise ValueError(f"Default camera '{self.default_id}' is not configured")
+
+    def __iter__(self):
+        return iter(self._cameras.values())
+
+    def __len__(self):
+        return len(self._cameras)
+
+    def ids(self):
+        return list(self._cameras.keys())
+
+    def get(self, camera_id=None):
+        """Camera by id, or the default camera. Raises KeyError for unknown ids."""
+        return self._cameras[camera_id or self.default_id]
+
+
+def load_cameras(environ):
+    """Build the registry from environ.json (see module docstring)."""
+    pw = environ.get("pw", "admin")
+    pictures_path = environ.get("pictures_path", DEFAULT_PICTURES_PATH)
+    pictures_layout = environ.get("pictures_layout", DEFAULT_LAYOUT)
+    configs = environ.get("cameras") or [{"id": DEFAULT_CAMERA_ID, "camera_ip": environ.get("camera_ip", DEFAULT_CAMERA_IP)}]
+
+    cameras = []
+    for i, config in enumerate(configs):
+        camera_id = str(config.get("id", f"camera{i + 1}"))
+        first = i == 0
+        cameras.append(Camera(
+            camera_id,
+            config.get("camera_ip", DEFAULT_CAMERA_IP),
+            config.get("pw", config.get("password", pw)),
+            # The first camera keeps the single-camera paths so existing pictures and presets are picked up
+            config.get("pictures_path", pictures_path if first else os.path.join(pictures_path, camera_id)),
+            config.get("locations_path", "locations.json" if first else f"locations_{camera_id}.json"),
+            onvif_port=config.get("onvif_port", ONVIF_PORT),
+            rtsp_url=config.get("rtsp_url"),
+            calibration_path=config.get("calibration_path", "calibration.json" if first else f"calibration_{camera_id}.json"),
+            hfov_deg=config.get("hfov_deg", environ.get("hfov_deg", DEFAULT_HFOV_DEG)),
+            references_path=config.get("references_path", "references" if first else f"references_{camera_id}"),
+            pictures_layout=config.get("pictures_layout", pictures_layout),
+            # The other cameras' default pictures folders sit inside the first camera's
+            pictures_ignore=[str(c.get("id", f"camera{j + 1}")) for j, c in enumerate(configs) if j] if first else (),
+            stream_paths={**environ.get("stream_paths", {}), **config.get("stream_paths", {})},
+            stream_consumers={**environ.get("stream_consumers", {}), **config.get("stream_consumers", {})},
+            stream_hold_s=config.get("stream_hold_s", environ.get("stream_hold_s", 0.0)),
+        ))
+    return CameraRegistry(cameras, environ.get("default_camera"))
@@ -9,14 +9,23 @@ pw = environ.get("pw", "admin")
 # cam_ip = environ.get("camera_ip", "192.168.1.139")
 cam_ip="192.168.1.139"
 
-url = f"rtsp://admin:{pw}@{cam_ip}:554/12"
-cap = cv2.VideoCapture(url)
+from streams import StreamManager
 
-def get_cap(source:str):
+# Preview and detection on the substream, stills from the main stream (see streams.py).
+# The main stream stays connected a while after a still, for stop-motion sequences.
+streams = StreamManager(
+    lambda path: f"rtsp://admin:{pw}@{cam_ip}:554/{path}",
+    environ.get("stream_paths"),
+    environ.get("stream_consumers"),
+    environ.get("stream_hold_s", 10),
+)
+url = streams.url("preview")
+
+def get_cap(source:str, consumer:str="preview"):
     if source=='webcam':
         cap = cv2.VideoCapture(0)
     elif source=='rtsp':
-        cap = cv2.VideoCapture(url)
+        cap = cv2.VideoCapture(streams.url(consumer))
     else:
         raise ValueError("Invalid source. Use 'webcam' or 'rtsp'.")
-    return cap
\ No newline at end of file
+    return cap
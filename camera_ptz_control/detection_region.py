@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+
+# Window size the plate cascade was trained with (haarcascade_russian_plate_number.xml)
+CASCADE_WINDOW = (60, 20)
+
+
+class DetectionRegion:
+    """
+    Where and at which size plates can appear for a preset.
+
+    Stored optionally per preset in locations.json, in pixels of the detection
+    stream:
+
+        "detection": {
+            "polygon": [[x, y], ...],
+            "min_plate": [w, h],
+            "max_plate": [w, h]
+        }
+
+    The cascade then only scans the polygon's bounding box, downscaled so the
+    smallest expected plate matches the cascade window, with minSize/maxSize
+    limiting the scales searched.
+    """
+
+    def __init__(self, polygon=None, min_plate=None, max_plate=None, cascade_window=CASCADE_WINDOW):
+        self.polygon = np.array(polygon, dtype=np.int32) if polygon else None
+        self.min_plate = tuple(min_plate) if min_plate else None
+        self.max_plate = tuple(max_plate) if max_plate else None
+        self.cascade_window = cascade_window
+
+    @classmethod
+    def from_preset(cls, preset):
+        """Build the region stored in a preset, or None if the preset has none."""
+        detection = (preset or {}).get("detection")
+        if not detection:
+            return None
+        return cls(detection.get("polygon"), detection.get("min_plate"), detection.get("max_plate"))
+
+    def scale(self):
+        """
+        Downscale factor mapping the smallest expected plate onto the cascade window.
+        The plate must still cover the window on both axes, so the axis that
+        needs the larger factor sets it.
+        """
+        if not self.min_plate:
+            return 1.0
+        return min(1.0, max(self.cascade_window[0] / self.min_plate[0], self.cascade_window[1] / self.min_plate[1]))
+
+    def crop_box(self, frame_shape):
+        height, width = frame_shape[:2]
+        if self.polygon is None:
+            return 0, 0, width, height
+        x, y, w, h = cv2.boundingRect(self.polygon)
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, width), min(y + h, height)
+        return x0, y0, x1 - x0, y1 - y0
+
+    def detect(self, cascade, frame, scaleFactor=1.1, minNeighbors=5):
+        """
+        Run the cascade on the region of a BGR or grayscale frame.
+        Returns (x, y, w, h) boxes in full-frame coordinates.
+        """
+        x0, y0, w, h = self.crop_box(frame.shape)
+        if w <= 0 or h <= 0:
+            return []
+        crop = frame[y0:y0 + h, x0:x0 + w]
+        if crop.ndim == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+
+        scale = self.scale()
+        if scale < 1.0:
+            crop = cv2.resize(crop, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        kwargs = {}
+        min_size = self.cascade_window
+        if self.min_plate:
+            min_size = (max(int(self.min_plate[0] * scale), self.cascade_window[0]),
+                        max(int(self.min_plate[1] * scale), self.cascade_window[1]))
+            kwargs["minSize"] = min_size
+        if self.max_plate:
+            # Never below minSize, or no scale would be searched at all
+            kwargs["maxSize"] = (max(int(round(self.max_plate[0] * scale)), min_size[0]),
+                                 max(int(round(self.max_plate[1] * scale)), min_size[1]))
+        found = cascade.detectMultiScale(crop, scaleFactor=scaleFactor, minNeighbors=minNeighbors, **kwargs)
+
+        boxes = []
+        for (x, y, bw, bh) in found:
+            box = (int(x / scale) + x0, int(y / scale) + y0, int(bw / scale), int(bh / scale))
+            if self.contains_center(box):
+                boxes.append(box)
+        return boxes
+
+    def contains_center(self, box):
+        if self.polygon is None:
+            return True
+        x, y, w, h = box
+        return cv2.pointPolygonTest(self.polygon, (x + w / 2, y + h / 2), False) >= 0
@@ -1,34 +1,100 @@
 import boto3
+from boto3.dynamodb.conditions import Key
 from datetime import datetime, timedelta
 import uuid
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('matriculas')
+from plate_cache import PlateCache
+from plate_writer import PlateWriter
+
+TABLE_NAME = 'matriculas'
+DEDUPE_PERIOD_S = 60
+
+_table = None
+_writer = None
+_writer_options = {}
+plate_cache = PlateCache(max_size=1024, ttl_s=DEDUPE_PERIOD_S)
+
+def get_table():
+    """Return the DynamoDB table, connecting on first use."""
+    global _table
+    if _table is None:
+        _table = boto3.resource('dynamodb').Table(TABLE_NAME)
+    return _table
+
+def set_table(table):
+    """Use another table object, e.g. a local stub exposing query/put_item/batch_writer."""
+    global _table
+    _table = table
+
+def configure_cache(max_size=None, ttl_s=None):
+    """Resize the dedupe cache (e.g. from environ.json). Clears cached entries."""
+    global plate_cache
+    plate_cache = PlateCache(
+        max_size=plate_cache.max_size if max_size is None else max_size,
+        ttl_s=plate_cache.ttl_s if ttl_s is None else ttl_s,
+    )
+
+def configure_writer(**options):
+    """Set PlateWriter options (spool_path, max_queue, batch_size...) before the first save."""
+    _writer_options.update(options)
+
+def get_writer():
+    """Return the background plate writer, starting it on first use."""
+    global _writer
+    if _writer is None:
+        _writer = PlateWriter(get_table, is_duplicate=_exists_in_table, **_writer_options)
+        _writer.start()
+    return _writer
+
+def shutdown(timeout=10.0):
+    """Flush queued sightings, spooling whatever can't be written in time."""
+    if _writer is not None:
+        _writer.stop(timeout)
+        print(f"Plate writer stopped: {_writer.stats()}")
 
 def save_plate_to_db(plate_text):
-    plate_id = str(uuid.uuid4())
-    timestamp = datetime.now().isoformat()
-
-    if not check_plate_exists(plate_text, period_s=60):
-        print(f"Plate {plate_text} does not exist in the database, saving it.")
-        table.put_item(Item={
-            'id_matricula': plate_id,
-            'texto_matricula': plate_text,
-            'timestamp': timestamp
-        })
-    else:
-        print(f"Skip {plate_text} (detected within the last 60 seconds).")
+    """Queue a plate sighting for the background writer. Never waits on DynamoDB."""
+    now = datetime.now()
+
+    if plate_cache.seen_since(plate_text, now - timedelta(seconds=DEDUPE_PERIOD_S)):
+        print(f"Skip {plate_text} (detected within the last {DEDUPE_PERIOD_S} seconds).")
+        return
+    print(f"Plate {plate_text} not seen recently, saving it.")
+    plate_cache.put(plate_text, now)
+    get_writer().submit({
+        'id_matricula': str(uuid.uuid4()),
+        'texto_matricula': plate_text,
+        'timestamp': now.isoformat()
+    })
 
 def check_plate_exists(plate_text, period_s: int):
     """
     Check if a plate exists in the database within a specified period in seconds.
+    Answered from the local cache when possible; DynamoDB is only queried on a miss.
     Returns True if the plate exists, False otherwise.
     """
-    timestamp_limit = (datetime.now() - timedelta(seconds=period_s)).isoformat()
-    response = table.query(
+    since = datetime.now() - timedelta(seconds=period_s)
+    if plate_cache.seen_since(plate_text, since):
+        return True
+    return latest_sighting(plate_text, since) is not None
+
+def latest_sighting(plate_text, since):
+    """Query DynamoDB for the latest sighting of a plate after `since`, or None."""
+    response = get_table().query(
         IndexName='texto_matricula-timestamp-index',
-        KeyConditionExpression=boto3.dynamodb.conditions.Key('texto_matricula').eq(plate_text) &
-                               boto3.dynamodb.conditions.Key('timestamp').gt(timestamp_limit)
+        KeyConditionExpression=Key('texto_matricula').eq(plate_text) &
+                               Key('timestamp').gt(since.isoformat())
     )
-    
-    return len(response['Items']) > 0
\ No newline at end of file
+    items = response['Items']
+    if not items:
+        return None
+    # Remember the latest sighting so the next reads are answered locally
+    latest = max(datetime.fromisoformat(item['timestamp']) for item in items)
+    plate_cache.put(plate_text, latest)
+    return latest
+
+def _exists_in_table(item):
+    # Catches sightings saved by another process or before a restart
+    seen_at = datetime.fromisoformat(item['timestamp'])
+    latest = latest_sighting(item['texto_matricula'], seen_at - timedelta(seconds=DEDUPE_PERIOD_S))
+    return latest is not None and latest != seen_at
@@ -0,0 +1,74 @@
+"""
+Read-ahead image loader for stop-motion videos.
+
+Reading a picture (from a network share like Z:) and decoding the JPEG take
+about as long as writing it to the video, so doing both in the writing loop
+leaves the encoder waiting on every frame. FrameSource decodes the next images
+on a thread pool (cv2.imread releases the GIL) while the caller encodes the
+current one, and hands them out in order. How far it reads ahead is bounded by
+a number of images and by the memory of the decoded frames held, so 4K pictures
+don't pile up. Pictures that can't be read are reported and skipped.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import cv2
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_READ_AHEAD = 16      # images decoded or being decoded ahead of the caller
+DEFAULT_MAX_MB = 256         # decoded frames held ahead of the caller
+
+
+class FrameSource:
+    """
+    Iterates (position, frame) over the readable images of paths, in order;
+    position is the image's index in paths. Paths that couldn't be read end up
+    in `unreadable`.
+    """
+
+    def __init__(self, paths, workers=DEFAULT_WORKERS, read_ahead=DEFAULT_READ_AHEAD, max_mb=DEFAULT_MAX_MB,
+                 read=cv2.imread):
+        self.paths = list(paths)
+        self.workers = max(1, workers)
+        self.read_ahead = max(1, read_ahead)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.read = read
+        self.unreadable = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _read(self, path):
+        try:
+            return self.read(path), None
+        except Exception as e:
+            return None, e
+
+    def _ahead(self, frame_bytes):
+        # Until a frame's size is known, only as many as there are workers
+        if not frame_bytes:
+            return self.workers
+        return max(1, min(self.read_ahead, self.max_bytes // frame_bytes))
+
+    def __iter__(self):
+        pending = deque()
+        submitted = 0
+        frame_bytes = 0
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="frame-source") as pool:
+            try:
+                for position, path in enumerate(self.paths):
+                    while submitted < len(self.paths) and len(pending) < self._ahead(frame_bytes):
+                        pending.append(pool.submit(self._read, self.paths[submitted]))
+                        submitted += 1
+                    frame, error = pending.popleft().result()
+                    if frame is None:
+                        self.unreadable.append(path)
+                        print(f"Warning: Could not read image {path}{f': {error}' if error else ''}.")
+                        continue
+                    frame_bytes = max(frame_bytes, frame.nbytes)
+                    yield position, frame
+            finally:
+                # Stopped early: don't decode what nobody will take
+                for future in pending:
+                    future.cancel()
@@ -7,8 +7,10 @@ import cap_mgr
 import time
 from roi_utils import show_plate_roi
 from plate_format import extract_plate
+from detection_region import DetectionRegion
 from camera_gui import start_gui
 from onvif import ONVIFCamera
+from onvif_transport import make_transport
 
 # Read environment configuration
 with open("environ.json", "r") as f:
@@ -29,12 +31,25 @@ def main():
     with open("environ.json", "r") as f:
         environ = json.load(f)
     pw = environ.get("pw", "admin")
+    dynamodb.configure_cache(max_size=environ.get("plate_cache_size", 1024))
+    dynamodb.configure_writer(spool_path=environ.get("plate_spool_path", os.path.join('output', 'plate_spool.jsonl')))
     wsdl_dir=os.path.join('C:\\', 'Users', 'Hugo', 'AppData', 'Roaming', 'Python', 'Lib', 'site-packages', 'wsdl')
-    onvif_camera = ONVIFCamera(cam_ip, 8080, 'admin', pw, wsdl_dir=wsdl_dir)
+    onvif_camera = ONVIFCamera(cam_ip, 8080, 'admin', pw, wsdl_dir=wsdl_dir, transport=make_transport())
     print(f"ONVIF Camera initialized: {onvif_camera.devicemgmt.GetDeviceInformation()}")
     cap = cap_mgr.get_cap('rtsp')
     os.makedirs('output', exist_ok=True)
-    start_gui(cap, plate_cascade, reader, extract_plate, show_plate_roi, dynamodb, onvif_camera)
+    # Restrict the cascade to the road area of the preset the camera is parked on
+    detection_region = None
+    detection_preset = environ.get("detection_preset")
+    if detection_preset:
+        with open("locations.json", "r") as f:
+            preset_locations = json.load(f)
+        detection_region = DetectionRegion.from_preset(preset_locations.get(detection_preset))
+        print(f"Detection region for '{detection_preset}': {'set' if detection_region else 'full frame'}")
+    start_gui(cap, plate_cascade, reader, extract_plate, show_plate_roi, dynamodb, onvif_camera, detection_region, cap_mgr.streams,
+              environ.get("preview_fps", 15))
+    cap_mgr.streams.release()
+    dynamodb.shutdown()
 
 if __name__ == "__main__":
     main()
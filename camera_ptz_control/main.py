@@ -1,12 +1,25 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import cv2
+from typing import List
+import asyncio
 from datetime import datetime
-import os
-from ptz_commands import PTZCommands
 import json
+import os
 import time
-import subprocess
+import metrics
+import tracing
+import profiler
+import stability
+import calibration
+import renditions
+from cameras import load_cameras
+from scheduler import Scheduler
+from picture_index import file_hash
+from picture_store import parse_name
+from retention import DEFAULT_CRON, RetentionJob
+from ptz_commands import DEFAULT_PT_SPEED, MotionPreempted
 
 # Initialize FastAPI app
 app = FastAPI(title="Camera Control API")
@@ -14,172 +27,249 @@ app = FastAPI(title="Camera Control API")
 # Read environment configuration
 with open("environ.json", "r") as f:
     environ = json.load(f)
-pw = environ.get("pw", "admin")
-cam_ip = environ.get("camera_ip", "192.168.1.139")
-PICTURES_PATH = environ.get("pictures_path", "/config/pictures/cam_api")
 
-# Initialize camera URL
-CAMERA_IP = cam_ip
-CAMERA_URL = f"rtsp://admin:{pw}@{CAMERA_IP}:554/12"
+# Configured cameras (PTZ control of each is set up in startup event)
+cameras = load_cameras(environ)
+
+# Periodic preset rounds from the "schedule" rules (started in startup event)
+scheduler = Scheduler(
+    cameras, environ.get("schedule"),
+    # Scheduled captures queue behind user moves rather than preempting them
+    lambda camera, location, stable, min_change: camera.motion.call(
+        _take_picture_at_location, camera, location, stable, stability.MAX_WAIT_S, True, min_change).result())
 
-# Initialize PTZ commands (will be set up in startup event)
-ptz_control = None
+# Encoded pictures served by the capture, /picture and /latest endpoints, bounded by rendition_cache_mb
+rendition_cache = renditions.RenditionCache(environ.get("rendition_cache_mb", renditions.DEFAULT_CACHE_MB) * 1024 * 1024)
+
+# Tiered compaction of the picture archive from the "retention" tiers (started in startup event)
+retention = RetentionJob(cameras, environ.get("retention"), environ.get("retention_cron") or DEFAULT_CRON,
+                         listeners=[rendition_cache.on_retention])
 
 class PTZRequest(BaseModel):
     pan: float
     tilt: float
     zoom: float | None = None  # Optional zoom parameter
 
-@app.on_event("startup")
-async def startup_event():
-    global ptz_control
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = None
+    with tracing.trace(f"{request.method} {request.url.path}") as request_trace:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            request_trace.finish(status)
+            # Label by handler rather than raw path to keep locations out of the label set
+            endpoint = request.scope.get("endpoint")
+            endpoint_name = endpoint.__name__ if endpoint else "unmatched"
+            metrics.REQUEST_SECONDS.labels(endpoint_name).observe(time.perf_counter() - start)
+
+async def run_motion(future):
+    """Await a motion actor command (see motion.py); a preempted move answers 409."""
     try:
+        return await asyncio.wrap_future(future)
+    except MotionPreempted as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-        # Initialize your PTZ control here
-        from onvif import ONVIFCamera
-        print(f"Connecting to camera at {CAMERA_IP}...")
-        
-        # Get camera IP from RTSP URL
-        from urllib.parse import urlparse
-        camera_url = urlparse(CAMERA_URL)
-        camera_ip = camera_url.hostname
-        
-        # Create ONVIFCamera instance (simpler initialization like in CameraGUI)
-        # cam = ONVIFCamera(camera_ip, 80, 'admin', pw)
-        # Try multiple possible WSDL paths
-        possible_wsdl_paths = [
-            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wsdl'),
-            '/app/wsdl',
-            'wsdl'
+def get_camera(camera_id=None):
+    """Camera by id (default camera if None), 404 if it isn't configured."""
+    try:
+        return cameras.get(camera_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Camera '{camera_id}' not found. Available cameras: {cameras.ids()}")
+
+def _rendition(format, width, quality):
+    """(format, width, quality) of a requested image response, None for a JSON response; 400 if invalid."""
+    if format is None:
+        return None
+    try:
+        renditions.check(format.lower(), width, quality)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return format.lower(), width, quality
+
+def _store_picture(camera, frame, filename, rendition):
+    """
+    Save a capture to filename (if any). With a rendition, the picture is saved
+    in the background and the encoded rendition is returned for the response.
+    """
+    if rendition is None:
+        if filename:
+            print(f"Saving picture to {filename}")
+            camera.save_frame(frame, filename)
+        return None
+    if filename:
+        encoded = None
+        if renditions.is_original(filename, *rendition):
+            # The response is the stored file: encode it once for both
+            encoded = camera.encode_frame(frame)
+            rendition_cache.put_original(filename, encoded)
+        camera.save_frame_async(frame, filename, encoded)
+    with metrics.stage("render"):
+        if filename:
+            # Cached under the file, for /picture and /latest requests that follow
+            return rendition_cache.render(filename, *rendition, frame=frame)
+        return renditions.encode(frame, *rendition)
+
+def _image_response(image, filename, scene_change=None):
+    data, media_type = image
+    headers = {"X-Picture-Filename": filename or ""}
+    if scene_change is not None:
+        headers["X-Scene-Change"] = str(scene_change)
+    return Response(content=data, media_type=media_type, headers=headers)
+
+@app.get("/debug/timings")
+async def get_debug_timings(limit: int = 50, format: str = "json"):
+    if format == "chrome":
+        return tracing.chrome_trace(limit)
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'chrome'")
+    return {"traces": tracing.recent(limit)}
+
+@app.get("/debug/profile")
+async def get_debug_profile(seconds: float = 10, interval_ms: float = 10):
+    if seconds <= 0 or interval_ms <= 0:
+        raise HTTPException(status_code=400, detail="seconds and interval_ms must be positive")
+    try:
+        # Sample from a worker thread so the event loop itself shows up in the profile
+        stacks = await run_in_threadpool(profiler.profile, seconds, interval_ms / 1000)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return PlainTextResponse(stacks, headers={"Content-Disposition": f'attachment; filename="profile_{timestamp}.collapsed"'})
+
+@app.get("/debug/renditions")
+async def get_rendition_cache_stats():
+    return rendition_cache.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    for camera in cameras:
+        if camera.ptz_control:
+            metrics.set_estimated_position(camera.id, **camera.position())
+    body, content_type = metrics.render()
+    return Response(content=body, headers={"Content-Type": content_type})
+
+@app.get("/cameras")
+async def list_cameras():
+    return {
+        "default": cameras.default_id,
+        "cameras": [
+            {
+                "id": camera.id,
+                "camera_ip": camera.ip,
+                "connected": camera.ptz_control is not None,
+                "calibrated": bool(camera.ptz_control and camera.ptz_control.calibration),
+                "current_position": camera.position() if camera.ptz_control else None,
+                "locations": camera.presets.names()
+            }
+            for camera in cameras
         ]
-        
-        wsdl_path = None
-        for path in possible_wsdl_paths:
-            print(f"Checking WSDL path: {path}")
-            if os.path.exists(path):
-                print(f"Found WSDL directory at: {path}")
-                # Verify that devicemgmt.wsdl exists
-                if os.path.exists(os.path.join(path, 'devicemgmt.wsdl')):
-                    wsdl_path = path
-                    break
-                else:
-                    print(f"devicemgmt.wsdl not found in {path}")
-            else:
-                print(f"Directory not found: {path}")
-                
-        if wsdl_path is None:
-            raise Exception("WSDL directory with required files not found in any of the expected locations")
-            
-        print(f"Using WSDL directory: {wsdl_path}")
-        cam = ONVIFCamera(cam_ip, 8080, 'admin', pw, wsdl_dir=wsdl_path)
-        print("Camera connection established")
-    
-    except Exception as e:
-        print(f"Failed to connect to camera using ONVIF: {str(e)}")
-        print(f"Pinging {CAMERA_IP}...")
-        
-        # Use ping command compatible with both Windows and Linux
-        if os.name == 'nt':  # Windows
-            ping_cmd = ["ping", "-n", "1", "-w", "2000", CAMERA_IP]
-        else:  # Linux/Unix
-            ping_cmd = ["ping", "-c", "1", "-W", "2", CAMERA_IP]
-            
-        ping = subprocess.run(ping_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if ping.returncode != 0:
-            raise HTTPException(status_code=503, detail="Camera is not reachable")
-        raise HTTPException(status_code=500, detail=f"Failed to connect to camera, although it is reachable. Error: {str(e)}")
-    
-    # Create media service object
-    print("Creating media service...")
-    media = cam.create_media_service()
-    
-    # Create ptz service object
-    print("Creating PTZ service...")
-    ptz = cam.create_ptz_service()
+    }
 
-    # Get target profile
-    print("Getting media profile...")
-    media_profile = media.GetProfiles()[0]
-    
-    # Initialize PTZ control
-    print("Initializing PTZ control...")
-    ptz_control = PTZCommands(ptz, media_profile)
-    print("PTZ control initialized successfully")
+@app.on_event("startup")
+async def startup_event():
+    # Connect and home all cameras at once
+    results = await asyncio.gather(*(camera.run(camera.start) for camera in cameras), return_exceptions=True)
+    failures = []
+    for camera, result in zip(cameras, results):
+        if isinstance(result, BaseException):
+            print(f"[{camera.id}] Camera not available: {getattr(result, 'detail', result)}")
+            failures.append(result)
+    # Keep serving the cameras that did connect
+    if len(failures) == len(cameras):
+        raise failures[0]
+    scheduler.start()
+    retention.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    scheduler.stop()
+    retention.stop()
+    for camera in cameras:
+        camera.streams.release()
+
+@app.get("/schedule")
+async def get_schedule(limit: int = 20):
+    return scheduler.status(limit)
 
-    # go origin + go home
-    ptz_control.hard_origin(blocking=True)
-    ptz_control.go_home()
+@app.get("/retention")
+async def get_retention():
+    return retention.status()
 
+@app.post("/retention/run")
+async def run_retention(dry_run: bool = True):
+    """Compact the picture archive now; by default only report what would be deleted and reclaimed."""
+    return await run_in_threadpool(retention.run, dry_run)
+
+@app.get("/cameras/{camera_id}/move")
+@app.post("/cameras/{camera_id}/move")
 @app.get("/move")
 @app.post("/move")
-async def move_camera(pan: float = None, tilt: float = None, zoom: float = None, request: PTZRequest = None):
-    if not ptz_control:
+async def move_camera(pan: float = None, tilt: float = None, zoom: float = None, request: PTZRequest = None, camera_id: str = None):
+    camera = get_camera(camera_id)
+    if not camera.ptz_control:
         raise HTTPException(status_code=503, detail="PTZ control not available")
     
+    # Get values either from query params (GET) or request body (POST)
+    pan_value = pan if pan is not None else (request.pan if request else None)
+    tilt_value = tilt if tilt is not None else (request.tilt if request else None)
+    zoom_value = zoom if zoom is not None else (request.zoom if request else None)
+    
+    if pan_value is None and tilt_value is None and zoom_value is None:
+        raise HTTPException(status_code=400, detail="At least one of pan, tilt, or zoom must be provided")
+    
     try:
-        # Get values either from query params (GET) or request body (POST)
-        pan_value = pan if pan is not None else (request.pan if request else None)
-        tilt_value = tilt if tilt is not None else (request.tilt if request else None)
-        zoom_value = zoom if zoom is not None else (request.zoom if request else None)
-        
-        if pan_value is None and tilt_value is None and zoom_value is None:
-            raise HTTPException(status_code=400, detail="At least one of pan, tilt, or zoom must be provided")
-        
-        # Calculate absolute position based on current position plus relative movement
-        new_pan = ptz_control.est_pan_angle_deg + pan_value if pan_value is not None else ptz_control.est_pan_angle_deg
-        new_tilt = ptz_control.est_tilt_angle_deg + tilt_value if tilt_value is not None else ptz_control.est_tilt_angle_deg
-        new_zoom = ptz_control.est_zoom_level + zoom_value if zoom_value is not None else ptz_control.est_zoom_level
-        
-        # First stop any ongoing movement
-        ptz_control.stop_ptz()
-        time.sleep(0.5)  # Small delay to ensure stop is processed
-        
-        # Move to requested position using absolute positioning
-        if (abs(new_pan) <= 350 and abs(new_tilt) <= 90 and 
-            (new_zoom is None or (0 <= new_zoom <= 1))):  # Check if within limits
-            
-            # Then move zoom if specified
-            if zoom_value is not None:
-                ptz_control.abs_zoom(new_zoom)
-
-            # Move pan/tilt first if specified
-            if pan or tilt:
-                ptz_control.abs_pantilt((new_pan, new_tilt))
-            
-            
-            # Build message with only the movements that were requested
-            movements = []
-            if pan_value is not None:
-                movements.append(f"pan: {pan_value}")
-            if tilt_value is not None:
-                movements.append(f"tilt: {tilt_value}")
-            if zoom_value is not None:
-                movements.append(f"zoom: {zoom_value}")
-            
-            return {
-                "message": f"Moving relative {', '.join(movements)}",
-                "target_position": {
-                    "pan": new_pan,
-                    "tilt": new_tilt,
-                    "zoom": new_zoom
-                },
-                "current_position": {
-                    "pan": ptz_control.est_pan_angle_deg,
-                    "tilt": ptz_control.est_tilt_angle_deg,
-                    "zoom": ptz_control.est_zoom_level
-                }
-            }
-        else:
-            raise HTTPException(status_code=400, detail=f"Pan/Tilt values out of range: {new_pan}, {new_tilt}. Zoom must be between 0 and 1 if specified: {new_zoom}")
-            
+        # Relative moves that arrive while one is queued or running are merged into one target
+        result = await run_motion(camera.motion.move_by(pan_value or 0.0, tilt_value or 0.0, zoom_value or 0.0))
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    # Build message with only the movements that were requested
+    movements = []
+    if pan_value is not None:
+        movements.append(f"pan: {pan_value}")
+    if tilt_value is not None:
+        movements.append(f"tilt: {tilt_value}")
+    if zoom_value is not None:
+        movements.append(f"zoom: {zoom_value}")
+    
+    return {"message": f"Moving relative {', '.join(movements)}", **result}
 
+@app.get("/cameras/{camera_id}/stop", response_model=dict)
+@app.post("/cameras/{camera_id}/stop", response_model=dict)
+@app.get("/stop", response_model=dict)
+@app.post("/stop", response_model=dict)
+async def stop_camera(camera_id: str = None):
+    camera = get_camera(camera_id)
+    # Jumps the motion queue: interrupts the running move and drops the queued ones
+    position = await run_motion(camera.motion.stop())
+    return {"message": "Stopped", "current_position": position}
+
+@app.get("/cameras/{camera_id}/capture", response_model=dict)
+@app.post("/cameras/{camera_id}/capture", response_model=dict)
+@app.get("/cameras/{camera_id}/capture/{suffix}", response_model=dict)
+@app.post("/cameras/{camera_id}/capture/{suffix}", response_model=dict)
 @app.get("/capture", response_model=dict)
 @app.post("/capture", response_model=dict)
 @app.get("/capture/{suffix}", response_model=dict)
 @app.post("/capture/{suffix}", response_model=dict)
-async def take_picture(suffix: str = ""):
+async def take_picture(suffix: str = "", stable: bool = False, max_wait: float = stability.MAX_WAIT_S,
+                       format: str = None, width: int = None, quality: int = None, save: bool = True,
+                       camera_id: str = None):
+    camera = get_camera(camera_id)
+    rendition = _rendition(format, width, quality)
+    result = await camera.run(_take_picture, camera, suffix, stable, max_wait, rendition, save)
+    return _image_response(result["image"], result["filename"]) if rendition else result
+
+def _take_picture(camera, suffix, stable, max_wait, rendition=None, save=True):
+    ptz_control = camera.ptz_control
     if not ptz_control:
         raise HTTPException(status_code=503, detail="PTZ control not available")
     
@@ -187,45 +277,43 @@ async def take_picture(suffix: str = ""):
         # Hard origin before taking picture
         # print("Moving to hard origin before taking picture...")
         # ptz_control.hard_origin(blocking=True)
-        time.sleep(0.5)  # Small delay to ensure camera has stopped moving
-        
-        # Initialize capture
-        cap = cv2.VideoCapture(CAMERA_URL)
-        if not cap.isOpened():
-            raise HTTPException(status_code=503, detail="Could not connect to camera")
+        with metrics.stage("settle"):
+            ptz_control.wait_settled()
         
-        # Read a frame
-        ret, frame = cap.read()
-        if not ret:
-            raise HTTPException(status_code=500, detail="Could not capture image")
+        # Read a frame, optionally once the image has stopped changing
+        frame, stability_stats = camera.grab_frame(stable, max_wait)
         
-        # Create output directory if it doesn't exist
-        os.makedirs(PICTURES_PATH, exist_ok=True)
-        
-        # Generate filename with timestamp and suffix
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{PICTURES_PATH}/{timestamp}_{suffix}_api.jpg"
+        # Generate filename with timestamp and suffix, in its folder of the pictures layout
+        now = datetime.now()
+        filename = camera.pictures.path_for(f"{suffix}_api", now) if save else None
 
-        print(f"Saving picture to {filename}")
-        
-        # Save the image
-        cv2.imwrite(filename, frame)
-        
-        # Release the capture
-        cap.release()
+        # Save the image, or encode it for the response while it is saved
+        image = _store_picture(camera, frame, filename, rendition)
         
         # # Hard origin after taking picture
         # print("Moving to hard origin after taking picture...")
         # ptz_control.hard_origin(blocking=True)
         
-        return {"message": "Picture captured", "filename": filename}
+        result = {"message": "Picture captured", "filename": filename}
+        if stability_stats:
+            result["stability"] = stability_stats
+        if image:
+            result["image"] = image
+        return result
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cameras/{camera_id}/origin", response_model=dict)
+@app.post("/cameras/{camera_id}/origin", response_model=dict)
 @app.get("/origin", response_model=dict)
 @app.post("/origin", response_model=dict)
-async def move_to_origin():
+async def move_to_origin(camera_id: str = None):
+    camera = get_camera(camera_id)
+    return await run_motion(camera.motion.call(_move_to_origin, camera))
+
+def _move_to_origin(camera):
+    ptz_control = camera.ptz_control
     if not ptz_control:
         raise HTTPException(status_code=503, detail="PTZ control not available")
     
@@ -239,11 +327,19 @@ async def move_to_origin():
                 "zoom": ptz_control.est_zoom_level
             }
         }
+    except MotionPreempted:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cameras/{camera_id}/home", response_model=dict)
 @app.get("/home", response_model=dict)
-async def move_to_home():
+async def move_to_home(camera_id: str = None):
+    camera = get_camera(camera_id)
+    return await run_motion(camera.motion.goto(_move_to_home, camera))
+
+def _move_to_home(camera):
+    ptz_control = camera.ptz_control
     if not ptz_control:
         raise HTTPException(status_code=503, detail="PTZ control not available")
     
@@ -257,38 +353,46 @@ async def move_to_home():
                 "tilt": ptz_control.est_tilt_angle_deg
             }
         }
+    except MotionPreempted:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
-# Load preset locations
-with open("locations.json", "r") as f:
-    preset_locations = json.load(f)
-
+@app.get("/cameras/{camera_id}/goto/{location}", response_model=dict)
 @app.get("/goto/{location}", response_model=dict)
-async def move_to_preset(location: str):
+async def move_to_preset(location: str, relocalize: bool = True, camera_id: str = None):
+    camera = get_camera(camera_id)
+    return await run_motion(camera.motion.goto(_move_to_preset, camera, location, relocalize))
+
+def _move_to_preset(camera, location, relocalize):
+    ptz_control = camera.ptz_control
     if not ptz_control:
         raise HTTPException(status_code=503, detail="PTZ control not available")
     
     try:
         # Find the location in presets
         location = location.lower()  # case-insensitive matching
-        if location not in preset_locations:
-            available_locations = list(preset_locations.keys())
+        if location not in camera.presets:
+            available_locations = camera.presets.names()
             raise HTTPException(
                 status_code=404, 
                 detail=f"Location '{location}' not found. Available locations: {available_locations}"
             )
         
         # Get the preset coordinates
-        preset = preset_locations[location]
+        preset = camera.presets[location]
         
         # Move to the preset position
-        ptz_control.abs_zoom(preset["zoom"])
-        ptz_control.abs_pantilt((preset["pan"], preset["tilt"]))
+        with metrics.stage("move"):
+            ptz_control.abs_zoom(preset["zoom"])
+            relocalization = ptz_control.abs_pantilt(
+                (preset["pan"], preset["tilt"]),
+                on_arrival=(lambda: camera.relocalize(location)) if relocalize else None)
         
         return {
             "message": f"Moved to preset location: {location}",
             "preset": preset,
+            "relocalization": relocalization,
             "current_position": {
                 "pan": ptz_control.est_pan_angle_deg,
                 "tilt": ptz_control.est_tilt_angle_deg,
@@ -296,12 +400,21 @@ async def move_to_preset(location: str):
             }
         }
         
+    except MotionPreempted:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+@app.post("/cameras/{camera_id}/savelocation/{name}", response_model=dict)
+@app.get("/cameras/{camera_id}/savelocation/{name}", response_model=dict)
 @app.post("/savelocation/{name}", response_model=dict)
 @app.get("/savelocation/{name}", response_model=dict)
-async def save_current_position(name: str):
+async def save_current_position(name: str, camera_id: str = None):
+    camera = get_camera(camera_id)
+    return await run_motion(camera.motion.call(_save_current_position, camera, name))
+
+def _save_current_position(camera, name):
+    ptz_control = camera.ptz_control
     if not ptz_control:
         raise HTTPException(status_code=503, detail="PTZ control not available")
     
@@ -318,33 +431,52 @@ async def save_current_position(name: str):
             "zoom": ptz_control.est_zoom_level
         }
         
-        # Read existing locations
-        try:
-            with open("locations.json", "r") as f:
-                locations = json.load(f)
-        except FileNotFoundError:
-            locations = {}
-        
-        # Add or update the location
-        was_updated = name in locations
-        locations[name] = current_position
-        
-        # Save back to file with pretty formatting
-        with open("locations.json", "w") as f:
-            json.dump(locations, f, indent=4)
+        # Add or update the location, keeping extra preset settings such as the detection region
+        was_updated = camera.presets.save(name, current_position)
         
-        return {
+        result = {
             "message": f"Location '{name}' {'updated' if was_updated else 'saved'}",
             "location_name": name,
             "position": current_position,
-            "available_locations": list(locations.keys())
+            "available_locations": camera.presets.names()
         }
         
+        # The view from here is what later visits are checked against. The preset is
+        # saved either way; if the image can't be taken, the old one (of the previous
+        # position) goes and the next visit stores a new one.
+        try:
+            camera.store_reference(name)
+        except MotionPreempted:
+            raise
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            print(f"Warning: Could not store the reference image for '{name}': {detail}")
+            camera.references.discard(name)
+            result["reference"] = f"not stored: {detail}"
+        
+        return result
+        
+    except MotionPreempted:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+@app.get("/cameras/{camera_id}/take_picture/{location}", response_model=dict)
 @app.get("/take_picture/{location}", response_model=dict)
-async def take_picture_at_location(location: str):
+async def take_picture_at_location(location: str, stable: bool = False, max_wait: float = stability.MAX_WAIT_S,
+                                   relocalize: bool = True, min_change: float = None,
+                                   format: str = None, width: int = None, quality: int = None, save: bool = True,
+                                   camera_id: str = None):
+    camera = get_camera(camera_id)
+    rendition = _rendition(format, width, quality)
+    result = await run_motion(camera.motion.goto(
+        _take_picture_at_location, camera, location, stable, max_wait, relocalize, min_change, rendition, save))
+    if not rendition:
+        return result
+    return _image_response(result.pop("image"), result["picture"]["filename"], result["scene_change"]["score"])
+
+def _take_picture_at_location(camera, location, stable, max_wait, relocalize, min_change=None, rendition=None, save=True):
+    ptz_control = camera.ptz_control
     if not ptz_control:
         raise HTTPException(status_code=503, detail="PTZ control not available")
     
@@ -356,43 +488,44 @@ async def take_picture_at_location(location: str):
         
         # First, move to the location
         location = location.lower()  # case-insensitive matching
-        if location not in preset_locations:
-            available_locations = list(preset_locations.keys())
+        if location not in camera.presets:
+            available_locations = camera.presets.names()
             raise HTTPException(
                 status_code=404, 
                 detail=f"Location '{location}' not found. Available locations: {available_locations}"
             )
         
         # Get the preset coordinates and move there
-        preset = preset_locations[location]
-        ptz_control.abs_pantilt((preset["pan"], preset["tilt"]))
-        ptz_control.abs_zoom(preset["zoom"])
-        
-        # Small delay to ensure camera has stopped moving
-        time.sleep(0.5)
-        
-        # Now take the picture
-        cap = cv2.VideoCapture(CAMERA_URL)
-        if not cap.isOpened():
-            raise HTTPException(status_code=503, detail="Could not connect to camera")
-        
-        # Read a frame
-        ret, frame = cap.read()
-        if not ret:
-            raise HTTPException(status_code=500, detail="Could not capture image")
-        
-        # Create output directory if it doesn't exist
-        os.makedirs(PICTURES_PATH, exist_ok=True)
-        
-        # Generate filename with timestamp and location name
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{PICTURES_PATH}/{timestamp}_{location}.jpg"
-        
-        # Save the image
-        cv2.imwrite(filename, frame)
-        
-        # Release the capture
-        cap.release()
+        preset = camera.presets[location]
+        with metrics.stage("move"):
+            relocalization = ptz_control.abs_pantilt(
+                (preset["pan"], preset["tilt"]),
+                on_arrival=(lambda: camera.relocalize(location)) if relocalize else None)
+            ptz_control.abs_zoom(preset["zoom"])
+        
+        # Wait for the camera to report it has stopped moving
+        with metrics.stage("settle"):
+            ptz_control.wait_settled()
+        
+        # Now take the picture, optionally once the image has stopped changing
+        frame, stability_stats = camera.grab_frame(stable, max_wait)
+        
+        # How much the scene changed since the last stored picture at this preset
+        with metrics.stage("scene"):
+            scene_change, scene_frame = camera.scenes.score(location, frame)
+        
+        # Generate filename with timestamp and location name, in its folder of the pictures layout
+        now = datetime.now()
+        timestamp = now.strftime("%Y%m%d_%H%M%S")
+        filename = None
+        if min_change is not None and scene_change["score"] is not None and scene_change["score"] < min_change:
+            print(f"[{camera.id}] '{location}' changed {scene_change['score']}% < {min_change}%, not stored")
+        elif save:
+            filename = camera.pictures.path_for(location, now)
+            camera.scenes.remember(location, scene_frame, now)
+        
+        # Save the image, or encode it for the response while it is saved
+        image = _store_picture(camera, frame, filename, rendition)
         
         # # Hard origin after taking picture
         # print("Moving to hard origin after taking picture...")
@@ -401,6 +534,7 @@ async def take_picture_at_location(location: str):
         return {
             "message": f"Moved to location '{location}' and took picture",
             "location": preset,
+            "relocalization": relocalization,
             "current_position": {
                 "pan": ptz_control.est_pan_angle_deg,
                 "tilt": ptz_control.est_tilt_angle_deg,
@@ -408,13 +542,113 @@ async def take_picture_at_location(location: str):
             },
             "picture": {
                 "filename": filename,
-                "timestamp": timestamp
-            }
+                "timestamp": timestamp,
+                "stability": stability_stats,
+                "stored": filename is not None
+            },
+            "scene_change": scene_change,
+            **({"image": image} if image else {})
         }
         
+    except MotionPreempted:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+@app.post("/cameras/{camera_id}/calibrate", response_model=dict)
+@app.post("/calibrate", response_model=dict)
+async def calibrate_camera(speeds: List[float] = Query([DEFAULT_PT_SPEED]), zooms: List[float] = Query([0.0]), camera_id: str = None):
+    camera = get_camera(camera_id)
+    return await run_motion(camera.motion.call(_calibrate_camera, camera, speeds, zooms))
+
+def _calibrate_camera(camera, speeds, zooms):
+    ptz_control = camera.ptz_control
+    if not ptz_control:
+        raise HTTPException(status_code=503, detail="PTZ control not available")
+    
+    try:
+        # Timed moves measured on grabbed frames; takes about a minute per speed and zoom level
+        result = calibration.calibrate(ptz_control, lambda: camera.grab_frame(consumer="analysis")[0], camera.hfov_deg, speeds, zooms)
+        result.save(camera.calibration_path)
+        
+        return {
+            "message": f"Camera calibrated, saved to {camera.calibration_path}",
+            "calibration": result.to_dict(),
+            "current_position": camera.position()
+        }
+        
+    except calibration.CalibrationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except MotionPreempted:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+@app.get("/cameras/{camera_id}/similar/{location}", response_model=dict)
+@app.get("/similar/{location}", response_model=dict)
+async def similar_pictures(location: str, picture: str = None, limit: int = 20, max_distance: int = None, camera_id: str = None):
+    """
+    Pictures of a location nearest to one of its pictures (file name or path,
+    latest by default) by perceptual hash; with max_distance only those within
+    that many differing bits (e.g. 6 for near-duplicates).
+    """
+    camera = get_camera(camera_id)
+    return await run_in_threadpool(_similar_pictures, camera, location.lower(), picture, limit, max_distance)
+
+def _similar_pictures(camera, location, picture, limit, max_distance):
+    if picture is None:
+        latest = camera.index.latest(location)
+        if latest is None:
+            raise HTTPException(status_code=404, detail=f"No indexed pictures of '{location}'")
+        picture, h = latest[0].path, latest[1]
+    else:
+        parsed = parse_name(os.path.basename(picture))
+        h = camera.index.hash_of(location, parsed[0]) if parsed else None
+        if h is None:
+            path = camera.pictures.resolve(picture)
+            h = file_hash(path) if path else None
+        if h is None:
+            raise HTTPException(status_code=404, detail=f"Picture '{picture}' not found")
+    matches = camera.index.nearest(location, h, limit, max_distance)
+    return {
+        "picture": picture,
+        "hash": f"{h:016x}",
+        "matches": [{"filename": p.path, "timestamp": p.timestamp.isoformat(), "distance": d} for p, d in matches],
+    }
+
+@app.get("/cameras/{camera_id}/picture/{name}")
+@app.get("/picture/{name}")
+async def get_picture(name: str, format: str = "jpeg", width: int = None, quality: int = None, camera_id: str = None):
+    """A stored picture by file name, optionally downscaled and re-encoded."""
+    camera = get_camera(camera_id)
+    rendition = _rendition(format, width, quality)
+    path = camera.pictures.resolve(os.path.basename(name))
+    if path is None:
+        # Just captured and still being written in the background: its rendition may be cached already
+        pending = camera.pictures.layout_path(name)
+        image = rendition_cache.cached(pending, *rendition) if pending else None
+        if image is None:
+            raise HTTPException(status_code=404, detail=f"Picture '{name}' not found")
+        return _image_response(image, pending)
+    return await run_in_threadpool(_serve_picture, path, rendition)
+
+@app.get("/cameras/{camera_id}/latest/{location}")
+@app.get("/latest/{location}")
+async def get_latest_picture(location: str, format: str = "jpeg", width: int = None, quality: int = None, camera_id: str = None):
+    """The last stored picture of a location (preset, or "<suffix>_api" for /capture)."""
+    camera = get_camera(camera_id)
+    rendition = _rendition(format, width, quality)
+    latest = camera.index.latest(location.lower())
+    if latest is None:
+        raise HTTPException(status_code=404, detail=f"No pictures of '{location}'")
+    return await run_in_threadpool(_serve_picture, latest[0].path, rendition)
+
+def _serve_picture(path, rendition):
+    image = rendition_cache.render(path, *rendition)
+    if image is None:
+        raise HTTPException(status_code=404, detail=f"Picture '{path}' could not be read")
+    return _image_response(image, path)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+import tracing
+
+# Moves take seconds, ONVIF calls and encodes take milliseconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_SECONDS = Histogram(
+    "cam_api_request_seconds", "Endpoint latency", ["endpoint"], buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram(
+    "cam_api_stage_seconds", "Latency of request stages (move, relocalize, settle, connect, grab, stabilize, scene, encode, write, hash)",
+    ["stage"], buckets=LATENCY_BUCKETS)
+ONVIF_CALL_SECONDS = Histogram(
+    "cam_api_onvif_call_seconds", "ONVIF call latency", ["operation"], buckets=LATENCY_BUCKETS)
+ONVIF_CALL_ERRORS = Counter(
+    "cam_api_onvif_call_errors_total", "ONVIF calls that raised", ["operation"])
+FRAMES_CAPTURED = Counter(
+    "cam_api_frames_captured_total", "Frames grabbed from the camera stream")
+FRAMES_DROPPED = Counter(
+    "cam_api_frames_dropped_total", "Frame grabs that failed (stream not opened or no frame read)")
+WRITER_QUEUE_DEPTH = Gauge(
+    "cam_api_writer_queue_depth", "Items waiting in background writers", ["writer"])
+SCHEDULED_CAPTURES = Counter(
+    "cam_api_scheduled_captures_total", "Scheduled preset captures by outcome (ok, failed, skipped)", ["camera", "outcome"])
+ESTIMATED_POSITION = Gauge(
+    "cam_api_estimated_position", "Estimated PTZ position (degrees for pan/tilt, level for zoom)", ["camera", "axis"])
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of a request, in the stage histogram and the current trace."""
+    start = time.perf_counter()
+    try:
+        with tracing.span(name):
+            yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def onvif_call(operation):
+    """Time one ONVIF call, counting the ones that raise."""
+    start = time.perf_counter()
+    try:
+        with tracing.span(operation):
+            yield
+    except Exception:
+        ONVIF_CALL_ERRORS.labels(operation).inc()
+        raise
+    finally:
+        ONVIF_CALL_SECONDS.labels(operation).observe(time.perf_counter() - start)
+
+
+def set_estimated_position(camera, pan, tilt, zoom):
+    ESTIMATED_POSITION.labels(camera, "pan").set(pan)
+    ESTIMATED_POSITION.labels(camera, "tilt").set(tilt)
+    ESTIMATED_POSITION.labels(camera, "zoom").set(zoom)
+
+
+def render():
+    """Current metrics in the Prometheus text format, with its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
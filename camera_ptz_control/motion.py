@@ -0,0 +1,212 @@
+"""
+Motion actor: one thread per camera runs every PTZ move, so moves never
+overlap and the position estimate has a single writer.
+
+Commands wait in a priority queue:
+
+- stop() jumps the queue: it interrupts whatever is running, drops the queued
+  moves and sends Stop.
+- move_by() is a relative move. Relative moves still waiting collapse into one,
+  and a new one replans a running relative move (stop where it is, head for
+  the combined target) instead of waiting for it to finish.
+- goto() runs an absolute move. It preempts the running and queued moves and
+  gotos, whose futures fail with MotionPreempted.
+- call() runs other exclusive work (origin, calibration) in order. Only a stop
+  interrupts it.
+
+Interrupted timed moves stop at once and update the estimate from the time
+they actually ran (see PTZCommands.interrupted).
+"""
+from concurrent.futures import Future
+import contextvars
+import heapq
+import itertools
+import threading
+
+from fastapi import HTTPException
+
+import metrics
+from ptz_commands import MotionPreempted
+
+STOP = 0
+MOTION = 1
+
+# Same limits /move has always checked
+MAX_ABS_PAN_DEG = 350
+MAX_ABS_TILT_DEG = 90
+
+
+def _check_target(pan, tilt, zoom):
+    if abs(pan) > MAX_ABS_PAN_DEG or abs(tilt) > MAX_ABS_TILT_DEG or not 0 <= zoom <= 1:
+        raise ValueError(f"Pan/Tilt values out of range: {pan}, {tilt}. Zoom must be between 0 and 1 if specified: {zoom}")
+
+
+class _Command:
+    def __init__(self, kind, priority, fn=None, args=(), delta=None):
+        self.kind = kind          # "stop", "move", "goto" or "call"
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.delta = list(delta) if delta else None
+        self.base = None          # absolute (pan, tilt, zoom) a replanned move starts from
+        self.target = None        # absolute target of a running move
+        self.futures = [Future()]
+        self.context = contextvars.copy_context()
+
+    def resolve(self, result=None, error=None):
+        for future in self.futures:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+class MotionActor:
+    def __init__(self, camera):
+        self.camera = camera
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._current = None
+        self._thread = threading.Thread(target=self._loop, name=f"motion-{camera.id}", daemon=True)
+        self._thread.start()
+
+    def pending(self):
+        """Commands queued or running."""
+        with self._cond:
+            return len(self._queue) + (self._current is not None)
+
+    def _push(self, command):
+        heapq.heappush(self._queue, (command.priority, next(self._seq), command))
+        self._cond.notify()
+
+    def _drop_queued(self, kinds):
+        kept = []
+        for entry in self._queue:
+            if entry[2].kind in kinds:
+                entry[2].resolve(error=MotionPreempted("Superseded by a newer command"))
+            else:
+                kept.append(entry)
+        heapq.heapify(kept)
+        self._queue = kept
+
+    def _interrupt(self, kinds):
+        control = self.camera.ptz_control
+        if self._current and self._current.kind in kinds and control:
+            control.interrupted.set()
+
+    def _last_queued_move(self):
+        motion = [entry for entry in self._queue if entry[0] == MOTION]
+        if motion:
+            last = max(motion, key=lambda entry: entry[1])[2]
+            if last.kind == "move":
+                return last
+        return None
+
+    def _projected_target(self, queued, current, delta):
+        """Absolute target of delta once combined with the queued or running relative move."""
+        control = self.camera.ptz_control
+        running = current.target if current and current.kind == "move" else None
+        base = running or (control.est_pan_angle_deg, control.est_tilt_angle_deg, control.est_zoom_level)
+        if queued:
+            base = queued.base or base
+            delta = [a + b for a, b in zip(queued.delta, delta)]
+        return [b + d for b, d in zip(base, delta)]
+
+    def move_by(self, pan=0.0, tilt=0.0, zoom=0.0):
+        """
+        Queue a relative move. Returns a future for the final target and position.
+        A move whose combined target is out of range fails on its own (ValueError)
+        and leaves the running and queued moves alone.
+        """
+        command = _Command("move", MOTION, delta=(pan, tilt, zoom))
+        with self._cond:
+            queued = self._last_queued_move()
+            if self.camera.ptz_control:
+                try:
+                    _check_target(*self._projected_target(queued, self._current, command.delta))
+                except ValueError as e:
+                    command.futures[0].set_exception(e)
+                    return command.futures[0]
+            if queued:
+                # Collapse into the move still waiting
+                queued.delta = [a + b for a, b in zip(queued.delta, command.delta)]
+                queued.futures += command.futures
+                return command.futures[0]
+            current = self._current
+            if current and current.kind == "move" and current.target is not None:
+                # Replan the running move: it stops where it is and this one heads for the combined target
+                command.base = current.target
+                command.futures += current.futures
+                current.futures = []
+                self._interrupt(("move",))
+            self._push(command)
+        return command.futures[0]
+
+    def goto(self, fn, *args):
+        """Run fn(*args) as an absolute move, preempting older moves and gotos. Returns a future."""
+        command = _Command("goto", MOTION, fn, args)
+        with self._cond:
+            self._drop_queued(("move", "goto"))
+            self._interrupt(("move", "goto"))
+            self._push(command)
+        return command.futures[0]
+
+    def call(self, fn, *args):
+        """Run fn(*args) on the motion thread, in order. Returns a future."""
+        command = _Command("call", MOTION, fn, args)
+        with self._cond:
+            self._push(command)
+        return command.futures[0]
+
+    def stop(self):
+        """Stop now: interrupt the running command and drop the queued ones. Returns a future."""
+        command = _Command("stop", STOP)
+        with self._cond:
+            self._drop_queued(("move", "goto", "call"))
+            self._interrupt(("move", "goto", "call"))
+            self._push(command)
+        return command.futures[0]
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                _, _, command = heapq.heappop(self._queue)
+                if self.camera.ptz_control:
+                    self.camera.ptz_control.interrupted.clear()
+                self._current = command
+            try:
+                result = command.context.run(self._execute, command)
+            except BaseException as e:
+                command.resolve(error=e)
+            else:
+                command.resolve(result)
+            finally:
+                with self._cond:
+                    self._current = None
+
+    def _execute(self, command):
+        control = self.camera.ptz_control
+        if not control:
+            raise HTTPException(status_code=503, detail="PTZ control not available")
+        if command.kind == "stop":
+            control.stop_ptz()
+            return self.camera.position()
+        if command.kind == "move":
+            return self._move(control, command)
+        return command.fn(*command.args)
+
+    def _move(self, control, command):
+        base = command.base or (control.est_pan_angle_deg, control.est_tilt_angle_deg, control.est_zoom_level)
+        pan, tilt, zoom = (b + d for b, d in zip(base, command.delta))
+        # Checked again here: a queued move's base is only known once it runs
+        _check_target(pan, tilt, zoom)
+        with self._cond:
+            command.target = (pan, tilt, zoom)
+        with metrics.stage("move"):
+            if abs(pan - control.est_pan_angle_deg) >= 0.01 or abs(tilt - control.est_tilt_angle_deg) >= 0.01:
+                control.abs_pantilt((pan, tilt))
+            control.abs_zoom(zoom)
+        return {"target_position": {"pan": pan, "tilt": tilt, "zoom": zoom}, "current_position": self.camera.position()}
@@ -0,0 +1,451 @@
+"""
+Local ONVIF PTZ camera simulator.
+
+Speaks the subset of devicemgmt/media/ptz used by main.py and PTZCommands
+(GetCapabilities, GetProfiles, ContinuousMove, Stop, GetStatus, AbsoluteMove,
+GetConfigurationOptions) over SOAP 1.2, backed by a kinematic model with
+configurable speeds, limits and injected response latency. ONVIFCamera
+connects to it unchanged:
+
+    python onvif_sim.py --port 8080 --latency-ms 40
+    ONVIFCamera('127.0.0.1', 8080, 'admin', 'admin', wsdl_dir='wsdl')
+
+The default speeds match the constants in ptz_commands.py at pt_speed=0.2.
+SimulatedView renders the camera's current view of a synthetic panorama for
+image-based routines (calibration).
+"""
+import argparse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import cv2
+import numpy as np
+
+import ptz_commands
+
+SOAP_ENV = "http://www.w3.org/2003/05/soap-envelope"
+NAMESPACES = {
+    "tds": "http://www.onvif.org/ver10/device/wsdl",
+    "trt": "http://www.onvif.org/ver10/media/wsdl",
+    "tptz": "http://www.onvif.org/ver20/ptz/wsdl",
+    "tt": "http://www.onvif.org/ver10/schema",
+}
+PROFILE_TOKEN = "Profile_1"
+PTZ_CONFIG_TOKEN = "PTZConfiguration_1"
+
+DEFAULT_PT_SPEED = 0.2
+
+
+class Axis:
+    """One motor axis moving at a commanded velocity or towards a target, clamped to limits."""
+
+    def __init__(self, name, minimum, maximum, max_speed, position):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_speed = max_speed
+        self.position = position
+        self.velocity = 0.0
+        self.target = None
+
+    def advance(self, dt):
+        if self.target is not None:
+            step = abs(self.velocity) * dt
+            delta = self.target - self.position
+            if abs(delta) <= step:
+                self.position = self.target
+                self.target = None
+                self.velocity = 0.0
+            else:
+                self.position += step if delta > 0 else -step
+        else:
+            self.position += self.velocity * dt
+        if self.position <= self.minimum or self.position >= self.maximum:
+            self.position = min(max(self.position, self.minimum), self.maximum)
+            if self.target is None:
+                self.velocity = 0.0
+
+    def move(self, normalized_velocity):
+        self.target = None
+        self.velocity = max(-1.0, min(1.0, normalized_velocity)) * self.max_speed
+
+    def move_to(self, position, normalized_speed=1.0):
+        self.target = min(max(position, self.minimum), self.maximum)
+        self.velocity = max(0.0, min(1.0, normalized_speed)) * self.max_speed
+
+    def stop(self):
+        self.target = None
+        self.velocity = 0.0
+
+    @property
+    def moving(self):
+        return self.velocity != 0.0
+
+    def to_normalized(self, value=None, signed=True):
+        value = self.position if value is None else value
+        span = self.maximum - self.minimum
+        fraction = (value - self.minimum) / span if span else 0.0
+        return fraction * 2 - 1 if signed else fraction
+
+    def from_normalized(self, value, signed=True):
+        fraction = (value + 1) / 2 if signed else value
+        return self.minimum + fraction * (self.maximum - self.minimum)
+
+
+class SimulatedPTZ:
+    """Kinematic model of the camera. Positions in degrees (pan/tilt) and zoom level."""
+
+    def __init__(self, pan_speed_degps=None, tilt_speed_degps=None, zoom_speed_levelps=None,
+                 pan_limits=(ptz_commands.MIN_PAN_ANGLE, ptz_commands.MAX_PAN_ANGLE),
+                 tilt_limits=(ptz_commands.MIN_TILT_ANGLE, ptz_commands.MAX_TILT_ANGLE),
+                 zoom_limits=(ptz_commands.MIN_ZOOM_LEVEL, ptz_commands.MAX_ZOOM_LEVEL),
+                 start=None):
+        # Full-speed rates derived from the timed-move constants at the default pt_speed
+        if pan_speed_degps is None:
+            pan_speed_degps = ptz_commands.pan_speed_degps / DEFAULT_PT_SPEED
+        if tilt_speed_degps is None:
+            tilt_speed_degps = ptz_commands.tilt_speed_degps / DEFAULT_PT_SPEED
+        if zoom_speed_levelps is None:
+            zoom_speed_levelps = ptz_commands.zoom_speed_levelps / DEFAULT_PT_SPEED
+        start = start or (pan_limits[0], tilt_limits[0], zoom_limits[0])
+        self.pan = Axis("pan", pan_limits[0], pan_limits[1], pan_speed_degps, start[0])
+        self.tilt = Axis("tilt", tilt_limits[0], tilt_limits[1], tilt_speed_degps, start[1])
+        self.zoom = Axis("zoom", zoom_limits[0], zoom_limits[1], zoom_speed_levelps, start[2])
+        self.lock = threading.Lock()
+        self._last_update = time.monotonic()
+
+    def update(self):
+        now = time.monotonic()
+        dt = now - self._last_update
+        self._last_update = now
+        for axis in (self.pan, self.tilt, self.zoom):
+            axis.advance(dt)
+
+    def continuous_move(self, pan_tilt=None, zoom=None):
+        with self.lock:
+            self.update()
+            if pan_tilt is not None:
+                self.pan.move(pan_tilt[0])
+                self.tilt.move(pan_tilt[1])
+            if zoom is not None:
+                self.zoom.move(zoom)
+
+    def absolute_move(self, pan_tilt=None, zoom=None, pan_tilt_speed=1.0, zoom_speed=1.0):
+        with self.lock:
+            self.update()
+            if pan_tilt is not None:
+                self.pan.move_to(self.pan.from_normalized(pan_tilt[0]), pan_tilt_speed)
+                self.tilt.move_to(self.tilt.from_normalized(pan_tilt[1]), pan_tilt_speed)
+            if zoom is not None:
+                self.zoom.move_to(self.zoom.from_normalized(zoom, signed=False), zoom_speed)
+
+    def stop(self, pan_tilt=True, zoom=True):
+        with self.lock:
+            self.update()
+            if pan_tilt:
+                self.pan.stop()
+                self.tilt.stop()
+            if zoom:
+                self.zoom.stop()
+
+    def status(self):
+        with self.lock:
+            self.update()
+            return {
+                "pan": self.pan.position,
+                "tilt": self.tilt.position,
+                "zoom": self.zoom.position,
+                "x": self.pan.to_normalized(),
+                "y": self.tilt.to_normalized(),
+                "z": self.zoom.to_normalized(signed=False),
+                "pan_tilt_moving": self.pan.moving or self.tilt.moving,
+                "zoom_moving": self.zoom.moving,
+            }
+
+
+def synthetic_panorama(width=4096, height=2048, shapes=3000, seed=0):
+    """Textured equirectangular scene (360 x 180 degrees) for SimulatedView."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(40, 215, (height // 32, width // 32, 3), dtype=np.uint8)
+    panorama = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(shapes):
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(4, 60))
+        if rng.random() < 0.5:
+            cv2.rectangle(panorama, (x, y), (x + size, y + int(rng.integers(4, 60))), color, -1)
+        else:
+            cv2.circle(panorama, (x, y), size // 2, color, -1)
+    return panorama
+
+
+class SimulatedView:
+    """
+    What a SimulatedPTZ sees: a rectilinear view into an equirectangular
+    panorama at its current pan/tilt, narrowed by zoom (magnification grows
+    geometrically from 1 at zoom 0 to max_magnification at zoom 1).
+    """
+
+    def __init__(self, camera, panorama=None, size=(640, 360), hfov_deg=60.0, max_magnification=4.0):
+        self.camera = camera
+        self.panorama = synthetic_panorama() if panorama is None else panorama
+        self.size = size
+        self.hfov_deg = hfov_deg
+        self.max_magnification = max_magnification
+        u, v = np.meshgrid(np.arange(size[0], dtype=np.float64), np.arange(size[1], dtype=np.float64))
+        self._x = u - (size[0] - 1) / 2
+        self._y = (size[1] - 1) / 2 - v
+
+    def focal_px(self, zoom):
+        return (self.size[0] / 2) / np.tan(np.radians(self.hfov_deg) / 2) * self.max_magnification ** zoom
+
+    def render(self):
+        status = self.camera.status()
+        f = self.focal_px(status["zoom"])
+        tilt = np.radians(status["tilt"])
+        x, y = self._x / f, self._y / f
+        # Pitch the ray by the tilt, then yaw it by the pan
+        y2 = y * np.cos(tilt) + np.sin(tilt)
+        z2 = np.cos(tilt) - y * np.sin(tilt)
+        lon = np.degrees(np.arctan2(x, z2)) + status["pan"]
+        lat = np.degrees(np.arctan2(y2, np.hypot(x, z2)))
+        height, width = self.panorama.shape[:2]
+        map_x = ((lon % 360) / 360 * width).astype(np.float32)
+        map_y = ((90 - lat) / 180 * height).astype(np.float32)
+        return cv2.remap(self.panorama, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find(element, name):
+    """First descendant with the given local name, ignoring namespaces."""
+    if element is None:
+        return None
+    for child in element.iter():
+        if _local(child.tag) == name and child is not element:
+            return child
+    return None
+
+
+def _vector(element, *attrs):
+    if element is None:
+        return None
+    return tuple(float(element.get(a, 0)) for a in attrs)
+
+
+def _bool(element, default=True):
+    if element is None or element.text is None:
+        return default
+    return element.text.strip().lower() in ("true", "1")
+
+
+class ONVIFSimulator:
+    """HTTP/SOAP front end for a SimulatedPTZ."""
+
+    def __init__(self, camera=None, host="127.0.0.1", port=8080, latency_s=0.0, jitter_s=0.0, verbose=False):
+        self.camera = camera or SimulatedPTZ()
+        self.host = host
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.verbose = verbose
+        self.request_counts = {}
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; don't let Nagle add ~40 ms per reply
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, payload = simulator.handle(body)
+                data = payload.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/soap+xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                if simulator.verbose:
+                    super().log_message(format, *args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="onvif-sim", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, body):
+        try:
+            envelope = ET.fromstring(body)
+            request = next(iter(_find(envelope, "Body")))
+        except Exception:
+            return 400, self._fault("env:Sender", "Malformed SOAP request")
+        operation = _local(request.tag)
+        self.request_counts[operation] = self.request_counts.get(operation, 0) + 1
+        if self.verbose:
+            print(f"ONVIF sim: {operation}")
+
+        delay = self.latency_s + (random.uniform(0, self.jitter_s) if self.jitter_s else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+        handler = getattr(self, f"_op_{operation}", None)
+        if handler is None:
+            return 500, self._fault("env:Receiver", f"Action {operation} not supported by the simulator")
+        return 200, self._envelope(handler(request))
+
+    def _envelope(self, body):
+        namespaces = " ".join(f'xmlns:{k}="{v}"' for k, v in NAMESPACES.items())
+        return (f'<?xml version="1.0" encoding="UTF-8"?>'
+                f'<env:Envelope xmlns:env="{SOAP_ENV}" {namespaces}><env:Body>{body}</env:Body></env:Envelope>')
+
+    def _fault(self, code, reason):
+        return self._envelope(
+            f'<env:Fault><env:Code><env:Value>{code}</env:Value></env:Code>'
+            f'<env:Reason><env:Text xml:lang="en">{reason}</env:Text></env:Reason></env:Fault>')
+
+    # devicemgmt
+
+    def _op_GetCapabilities(self, request):
+        return (f'<tds:GetCapabilitiesResponse><tds:Capabilities>'
+                f'<tt:Device><tt:XAddr>{self.base_url}/onvif/device_service</tt:XAddr></tt:Device>'
+                f'<tt:Media><tt:XAddr>{self.base_url}/onvif/media_service</tt:XAddr>'
+                f'<tt:StreamingCapabilities><tt:RTPMulticast>false</tt:RTPMulticast>'
+                f'<tt:RTP_TCP>true</tt:RTP_TCP><tt:RTP_RTSP_TCP>true</tt:RTP_RTSP_TCP>'
+                f'</tt:StreamingCapabilities></tt:Media>'
+                f'<tt:PTZ><tt:XAddr>{self.base_url}/onvif/ptz_service</tt:XAddr></tt:PTZ>'
+                f'</tds:Capabilities></tds:GetCapabilitiesResponse>')
+
+    def _op_GetDeviceInformation(self, request):
+        return ('<tds:GetDeviceInformationResponse><tds:Manufacturer>cam_api</tds:Manufacturer>'
+                '<tds:Model>ONVIF simulator</tds:Model><tds:FirmwareVersion>1.0</tds:FirmwareVersion>'
+                '<tds:SerialNumber>SIM-0001</tds:SerialNumber><tds:HardwareId>sim</tds:HardwareId>'
+                '</tds:GetDeviceInformationResponse>')
+
+    def _op_GetSystemDateAndTime(self, request):
+        now = datetime.now(timezone.utc)
+        return (f'<tds:GetSystemDateAndTimeResponse><tds:SystemDateAndTime>'
+                f'<tt:DateTimeType>NTP</tt:DateTimeType><tt:DaylightSavings>false</tt:DaylightSavings>'
+                f'<tt:UTCDateTime><tt:Time><tt:Hour>{now.hour}</tt:Hour><tt:Minute>{now.minute}</tt:Minute>'
+                f'<tt:Second>{now.second}</tt:Second></tt:Time><tt:Date><tt:Year>{now.year}</tt:Year>'
+                f'<tt:Month>{now.month}</tt:Month><tt:Day>{now.day}</tt:Day></tt:Date></tt:UTCDateTime>'
+                f'</tds:SystemDateAndTime></tds:GetSystemDateAndTimeResponse>')
+
+    # media
+
+    def _op_GetProfiles(self, request):
+        return (f'<trt:GetProfilesResponse><trt:Profiles token="{PROFILE_TOKEN}" fixed="true">'
+                f'<tt:Name>MainProfile</tt:Name>'
+                f'<tt:PTZConfiguration token="{PTZ_CONFIG_TOKEN}"><tt:Name>PTZ</tt:Name>'
+                f'<tt:UseCount>1</tt:UseCount><tt:NodeToken>PTZNode_1</tt:NodeToken>'
+                f'</tt:PTZConfiguration></trt:Profiles></trt:GetProfilesResponse>')
+
+    # ptz
+
+    def _op_ContinuousMove(self, request):
+        velocity = _find(request, "Velocity")
+        self.camera.continuous_move(
+            pan_tilt=_vector(_find(velocity, "PanTilt"), "x", "y"),
+            zoom=(_vector(_find(velocity, "Zoom"), "x") or (None,))[0])
+        return '<tptz:ContinuousMoveResponse/>'
+
+    def _op_AbsoluteMove(self, request):
+        position = _find(request, "Position")
+        speed = _find(request, "Speed")
+        pan_tilt_speed = _vector(_find(speed, "PanTilt"), "x")
+        zoom_speed = _vector(_find(speed, "Zoom"), "x")
+        self.camera.absolute_move(
+            pan_tilt=_vector(_find(position, "PanTilt"), "x", "y"),
+            zoom=(_vector(_find(position, "Zoom"), "x") or (None,))[0],
+            pan_tilt_speed=pan_tilt_speed[0] if pan_tilt_speed else 1.0,
+            zoom_speed=zoom_speed[0] if zoom_speed else 1.0)
+        return '<tptz:AbsoluteMoveResponse/>'
+
+    def _op_Stop(self, request):
+        self.camera.stop(pan_tilt=_bool(_find(request, "PanTilt")), zoom=_bool(_find(request, "Zoom")))
+        return '<tptz:StopResponse/>'
+
+    def _op_GetStatus(self, request):
+        status = self.camera.status()
+        utc = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return (f'<tptz:GetStatusResponse><tptz:PTZStatus>'
+                f'<tt:Position><tt:PanTilt x="{status["x"]:.6f}" y="{status["y"]:.6f}"/>'
+                f'<tt:Zoom x="{status["z"]:.6f}"/></tt:Position>'
+                f'<tt:MoveStatus><tt:PanTilt>{"MOVING" if status["pan_tilt_moving"] else "IDLE"}</tt:PanTilt>'
+                f'<tt:Zoom>{"MOVING" if status["zoom_moving"] else "IDLE"}</tt:Zoom></tt:MoveStatus>'
+                f'<tt:UtcTime>{utc}</tt:UtcTime></tptz:PTZStatus></tptz:GetStatusResponse>')
+
+    def _op_GetConfigurationOptions(self, request):
+        def space_2d(name, uri):
+            return (f'<tt:{name}><tt:URI>{uri}</tt:URI><tt:XRange><tt:Min>-1</tt:Min><tt:Max>1</tt:Max></tt:XRange>'
+                    f'<tt:YRange><tt:Min>-1</tt:Min><tt:Max>1</tt:Max></tt:YRange></tt:{name}>')
+
+        def space_1d(name, uri, minimum=0):
+            return (f'<tt:{name}><tt:URI>{uri}</tt:URI><tt:XRange><tt:Min>{minimum}</tt:Min>'
+                    f'<tt:Max>1</tt:Max></tt:XRange></tt:{name}>')
+
+        spaces = "http://www.onvif.org/ver10/tptz"
+        return ('<tptz:GetConfigurationOptionsResponse><tptz:PTZConfigurationOptions><tt:Spaces>'
+                + space_2d("AbsolutePanTiltPositionSpace", f"{spaces}/PanTiltSpaces/PositionGenericSpace")
+                + space_1d("AbsoluteZoomPositionSpace", f"{spaces}/ZoomSpaces/PositionGenericSpace")
+                + space_2d("ContinuousPanTiltVelocitySpace", f"{spaces}/PanTiltSpaces/VelocityGenericSpace")
+                + space_1d("ContinuousZoomVelocitySpace", f"{spaces}/ZoomSpaces/VelocityGenericSpace", -1)
+                + space_1d("PanTiltSpeedSpace", f"{spaces}/PanTiltSpaces/GenericSpeedSpace")
+                + space_1d("ZoomSpeedSpace", f"{spaces}/ZoomSpaces/ZoomGenericSpeedSpace")
+                + '</tt:Spaces><tt:PTZTimeout><tt:Min>PT1S</tt:Min><tt:Max>PT60S</tt:Max></tt:PTZTimeout>'
+                '</tptz:PTZConfigurationOptions></tptz:GetConfigurationOptionsResponse>')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local ONVIF PTZ camera simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Fixed delay added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra delay up to this value")
+    parser.add_argument("--pan-speed", type=float, help="Pan speed at full velocity (deg/s)")
+    parser.add_argument("--tilt-speed", type=float, help="Tilt speed at full velocity (deg/s)")
+    parser.add_argument("--zoom-speed", type=float, help="Zoom speed at full velocity (levels/s)")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    camera = SimulatedPTZ(pan_speed_degps=args.pan_speed, tilt_speed_degps=args.tilt_speed,
+                          zoom_speed_levelps=args.zoom_speed)
+    simulator = ONVIFSimulator(camera, host=args.host, port=args.port, latency_s=args.latency_ms / 1000,
+                               jitter_s=args.jitter_ms / 1000, verbose=args.verbose)
+    print(f"ONVIF simulator listening on {simulator.base_url}")
+    try:
+        simulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import requests
+from requests.adapters import HTTPAdapter
+from zeep.transports import Transport
+
+CONNECT_TIMEOUT_S = 3
+OPERATION_TIMEOUT_S = 5
+POOL_SIZE = 4
+
+
+def make_transport(pool_size=POOL_SIZE, timeout_s=CONNECT_TIMEOUT_S, operation_timeout_s=OPERATION_TIMEOUT_S):
+    """
+    zeep transport for ONVIFCamera(transport=...): one keep-alive session shared
+    by the device, media and PTZ services, so every SOAP call reuses an open
+    connection. Proxy/netrc lookups from the environment are disabled, they cost
+    more than the POST itself on a LAN camera, and calls get a timeout instead of
+    hanging forever.
+    """
+    session = requests.Session()
+    session.trust_env = False
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return Transport(session=session, timeout=timeout_s, operation_timeout=operation_timeout_s)
@@ -0,0 +1,203 @@
+"""
+Perceptual-hash index of the pictures, for near-duplicate and similar-scene lookup.
+
+Every capture gets a 64-bit difference hash (dHash: a 9x8 grayscale thumbnail,
+one bit per pair of neighbouring pixels), which barely changes with noise or
+JPEG re-encoding but does with the scene. Hashes are kept per location in
+{pictures_path}/.index/{location}.dhash as fixed 16-byte records (capture time
+as YYYYmmddHHMMSS, hash), appended on capture. A query loads a location's
+records into two numpy arrays (cached until the file changes) and computes
+the Hamming distance to all of them at once, so it stays in milliseconds for
+a million pictures.
+
+Pictures taken before the index existed are hashed from a reduced decode with:
+
+    python picture_index.py /config/pictures/cam_api [--layout ...] [--location bomba]
+"""
+import argparse
+from datetime import datetime
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from picture_store import DEFAULT_LAYOUT, Picture, PictureStore, parse_name, picture_name
+
+INDEX_FOLDER = ".index"
+RECORD = np.dtype([("time", "<i8"), ("hash", "<u8")])
+DUPLICATE_DISTANCE = 6     # differing bits (of 64) below which two pictures are near-duplicates
+TIME_FORMAT = "%Y%m%d%H%M%S"
+
+_BIT_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(frame):
+    """64-bit difference hash of a BGR or grayscale frame."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def file_hash(path):
+    """dHash of a picture file from a 1/8 scale decode, or None if it can't be read."""
+    frame = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    return dhash(frame) if frame is not None else None
+
+
+def hamming(hashes, h):
+    """Differing bits between each of hashes (uint64 array) and h."""
+    x = np.bitwise_xor(hashes, np.uint64(h))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    return _BIT_COUNTS[x.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+def skip_near_duplicates(hashes, max_distance=DUPLICATE_DISTANCE):
+    """Mask keeping each picture that differs from the last kept one by more than max_distance bits."""
+    keep = np.zeros(len(hashes), dtype=bool)
+    last = None
+    for i, h in enumerate(int(h) for h in hashes):
+        if last is None or (h ^ last).bit_count() > max_distance:
+            keep[i] = True
+            last = h
+    return keep
+
+
+def _time_key(when):
+    return int(when.strftime(TIME_FORMAT))
+
+
+def _from_key(key):
+    return datetime.strptime(str(int(key)), TIME_FORMAT)
+
+
+class PictureIndex:
+    def __init__(self, store):
+        self.store = store
+        self.path = os.path.join(store.root, INDEX_FOLDER)
+        self._cache = {}    # location -> (file stat, times, hashes)
+        self._lock = threading.RLock()
+
+    def _file(self, location):
+        return os.path.join(self.path, f"{location}.dhash")
+
+    def add(self, location, when, h):
+        """Record the hash of the picture of location taken at `when`."""
+        record = np.array([(_time_key(when), h)], dtype=RECORD)
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file(location), "ab") as f:
+                f.write(record.tobytes())
+
+    def load(self, location):
+        """(times, hashes) arrays of a location in time order; the last record wins for a repeated time."""
+        path = self._file(location)
+        with self._lock:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return np.empty(0, np.int64), np.empty(0, np.uint64)
+            key = (stat.st_mtime_ns, stat.st_size)
+            cached = self._cache.get(location)
+            if cached and cached[0] == key:
+                return cached[1], cached[2]
+            records = np.fromfile(path, dtype=RECORD, count=stat.st_size // RECORD.itemsize)
+            # Stable sort by time, then keep the last record of each time
+            records = records[np.argsort(records["time"], kind="stable")]
+            last = np.append(records["time"][1:] != records["time"][:-1], True)
+            times, hashes = records["time"][last], records["hash"][last]
+            self._cache[location] = (key, times, hashes)
+            return times, hashes
+
+    def remove(self, location, paths):
+        """Drop the records of removed picture files, e.g. after retention deleted them."""
+        parsed = [parse_name(os.path.basename(path)) for path in paths]
+        drop = [_time_key(p[0]) for p in parsed if p and p[1] == location]
+        if not drop:
+            return
+        with self._lock:
+            times, hashes = self.load(location)
+            keep = ~np.isin(times, np.array(drop, dtype=np.int64))
+            records = np.empty(int(keep.sum()), dtype=RECORD)
+            records["time"], records["hash"] = times[keep], hashes[keep]
+            tmp = f"{self._file(location)}.tmp"
+            records.tofile(tmp)
+            os.replace(tmp, self._file(location))
+
+    def on_retention(self, location, removed, rewritten):
+        """Retention listener; re-encoded pictures keep their hash."""
+        self.remove(location, removed)
+
+    def hash_of(self, location, when):
+        times, hashes = self.load(location)
+        i = np.searchsorted(times, _time_key(when))
+        return int(hashes[i]) if i < len(times) and times[i] == _time_key(when) else None
+
+    def latest(self, location):
+        """(Picture, hash) of the last indexed picture of location, or None."""
+        times, hashes = self.load(location)
+        return (self._picture(location, times[-1]), int(hashes[-1])) if len(times) else None
+
+    def hashes_for(self, location, pictures):
+        """Hashes of the given pictures, from the index or, for pictures not in it, from the files."""
+        times, hashes = self.load(location)
+        keys = np.array([_time_key(p.timestamp) for p in pictures], dtype=np.int64)
+        i = np.searchsorted(times, keys)
+        found = i < len(times)
+        found[found] = times[i[found]] == keys[found]
+        result = np.zeros(len(keys), dtype=np.uint64)
+        result[found] = hashes[i[found]]
+        for j in np.flatnonzero(~found):
+            h = file_hash(pictures[j].path)
+            result[j] = h if h is not None else 0
+        return result
+
+    def nearest(self, location, h, limit=20, max_distance=None):
+        """Pictures of location closest to hash h, as (Picture, distance), nearest first."""
+        times, hashes = self.load(location)
+        distances = hamming(hashes, h)
+        candidates = np.flatnonzero(distances <= max_distance) if max_distance is not None else np.arange(len(times))
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(distances[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.lexsort((times[candidates], distances[candidates]))]
+        return [(self._picture(location, times[i]), int(distances[i])) for i in candidates]
+
+    def duplicates(self, location, h, max_distance=DUPLICATE_DISTANCE, limit=1000):
+        """Near-duplicates of hash h in location, as (Picture, distance), nearest first."""
+        return self.nearest(location, h, limit, max_distance)
+
+    def _picture(self, location, key):
+        when = _from_key(key)
+        name = picture_name(location, when)
+        return Picture(when, location, self.store.resolve(name) or os.path.join(self.store.folder(location, when), name))
+
+    def update(self, location, batch_size=500, log=print):
+        """Hash the pictures of location that aren't in the index yet. Returns how many were added."""
+        times, _ = self.load(location)
+        known = set(times.tolist())
+        missing = [p for p in self.store.pictures(location) if _time_key(p.timestamp) not in known]
+        added = 0
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            records = [(_time_key(p.timestamp), h) for p in batch if (h := file_hash(p.path)) is not None]
+            with self._lock:
+                os.makedirs(self.path, exist_ok=True)
+                with open(self._file(location), "ab") as f:
+                    f.write(np.array(records, dtype=RECORD).tobytes())
+            added += len(records)
+            log(f"{location}: hashed {start + len(batch)}/{len(missing)}")
+        return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the pictures missing from the perceptual-hash index")
+    parser.add_argument("root", help="Pictures folder (pictures_path)")
+    parser.add_argument("--layout", default=DEFAULT_LAYOUT, help=f"Folder layout (default: {DEFAULT_LAYOUT})")
+    parser.add_argument("--location", help="Only this location (default: all)")
+    args = parser.parse_args()
+    store = PictureStore(args.root, args.layout)
+    index = PictureIndex(store)
+    for location in [args.location] if args.location else store.locations():
+        print(f"{location}: {index.update(location)} pictures added to the index")
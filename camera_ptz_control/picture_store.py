@@ -0,0 +1,202 @@
+"""
+Where pictures are stored.
+
+Pictures are named {YYYYmmdd_HHMMSS}_{location}.jpg (API captures use
+"{suffix}_api" as location) and stored under the pictures path in folders given
+by a layout template, the "pictures_layout" option:
+
+    "{location}/{YYYY}/{MM}/{DD}"   (default) one folder per location and day
+    ""                              everything in one folder, the old layout
+
+Listing one location or one date range only reads the folders involved. Files
+still in the flat pictures folder, from before the layout was set, are listed
+and resolved too, so they stay reachable while they are migrated:
+
+    python picture_store.py /config/pictures/cam_api [--layout ...] [--batch 200] [--pause 0.5] [--dry-run]
+
+moves them into the layout in batches, while the API keeps running.
+"""
+import argparse
+from collections import namedtuple
+from datetime import datetime, timedelta
+import os
+import string
+import time
+
+DEFAULT_LAYOUT = "{location}/{YYYY}/{MM}/{DD}"
+LAYOUT_FIELDS = {"location", "YYYY", "MM", "DD"}
+EXTENSIONS = (".jpg", ".jpeg", ".png")
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+Picture = namedtuple("Picture", ["timestamp", "location", "path"])
+
+
+def picture_name(location, when):
+    return f"{when.strftime(TIMESTAMP_FORMAT)}_{location}.jpg"
+
+
+def parse_name(filename):
+    """(timestamp, location) from a picture file name, or None if it isn't one."""
+    stem, ext = os.path.splitext(filename)
+    if ext.lower() not in EXTENSIONS:
+        return None
+    parts = stem.split("_", 2)
+    if len(parts) < 3:
+        return None
+    try:
+        return datetime.strptime(f"{parts[0]}_{parts[1]}", TIMESTAMP_FORMAT), parts[2]
+    except ValueError:
+        return None
+
+
+class PictureStore:
+    def __init__(self, root, layout=DEFAULT_LAYOUT, ignore=()):
+        """ignore: folder names in root that aren't locations, e.g. other cameras' pictures."""
+        fields = {field for _, field, _, _ in string.Formatter().parse(layout) if field}
+        if not fields <= LAYOUT_FIELDS:
+            raise ValueError(f"Unknown fields {sorted(fields - LAYOUT_FIELDS)} in pictures layout '{layout}'")
+        self.root = root
+        self.layout = layout.strip("/")
+        self._dated = bool(fields & {"YYYY", "MM", "DD"})
+        self.ignore = set(ignore)
+
+    def folder(self, location, when):
+        """Folder a picture of location taken at `when` belongs in."""
+        if not self.layout:
+            return self.root
+        return os.path.join(self.root, self.layout.format(
+            location=location, YYYY=f"{when:%Y}", MM=f"{when:%m}", DD=f"{when:%d}"))
+
+    def path_for(self, location, when):
+        """Full path for a new picture, creating its folder."""
+        folder = self.folder(location, when)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, picture_name(location, when))
+
+    def resolve(self, path):
+        """
+        Current path of a picture given its file name or any earlier path, e.g.
+        one returned before the files were migrated. None if it doesn't exist.
+        Paths outside the pictures folder are only looked up by file name.
+        """
+        if os.path.isabs(path) and self._inside(path) and os.path.exists(path):
+            return path
+        name = os.path.basename(path)
+        candidates = [self.layout_path(name)] if parse_name(name) else []
+        candidates.append(os.path.join(self.root, name))
+        return next((c for c in candidates if os.path.exists(c)), None)
+
+    def _inside(self, path):
+        root = os.path.realpath(self.root)
+        return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+    def layout_path(self, name):
+        """Where the layout puts a picture file name, whether or not it's written yet; None for other names."""
+        parsed = parse_name(os.path.basename(name))
+        return os.path.join(self.folder(parsed[1], parsed[0]), os.path.basename(name)) if parsed else None
+
+    def locations(self):
+        """Locations with pictures, from the folder names (and any flat files)."""
+        found = {p.location for p in self._flat_pictures()}
+        if not os.path.isdir(self.root):
+            return []  # nothing captured yet
+        if self.layout.startswith("{location}"):
+            with os.scandir(self.root) as entries:
+                found.update(e.name for e in entries if e.is_dir() and self._listed(e.name))
+        elif self.layout:
+            found.update(p.location for p in self._walk(self.root))
+        return sorted(found)
+
+    def pictures(self, location=None, since=None, until=None):
+        """Pictures of one location (or all) between since and until, in time order."""
+        found = [p for p in self._flat_pictures() if self._matches(p, location, since, until)]
+        if self.layout:
+            for folder in self._folders(location, since, until):
+                found += [p for p in self._walk(folder) if self._matches(p, location, since, until)]
+        return sorted(found)
+
+    @staticmethod
+    def _matches(picture, location, since, until):
+        return ((location is None or picture.location == location) and
+                (since is None or picture.timestamp >= since) and
+                (until is None or picture.timestamp <= until))
+
+    def _folders(self, location, since, until):
+        """Folders that can hold the matching pictures; for a date range, one per day."""
+        if location is None and "{location}" in self.layout:
+            if not self.layout.startswith("{location}"):
+                return [self.root]
+            locations = self.locations()
+        else:
+            locations = [location]
+        if self._dated and since and until:
+            days = [since.date() + timedelta(days=i) for i in range((until.date() - since.date()).days + 1)]
+            folders = {self.folder(loc, day) for loc in locations for day in days}
+        else:
+            # Everything under the part of the layout before the first date field
+            prefix = self.layout.split("{YYYY}")[0].split("{MM}")[0].split("{DD}")[0]
+            folders = {os.path.join(self.root, prefix.format(location=loc)) for loc in locations}
+        return sorted(f for f in folders if os.path.isdir(f))
+
+    def _listed(self, name):
+        """Whether a folder in root holds pictures; hidden folders (such as the index) and ignored ones don't."""
+        return not name.startswith(".") and name not in self.ignore
+
+    def _flat_pictures(self):
+        """Pictures directly in the root folder (the flat layout)."""
+        if not os.path.isdir(self.root):
+            return []
+        with os.scandir(self.root) as entries:
+            return [Picture(*parsed, entry.path) for entry in entries
+                    if entry.is_file() and (parsed := parse_name(entry.name))]
+
+    def _walk(self, folder):
+        for dirpath, dirnames, filenames in os.walk(folder):
+            if os.path.normpath(dirpath) == os.path.normpath(self.root):
+                dirnames[:] = [d for d in dirnames if self._listed(d)]
+                continue  # flat files are listed separately
+            for filename in filenames:
+                parsed = parse_name(filename)
+                if parsed:
+                    yield Picture(*parsed, os.path.join(dirpath, filename))
+
+
+def migrate(store, batch_size=200, pause_s=0.5, dry_run=False, log=print):
+    """
+    Move the pictures in the flat root folder into the store's layout, batch_size
+    files at a time with a pause in between so the API and file shares stay
+    responsive. Returns the number of files moved (or to be moved, with dry_run).
+    """
+    if not store.layout:
+        log("Layout is flat, nothing to migrate")
+        return 0
+    pending = store._flat_pictures()
+    log(f"{len(pending)} pictures to move into '{store.layout}'")
+    moved = 0
+    for start in range(0, len(pending), batch_size):
+        for picture in pending[start:start + batch_size]:
+            target = os.path.join(store.folder(picture.location, picture.timestamp), os.path.basename(picture.path))
+            if dry_run:
+                moved += 1
+                continue
+            if os.path.exists(target):
+                log(f"Skipping {picture.path}: {target} already exists")
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(picture.path, target)
+            moved += 1
+        log(f"{'Would move' if dry_run else 'Moved'} {moved}/{len(pending)}")
+        if not dry_run and start + batch_size < len(pending):
+            time.sleep(pause_s)
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move flat pictures into the dated folder layout")
+    parser.add_argument("root", help="Pictures folder (pictures_path)")
+    parser.add_argument("--layout", default=DEFAULT_LAYOUT, help=f"Folder layout (default: {DEFAULT_LAYOUT})")
+    parser.add_argument("--batch", type=int, default=200, help="Files moved per batch")
+    parser.add_argument("--pause", type=float, default=0.5, help="Seconds to pause between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be moved")
+    args = parser.parse_args()
+    migrate(PictureStore(args.root, args.layout), args.batch, args.pause, args.dry_run)
@@ -0,0 +1,60 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import threading
+
+
+class PlateCache:
+    """
+    In-process cache of recently saved plates with a TTL and LRU eviction.
+
+    Maps plate text to the time it was last saved, so the dedupe window can be
+    answered locally and DynamoDB is only queried on a miss.
+    """
+
+    def __init__(self, max_size=1024, ttl_s=60):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen_since(self, plate_text, since):
+        """True if the plate was saved after `since` (a cache hit), False on a miss."""
+        with self._lock:
+            last_seen = self._entries.get(plate_text)
+            if last_seen is not None and datetime.now() - last_seen > timedelta(seconds=self.ttl_s):
+                del self._entries[plate_text]
+                last_seen = None
+            if last_seen is not None and last_seen > since:
+                self._entries.move_to_end(plate_text)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def put(self, plate_text, seen_at):
+        with self._lock:
+            previous = self._entries.get(plate_text)
+            if previous is not None and previous > seen_at:
+                seen_at = previous
+            self._entries[plate_text] = seen_at
+            self._entries.move_to_end(plate_text)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
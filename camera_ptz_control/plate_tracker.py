@@ -0,0 +1,179 @@
+from collections import Counter
+import itertools
+import time
+
+from plate_format import test_match
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+def box_centroid_distance(a, b):
+    """Distance between box centres, relative to the larger box width."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    dx = (ax + aw / 2) - (bx + bw / 2)
+    dy = (ay + ah / 2) - (by + bh / 2)
+    return (dx * dx + dy * dy) ** 0.5 / max(aw, bw, 1)
+
+
+def vote_plate(reads):
+    """
+    Combine several plate reads into one by per-character majority voting.
+    Returns (plate, confidence) where confidence is the weakest per-character
+    agreement ratio, or ("", 0.0) if no consistent plate can be built.
+    """
+    reads = [r for r in reads if r]
+    if not reads:
+        return "", 0.0
+    # Only reads of the most common length can be aligned character by character
+    length = Counter(len(r) for r in reads).most_common(1)[0][0]
+    reads = [r for r in reads if len(r) == length]
+
+    plate = ""
+    confidence = 1.0
+    for position in range(length):
+        char, count = Counter(r[position] for r in reads).most_common(1)[0]
+        plate += char
+        confidence = min(confidence, count / len(reads))
+
+    if not test_match(plate):
+        return "", 0.0
+    return plate, confidence
+
+
+class PlateTrack:
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = tuple(int(v) for v in box)
+        self.first_seen = now
+        self.last_seen = now
+        self.misses = 0
+        self.ocr_attempts = 0
+        self.reads = []
+        self.rois = {}
+
+    def add_read(self, plate_text, roi=None):
+        self.ocr_attempts += 1
+        if plate_text:
+            self.reads.append(plate_text)
+            if roi is not None:
+                self.rois.setdefault(plate_text, roi)
+
+    def vote(self):
+        return vote_plate(self.reads)
+
+    def best_roi(self, plate):
+        """ROI of a read that agrees with the voted plate, else of any read."""
+        if plate in self.rois:
+            return self.rois[plate]
+        return next(iter(self.rois.values()), None)
+
+
+class PlateTracker:
+    """
+    Lightweight IoU/centroid tracker over cascade detections.
+
+    Each detection is matched to an existing track (by IoU, then by centroid
+    distance for small or fast-moving boxes) so the same car is only OCR'd a
+    few times. When a track has not been seen for `max_misses` detection
+    cycles it is finished and its reads are voted into a single plate.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_centroid_distance=0.75, max_misses=3,
+                 max_ocr_per_track=3, min_agreeing_reads=2):
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.max_misses = max_misses
+        self.max_ocr_per_track = max_ocr_per_track
+        self.min_agreeing_reads = min_agreeing_reads
+        self.tracks = []
+        self.finished = []
+        self._ids = itertools.count(1)
+
+    def update(self, boxes, now=None):
+        """
+        Match detections to tracks. Returns the track for each box, in the
+        same order as `boxes`.
+        """
+        if now is None:
+            now = time.time()
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        assigned = [None] * len(boxes)
+        free_tracks = set(range(len(self.tracks)))
+
+        # Greedy matching, best overlaps first
+        candidates = []
+        for bi, box in enumerate(boxes):
+            for ti, track in enumerate(self.tracks):
+                iou = box_iou(box, track.box)
+                if iou >= self.iou_threshold:
+                    candidates.append((iou, bi, ti))
+        for _, bi, ti in sorted(candidates, reverse=True):
+            if assigned[bi] is None and ti in free_tracks:
+                assigned[bi] = self.tracks[ti]
+                free_tracks.discard(ti)
+
+        # Fall back to centroid distance for boxes without overlap
+        for bi, box in enumerate(boxes):
+            if assigned[bi] is not None or not free_tracks:
+                continue
+            ti = min(free_tracks, key=lambda t: box_centroid_distance(box, self.tracks[t].box))
+            if box_centroid_distance(box, self.tracks[ti].box) <= self.max_centroid_distance:
+                assigned[bi] = self.tracks[ti]
+                free_tracks.discard(ti)
+
+        for bi, box in enumerate(boxes):
+            track = assigned[bi]
+            if track is None:
+                track = PlateTrack(next(self._ids), box, now)
+                self.tracks.append(track)
+            else:
+                track.box = box
+                track.last_seen = now
+                track.misses = 0
+            assigned[bi] = track
+
+        for ti in free_tracks:
+            self.tracks[ti].misses += 1
+
+        ended = [t for t in self.tracks if t.misses > self.max_misses]
+        if ended:
+            self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+            self.finished.extend(ended)
+        return assigned
+
+    def needs_ocr(self, track):
+        """OCR only until the read budget is spent or enough reads agree."""
+        if track.ocr_attempts >= self.max_ocr_per_track:
+            return False
+        if not track.reads:
+            return True
+        top_count = Counter(track.reads).most_common(1)[0][1]
+        return top_count < self.min_agreeing_reads
+
+    def pop_finished(self):
+        """Return (track, plate, confidence) for every ended track with a voted plate."""
+        results = []
+        for track in self.finished:
+            plate, confidence = track.vote()
+            if plate:
+                results.append((track, plate, confidence))
+            else:
+                print(f"🔴 Track {track.track_id} ended without a valid plate ({track.ocr_attempts} reads)")
+        self.finished = []
+        return results
+
+    def flush(self):
+        """End every active track, e.g. on shutdown."""
+        self.finished.extend(self.tracks)
+        self.tracks = []
+        return self.pop_finished()
@@ -0,0 +1,252 @@
+from collections import deque
+import json
+import os
+import queue
+import threading
+import time
+
+import metrics
+
+
+class PlateWriter:
+    """
+    Write-behind persistence for plate sightings.
+
+    Sightings are queued without blocking and a background thread groups them
+    into `batch_writer` batches, retrying with exponential backoff. Batches
+    that still fail are appended to a local JSON-lines spool file, which is
+    replayed once the table can be reached again. Sightings the spool can't
+    take either (disk full, read-only mount) are dropped and counted.
+
+    stats() are logged every stats_interval_s while there is activity, and
+    whenever the table stops or starts answering.
+    """
+
+    def __init__(self, get_table, is_duplicate=None, max_queue=1000, batch_size=25,
+                 flush_interval_s=1.0, max_retries=3, base_backoff_s=0.5, max_backoff_s=60.0,
+                 spool_path=os.path.join('output', 'plate_spool.jsonl'), stats_interval_s=60.0):
+        self.get_table = get_table
+        self.is_duplicate = is_duplicate
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.max_retries = max_retries
+        self.base_backoff_s = base_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.spool_path = spool_path
+        self.stats_interval_s = stats_interval_s
+
+        self.written = 0
+        self.batches = 0
+        self.duplicates = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.failed_attempts = 0
+        self.last_error = None
+        self.healthy = True
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spool_lock = threading.Lock()
+        self._spool_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._recent_writes = deque(maxlen=1000)
+        self._next_replay_at = 0.0
+        self._replay_backoff_s = base_backoff_s
+        self._logged = (True, 0, 0, 0, 0, 0, 0)   # health and counters at the last stats log
+        self._next_stats_at = 0.0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._recover_spool()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="plate-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Flush what can be written within `timeout`; spool the rest."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            self._spill(leftover)
+
+    def submit(self, item):
+        """Queue a sighting. Never blocks: spills to disk if the queue is full."""
+        try:
+            self._queue.put_nowait(item)
+            metrics.WRITER_QUEUE_DEPTH.labels("plates").set(self._queue.qsize())
+            return True
+        except queue.Full:
+            print(f"Plate writer queue full, spooling {item.get('texto_matricula')}")
+            self._spill([item])
+            return False
+
+    def stats(self):
+        now = time.monotonic()
+        written_last_minute = sum(n for t, n in self._recent_writes if now - t <= 60)
+        return {
+            "queued": self._queue.qsize(),
+            "spooled": self._spool_count,
+            "written": self.written,
+            "batches": self.batches,
+            "duplicates": self.duplicates,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "failed_attempts": self.failed_attempts,
+            "writes_per_s": written_last_minute / 60.0,
+            "healthy": self.healthy,
+            "last_error": self.last_error,
+        }
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            metrics.WRITER_QUEUE_DEPTH.labels("plates").set(self._queue.qsize())
+            if batch:
+                self._write(batch, check_duplicates=True)
+            elif self._spool_count and time.monotonic() >= self._next_replay_at:
+                self._replay()
+            self._log_stats()
+
+    def _log_stats(self):
+        state = (self.healthy, self.written, self.duplicates, self.spilled, self.replayed, self.dropped,
+                 self._queue.qsize())
+        if state == self._logged:
+            return
+        if state[0] == self._logged[0] and time.monotonic() < self._next_stats_at:
+            return
+        print(f"Plate writer: {self.stats()}")
+        self._logged = state
+        self._next_stats_at = time.monotonic() + self.stats_interval_s
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval_s)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval_s
+        while len(batch) < self.batch_size and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch, check_duplicates=False, spill_on_failure=True, attempts=None):
+        # Only ask the table about duplicates while it is answering; otherwise write through
+        if check_duplicates and self.is_duplicate and self.healthy:
+            fresh = []
+            for item in batch:
+                try:
+                    if self.is_duplicate(item):
+                        self.duplicates += 1
+                        print(f"Skip {item['texto_matricula']} (already in the database).")
+                        continue
+                except Exception as e:
+                    print(f"Could not check {item['texto_matricula']} for duplicates: {e}")
+                fresh.append(item)
+            batch = fresh
+        if not batch:
+            return True
+
+        attempts = attempts or self.max_retries
+        backoff = self.base_backoff_s
+        for attempt in range(1, attempts + 1):
+            try:
+                with self.get_table().batch_writer() as writer:
+                    for item in batch:
+                        writer.put_item(Item=item)
+                self.written += len(batch)
+                self.batches += 1
+                self._recent_writes.append((time.monotonic(), len(batch)))
+                self.healthy = True
+                self._replay_backoff_s = self.base_backoff_s
+                self._next_replay_at = 0.0
+                return True
+            except Exception as e:
+                self.failed_attempts += 1
+                self.last_error = str(e)
+                print(f"Plate batch write failed (attempt {attempt}/{attempts}): {e}")
+                if attempt < attempts:
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff_s)
+
+        self.healthy = False
+        self._next_replay_at = time.monotonic() + self._replay_backoff_s
+        self._replay_backoff_s = min(self._replay_backoff_s * 2, self.max_backoff_s)
+        if spill_on_failure:
+            self._spill(batch)
+        return False
+
+    def _spill(self, items, count=True):
+        """Append items to the spool; those it can't take are dropped, so the writer keeps running."""
+        with self._spool_lock:
+            try:
+                os.makedirs(os.path.dirname(self.spool_path) or '.', exist_ok=True)
+                with open(self.spool_path, "a") as f:
+                    f.write("".join(json.dumps(item) + "\n" for item in items))
+            except OSError as e:
+                # A half-written last line is skipped when the spool is read
+                self.dropped += len(items)
+                self.last_error = str(e)
+                print(f"Could not spool {len(items)} plate(s) to {self.spool_path}, dropped: {e}")
+                return
+            self._spool_count += len(items)
+        if count:
+            self.spilled += len(items)
+        print(f"Spooled {len(items)} plate(s) to {self.spool_path}")
+
+    def _replay(self):
+        replay_path = self.spool_path + ".replaying"
+        with self._spool_lock:
+            if not os.path.exists(self.spool_path):
+                self._spool_count = 0
+                return
+            os.replace(self.spool_path, replay_path)
+            self._spool_count = 0
+        items = self._read_spool(replay_path)
+        print(f"Replaying {len(items)} spooled plate(s)")
+        for i in range(0, len(items), self.batch_size):
+            chunk = items[i:i + self.batch_size]
+            # A single attempt per chunk: the replay itself is retried with backoff
+            if not self._write(chunk, spill_on_failure=False, attempts=1):
+                self._spill(items[i:], count=False)
+                break
+            self.replayed += len(chunk)
+        os.remove(replay_path)
+
+    def _recover_spool(self):
+        """Fold a replay interrupted by a crash back into the spool file."""
+        replay_path = self.spool_path + ".replaying"
+        if os.path.exists(replay_path):
+            self._spill(self._read_spool(replay_path), count=False)
+            os.remove(replay_path)
+        if os.path.exists(self.spool_path):
+            with self._spool_lock:
+                self._spool_count = len(self._read_spool(self.spool_path))
+
+    @staticmethod
+    def _read_spool(path):
+        items = []
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    print(f"Skipping corrupt spool line in {path}")
+        return items
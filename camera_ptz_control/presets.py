@@ -0,0 +1,41 @@
+import json
+
+
+class PresetStore:
+    """Named PTZ positions of one camera, persisted as a JSON file (locations.json)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._presets = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def __contains__(self, name):
+        return name in self._presets
+
+    def __getitem__(self, name):
+        return self._presets[name]
+
+    def names(self):
+        return list(self._presets.keys())
+
+    def items(self):
+        return self._presets.items()
+
+    def save(self, name, position):
+        """
+        Add or update a preset, keeping extra preset settings such as the detection
+        region. Returns True if it already existed.
+        """
+        # Re-read so hand edits to the file since startup are not lost
+        self._presets = self._load()
+        was_updated = name in self._presets
+        self._presets[name] = {**self._presets.get(name, {}), **position}
+        with open(self.path, "w") as f:
+            json.dump(self._presets, f, indent=4)
+        return was_updated
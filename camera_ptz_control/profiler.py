@@ -0,0 +1,62 @@
+from collections import Counter
+import os
+import re
+import sys
+import threading
+import time
+
+MAX_PROFILE_S = 60.0
+DEFAULT_INTERVAL_S = 0.01
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running."""
+
+
+def _thread_label(names, ident):
+    # "Thread-12 (pan_thread)" -> "Thread (pan_thread)" so short-lived threads aggregate
+    return re.sub(r"-\d+", "", names.get(ident, f"thread {ident}"))
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def profile(seconds, interval_s=DEFAULT_INTERVAL_S):
+    """
+    Sample the stacks of every thread in the process for `seconds` (capped at
+    MAX_PROFILE_S) and return them in collapsed-stack format, one
+    "thread;outer;...;inner count" line per distinct stack, ready for
+    flamegraph.pl or speedscope. Only one profile runs at a time.
+    """
+    seconds = min(max(float(seconds), interval_s), MAX_PROFILE_S)
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        own_ident = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        counts = Counter()
+        samples = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(_thread_label(names, ident))
+                counts[";".join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval_s)
+    finally:
+        _running.release()
+
+    print(f"Profiled {samples} samples over {seconds:.1f} s ({len(counts)} distinct stacks)")
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"
@@ -1,6 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
 import time
 import threading
 
+import metrics
+import tracing
+
 MAX_TILT_TIME_S=6
 MAX_TILT_ANGLE=0
 MIN_TILT_ANGLE=-90
@@ -25,77 +29,234 @@ zoom_speed_levelps = (MAX_ZOOM_LEVEL - MIN_ZOOM_LEVEL) / MAX_ZOOM_TIME_S
 
 ORIGIN_PAN_OFFSET_TO_NORTH_DEG=0
 
+DEFAULT_PT_SPEED = 0.2  # the speed the constants above were measured at
+
+SETTLE_TIMEOUT_S = 3.0
+SETTLE_POLL_S = 0.05
+SETTLE_FALLBACK_S = 0.5  # fixed delay for cameras that don't report MoveStatus
+
+
+class MotionPreempted(Exception):
+    """A move was cut short by interrupt(), e.g. for a newer goto or a stop."""
+
+
+def _report_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"PTZ command failed: {future.exception()}")
+
+
 class PTZCommands:
-    def __init__(self, ptz, profile, pt_speed=0.2):
+    def __init__(self, ptz, profile, pt_speed=DEFAULT_PT_SPEED, calibration=None):
         self.ptz = ptz
         self.profile = profile
         self.pt_speed = pt_speed
+        # calibration.Calibration with measured rates; the constants above are used without one
+        self.calibration = calibration
         self.est_pan_angle_deg = MIN_PAN_ANGLE + ORIGIN_PAN_OFFSET_TO_NORTH_DEG
         self.est_tilt_angle_deg = MIN_TILT_ANGLE
         self.est_zoom_level = 0
+        self._requests = {}
+        self._status_supported = None  # unknown until the first GetStatus
+        # One long-lived thread sends every move/stop, in the order they were issued
+        self._sender_thread = None
+        self._sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ptz-sender",
+                                          initializer=self._mark_sender)
+        # Set to cut timed moves short; blocking moves then raise MotionPreempted
+        self.interrupted = threading.Event()
     
     
+    def onvif_call(self, operation, request):
+        """Call an ONVIF PTZ operation, recording its latency."""
+        with metrics.onvif_call(operation):
+            return getattr(self.ptz, operation)(request)
+
+    def request(self, operation):
+        """Request object for operation, built once per profile token and reused."""
+        key = (operation, self.profile.token)
+        req = self._requests.get(key)
+        if req is None:
+            req = self.ptz.create_type(operation)
+            req.ProfileToken = self.profile.token
+            if operation == 'Stop':
+                req.PanTilt = True
+                req.Zoom = True
+            self._requests[key] = req
+        return req
+
+    def _mark_sender(self):
+        self._sender_thread = threading.current_thread()
+
+    def send(self, fn, *args):
+        """Queue a command on the sender thread. Returns its future."""
+        future = self._sender.submit(fn, *args)
+        future.add_done_callback(_report_error)
+        return future
+
+    def call(self, fn, *args):
+        """
+        Run a command on the sender thread and wait for its result. Called from
+        the sender thread itself, it runs inline instead of waiting on itself.
+        """
+        if threading.current_thread() is self._sender_thread:
+            return fn(*args)
+        return self.send(fn, *args).result()
+
+    def continuous_move(self, velocity):
+        """Queue a ContinuousMove at velocity. Returns its future."""
+        return self.send(self._continuous_move, velocity)
+
+    def _continuous_move(self, velocity):
+        # Only the sender thread mutates the shared request
+        req = self.request('ContinuousMove')
+        req.Velocity = velocity
+        return self.onvif_call('ContinuousMove', req)
+
     def stop_ptz(self):
         if not self.ptz or not self.profile:
             print("ONVIF PTZ service not available")
             return
         try:
-            print(self.ptz.Stop({'ProfileToken': self.profile.token,
-                           'PanTilt': True,
-                           'Zoom': True}))
+            print(self.call(self.onvif_call, 'Stop', self.request('Stop')))
             # print(f"    ({round(self.est_pan_angle_deg), round(self.est_tilt_angle_deg)})")
         except Exception as e:
             print(f"Could not stop PTZ: {e}")
 
+    def axis_rate(self, axis):
+        """
+        (rate, offset) used to time moves of 'pan', 'tilt' (degrees per second) or
+        'zoom' (levels per second) at the current speed and zoom level.
+        """
+        if self.calibration:
+            if axis == 'zoom':
+                rate = self.calibration.zoom_rate()
+                if rate:
+                    return rate, 0.0
+            else:
+                rate = self.calibration.rate(axis, self.pt_speed, self.est_zoom_level)
+                if rate:
+                    return rate
+        return {'pan': pan_speed_degps, 'tilt': tilt_speed_degps, 'zoom': zoom_speed_levelps}[axis], 0.0
+
+    def move_time(self, axis, amount):
+        """Seconds to drive axis by amount (degrees, or zoom levels)."""
+        rate, offset = self.axis_rate(axis)
+        return max(abs(amount) - offset, 0.0) / rate
+
+    def _drive(self, axis, amount):
+        """
+        Wait out a timed move of axis by amount, returning early if interrupted.
+        Returns how far the axis got (signed), estimated from the elapsed time.
+        """
+        duration = self.move_time(axis, amount)
+        start = time.perf_counter()
+        if not self.interrupted.wait(duration):
+            return amount
+        rate, offset = self.axis_rate(axis)
+        travelled = min(abs(amount), (time.perf_counter() - start) * rate + offset) if duration else abs(amount)
+        return travelled if amount > 0 else -travelled
+
+    def _check_interrupted(self):
+        if self.interrupted.is_set():
+            raise MotionPreempted("Move interrupted")
+
+    def is_moving(self):
+        """
+        True/False from GetStatus().MoveStatus, or None when the camera doesn't
+        report it (remembered, so it is only asked once) or GetStatus failed.
+        """
+        if not self.ptz or not self.profile or self._status_supported is False:
+            return None
+        try:
+            # Queued behind any pending move/stop so the answer reflects them
+            status = self.call(self.onvif_call, 'GetStatus', self.request('GetStatus'))
+        except Exception as e:
+            # A timeout or dropped connection says nothing about MoveStatus support; ask again next time
+            print(f"Could not get PTZ status: {e}")
+            return None
+        move_status = getattr(status, 'MoveStatus', None)
+        states = [str(getattr(move_status, axis, None) or '').upper() for axis in ('PanTilt', 'Zoom')]
+        states = [state for state in states if state in ('IDLE', 'MOVING')]
+        if not states:
+            if self._status_supported is None:
+                print("Camera does not report MoveStatus, settling with a fixed delay")
+            self._status_supported = False
+            return None
+        self._status_supported = True
+        return 'MOVING' in states
+
+    def wait_settled(self, timeout=SETTLE_TIMEOUT_S, poll=SETTLE_POLL_S, fallback=SETTLE_FALLBACK_S):
+        """
+        Wait until the camera reports pan/tilt and zoom IDLE, up to timeout seconds.
+        Falls back to sleeping `fallback` seconds when MoveStatus isn't available.
+        Returns the seconds waited.
+        """
+        start = time.perf_counter()
+        deadline = start + timeout
+        while True:
+            moving = self.is_moving()
+            if moving is None:
+                time.sleep(fallback)
+                break
+            if not moving:
+                break
+            if time.perf_counter() >= deadline:
+                print(f"PTZ still moving after {timeout} s, continuing")
+                break
+            time.sleep(poll)
+        return time.perf_counter() - start
+
     def pan_speed(self, direction, speed=None):
+        """Queue a continuous pan; returns its future."""
+        return self.send(self._pan_speed, direction, speed)
+
+    def _pan_speed(self, direction, speed=None):
         if not self.ptz or not self.profile:
             print("ONVIF PTZ service not available")
             return
         if speed is None:
             speed = self.pt_speed
-        req = self.ptz.create_type('ContinuousMove')
-        req.ProfileToken = self.profile.token
-        req.Velocity = {'PanTilt': {'x': speed if direction == 'right' else -speed, 'y': 0}}
-        self.ptz.ContinuousMove(req)
+        self._continuous_move({'PanTilt': {'x': speed if direction == 'right' else -speed, 'y': 0}})
 
     def pan_left(self):
-        threading.Thread(target=self.pan_speed, args=('left',), daemon=True).start()
+        return self.pan_speed('left')
 
     def pan_right(self):
-        threading.Thread(target=self.pan_speed, args=('right',), daemon=True).start()
+        return self.pan_speed('right')
 
     def tilt_speed(self, direction, speed=None):
+        """Queue a continuous tilt; returns its future."""
+        return self.send(self._tilt_speed, direction, speed)
+
+    def _tilt_speed(self, direction, speed=None):
         if not self.ptz or not self.profile:
             print("ONVIF PTZ service not available")
             return
         if speed is None:
             speed = self.pt_speed
-        req = self.ptz.create_type('ContinuousMove')
-        req.ProfileToken = self.profile.token
-        req.Velocity = {'PanTilt': {'x': 0, 'y': speed if direction == 'up' else -speed}}
-        self.ptz.ContinuousMove(req)
+        self._continuous_move({'PanTilt': {'x': 0, 'y': speed if direction == 'up' else -speed}})
 
     def tilt_up(self):
-        threading.Thread(target=self.tilt_speed, args=('up',), daemon=True).start()
+        return self.tilt_speed('up')
 
     def tilt_down(self):
-        threading.Thread(target=self.tilt_speed, args=('down',), daemon=True).start()
+        return self.tilt_speed('down')
 
     def zoom_in(self):
-        threading.Thread(target=self.zoom_speed, args=(1,), daemon=True).start()
+        return self.zoom_speed(1)
 
     def zoom_out(self):
-        threading.Thread(target=self.zoom_speed, args=(-1,), daemon=True).start()
+        return self.zoom_speed(-1)
 
     def zoom_speed(self, direction):
+        """Queue a continuous zoom (1 in, -1 out); returns its future."""
+        return self.send(self._zoom_speed, direction)
+
+    def _zoom_speed(self, direction):
         if not self.ptz or not self.profile:
             print("ONVIF PTZ service not available")
             return
         speed = self.pt_speed
-        req = self.ptz.create_type('ContinuousMove')
-        req.ProfileToken = self.profile.token
-        req.Velocity = {'Zoom': {'x': speed * direction}}
-        self.ptz.ContinuousMove(req)
+        self._continuous_move({'Zoom': {'x': speed * direction}})
     
     def hard_origin(self, blocking=True):
         print("Moving to hard origin position...")
@@ -107,40 +268,46 @@ class PTZCommands:
         self.est_zoom_level = MIN_ZOOM_LEVEL
 
     def rel_pan(self, angle_deg, blocking=True):
+        if blocking:
+            self._check_interrupted()
+
         def pan_thread():
-            sleep_time = abs(angle_deg) / pan_speed_degps
+            sleep_time = self.move_time('pan', angle_deg)
             if angle_deg > 0:
                 print(f'    {PAN_COLOR}RIGHT {round(angle_deg)}...{RESET_COLOR} ({round(sleep_time, 2)} s)')
                 self.pan_right()
             elif angle_deg < 0:
                 print(f'    {PAN_COLOR}LEFT {round(-angle_deg)}...{RESET_COLOR} ({round(sleep_time, 2)} s)')
                 self.pan_left()
-            time.sleep(sleep_time)
-            self.est_pan_angle_deg += angle_deg
+            self.est_pan_angle_deg += self._drive('pan', angle_deg)
             self.stop_ptz()
 
         t = threading.Thread(target=pan_thread, daemon=True)
         t.start()
         if blocking:
             t.join()
+            self._check_interrupted()
 
     def rel_tilt(self, angle_deg, blocking=True):
+        if blocking:
+            self._check_interrupted()
+
         def tilt_thread():
-            sleep_time = abs(angle_deg) / tilt_speed_degps
+            sleep_time = self.move_time('tilt', angle_deg)
             if angle_deg > 0:
                 print(f'    {TILT_COLOR}UP {round(angle_deg)}...{RESET_COLOR} ({round(sleep_time, 2)} s)')
                 self.tilt_up()
             elif angle_deg < 0:
                 print(f'    {TILT_COLOR}DOWN {round(-angle_deg)}...{RESET_COLOR} ({round(sleep_time, 2)} s)')
                 self.tilt_down()
-            time.sleep(sleep_time)
-            self.est_tilt_angle_deg += angle_deg
+            self.est_tilt_angle_deg += self._drive('tilt', angle_deg)
             self.stop_ptz()
 
         t = threading.Thread(target=tilt_thread, daemon=True)
         t.start()
         if blocking:
             t.join()
+            self._check_interrupted()
 
     def print_position(self):
         print(f"🛑 ({PAN_COLOR}{round(self.est_pan_angle_deg)}{RESET_COLOR}, {TILT_COLOR}{round(self.est_tilt_angle_deg)}{RESET_COLOR}, {ZOOM_COLOR}{round(self.est_zoom_level,2)}{RESET_COLOR})")
@@ -166,22 +333,28 @@ class PTZCommands:
         # target_level = self.est_zoom_level + zoom_change
         # target_level = min(max(target_level, MIN_ZOOM_LEVEL), MAX_ZOOM_LEVEL)
         # actual_change = target_level - self.est_zoom_level
-        sleep_time = abs(zoom_change) / zoom_speed_levelps
+        sleep_time = self.move_time('zoom', zoom_change)
+        if blocking:
+            self._check_interrupted()
 
         def zoom_thread():
             if zoom_change > 0:
                 print(f'    {ZOOM_COLOR}ZOOM IN by {round(zoom_change, 2)}...{RESET_COLOR} ({round(sleep_time, 2)} s)')
-                self.zoom_speed(1)
+                self.zoom_in()
             elif zoom_change < 0:
                 print(f'    {ZOOM_COLOR}ZOOM OUT by {round(-zoom_change, 2)}...{RESET_COLOR} ({round(sleep_time, 2)} s)')
-                self.zoom_speed(-1)
-            time.sleep(sleep_time)
+                self.zoom_out()
+            moved = self._drive('zoom', zoom_change)
+            if moved != zoom_change:
+                # Cut short: abs_zoom won't set the level, so account for what was done
+                self.est_zoom_level = min(max(self.est_zoom_level + moved, MIN_ZOOM_LEVEL), MAX_ZOOM_LEVEL)
             self.stop_ptz()
 
         t = threading.Thread(target=zoom_thread, daemon=True)
         t.start()
         if blocking:
             t.join()
+            self._check_interrupted()
 
     def abs_zoom(self, level, blocking=True):
         """Move to absolute zoom level between 0 (widest) and 1 (closest)"""
@@ -201,18 +374,33 @@ class PTZCommands:
         self.est_zoom_level = level
         self.print_position()
 
-    def abs_pantilt(self, pan_tilt, blocking=True):
+    def abs_pantilt(self, pan_tilt, blocking=True, on_arrival=None):
+        """
+        Zoom out, pan and tilt, zoom back in. on_arrival, if given, is called while
+        still zoomed out at the new pan/tilt; its result is returned.
+        """
         # pantilt must be done while zoom is at 0
         prev_zoom_level= self.est_zoom_level
-        self.abs_zoom(0, blocking=blocking)
+        with tracing.span("zoom-out"):
+            self.abs_zoom(0, blocking=blocking)
         pan, tilt = pan_tilt
         if pan < tilt:
-            self.abs_pan(pan, blocking=blocking)
-            self.abs_tilt(tilt, blocking=blocking)
+            with tracing.span("pan"):
+                self.abs_pan(pan, blocking=blocking)
+            with tracing.span("tilt"):
+                self.abs_tilt(tilt, blocking=blocking)
         else:
-            self.abs_tilt(tilt, blocking=blocking)
-            self.abs_pan(pan, blocking=blocking)
-        self.abs_zoom(prev_zoom_level, blocking=blocking)
+            with tracing.span("tilt"):
+                self.abs_tilt(tilt, blocking=blocking)
+            with tracing.span("pan"):
+                self.abs_pan(pan, blocking=blocking)
+        arrival = None
+        if on_arrival:
+            with tracing.span("arrival"):
+                arrival = on_arrival()
+        with tracing.span("zoom-in"):
+            self.abs_zoom(prev_zoom_level, blocking=blocking)
+        return arrival
     
     def go_home(self):
         
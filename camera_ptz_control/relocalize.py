@@ -0,0 +1,158 @@
+"""
+Visual re-localization at presets.
+
+Each preset keeps a reference image, taken zoomed out at the preset's pan/tilt.
+When the camera arrives at a preset, still zoomed out, the current frame is
+matched against the reference. Phase correlation in pan/tilt coordinates is
+used first; ORB features are the fallback for offsets too large for it. The
+offset corrects the position estimate, and a small fine move brings the camera
+onto the preset. Only if nothing matches on a frame with enough detail is the
+camera re-homed.
+"""
+import math
+import os
+
+import cv2
+import numpy as np
+
+from calibration import angle_shift, focal_px
+import stability
+
+MIN_CORRECTION_DEG = 0.2     # smaller offsets are left alone
+MAX_OFFSET_FRACTION = 0.4    # offsets beyond this fraction of the field of view are treated as mismatches
+MIN_RESPONSE = 0.1           # phase correlation peak needed to trust the offset
+MIN_ORB_INLIERS = 15
+MIN_SHARPNESS = 20.0         # below this (night, fog, lens covered) a failed match says nothing about position
+MAX_ITERATIONS = 2
+ANALYSIS_WIDTH = 640
+
+
+class ReferenceStore:
+    """Reference images of one camera's presets, one JPEG per preset."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.jpg")
+
+    def load(self, name):
+        return cv2.imread(self._file(name)) if os.path.exists(self._file(name)) else None
+
+    def save(self, name, frame):
+        os.makedirs(self.path, exist_ok=True)
+        cv2.imwrite(self._file(name), frame)
+
+    def discard(self, name):
+        if os.path.exists(self._file(name)):
+            os.remove(self._file(name))
+
+    def names(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(os.path.splitext(f)[0] for f in os.listdir(self.path) if f.endswith(".jpg"))
+
+
+def orb_offset(reference, frame, focal, tilt_deg):
+    """
+    Coarse (pan, tilt) offset in degrees of frame relative to reference from ORB
+    feature matches, or None if too few matches agree. Handles offsets too large
+    for phase correlation; refine the result with angle_shift.
+    """
+    scale = min(1.0, ANALYSIS_WIDTH / reference.shape[1])
+    a = cv2.resize(cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY), None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    b = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    orb = cv2.ORB_create(1000)
+    keypoints_a, descriptors_a = orb.detectAndCompute(a, None)
+    keypoints_b, descriptors_b = orb.detectAndCompute(b, None)
+    if descriptors_a is None or descriptors_b is None:
+        return None
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(descriptors_a, descriptors_b)
+    if len(matches) < MIN_ORB_INLIERS:
+        return None
+    src = np.float32([keypoints_a[m.queryIdx].pt for m in matches])
+    dst = np.float32([keypoints_b[m.trainIdx].pt for m in matches])
+    transform, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if transform is None or int(inliers.sum()) < MIN_ORB_INLIERS:
+        return None
+    # Where the reference's centre landed in the frame; the camera turned the other way
+    cx, cy = (a.shape[1] - 1) / 2, (a.shape[0] - 1) / 2
+    x, y = transform @ np.array([cx, cy, 1.0])
+    focal = focal * scale
+    pan = math.degrees(math.atan((cx - x) / focal)) / max(math.cos(math.radians(tilt_deg)), 0.1)
+    tilt = math.degrees(math.atan((y - cy) / focal))
+    return pan, tilt, int(inliers.sum())
+
+
+def match(reference, frame, focal, tilt_deg, fov_deg):
+    """(pan, tilt, method) offset of frame relative to reference in degrees, or None if they don't match."""
+    limit = MAX_OFFSET_FRACTION * fov_deg
+    pan, tilt, response = angle_shift(reference, frame, focal, tilt_deg)
+    if response >= MIN_RESPONSE and abs(pan) <= limit and abs(tilt) <= limit:
+        return pan, tilt, "phase"
+    coarse = orb_offset(reference, frame, focal, tilt_deg)
+    if coarse and abs(coarse[0]) <= 2 * limit and abs(coarse[1]) <= 2 * limit:
+        return coarse[0], coarse[1], "orb"
+    return None
+
+
+def relocalize(control, grab, references, name, preset, hfov_deg):
+    """
+    Match the camera view at preset `name` (reached zoomed out) against its
+    reference image and correct the estimate and position. The first visit
+    stores the reference. Returns a summary dict.
+    """
+    frame = grab()
+    reference = references.load(name)
+    if reference is None:
+        references.save(name, frame)
+        print(f"Stored reference image for '{name}'")
+        return {"method": "reference stored"}
+    if reference.shape != frame.shape:
+        # E.g. the analysis stream changed; the current view may have drifted, so it
+        # doesn't replace the reference. Saving the preset again takes a new one.
+        print(f"'{name}': reference image is {reference.shape[1]}x{reference.shape[0]} but the stream gives "
+              f"{frame.shape[1]}x{frame.shape[0]}; save the preset again to replace it")
+        return {"method": "reference mismatch", "reference_size": [reference.shape[1], reference.shape[0]],
+                "frame_size": [frame.shape[1], frame.shape[0]], "rehomed": False}
+
+    focal = focal_px(frame.shape[1], hfov_deg)
+    total_pan = total_tilt = 0.0
+    method = None
+    for _ in range(MAX_ITERATIONS):
+        result = match(reference, frame, focal, preset["tilt"], hfov_deg)
+        if result is None:
+            if method is not None:
+                # An earlier pass matched and corrected; keep that rather than re-home
+                print(f"'{name}': no match after correcting, keeping the correction")
+                return {"method": method, "pan_offset_deg": round(total_pan, 2),
+                        "tilt_offset_deg": round(total_tilt, 2), "rehomed": False}
+            break
+        pan, tilt, method = result
+        if abs(pan) < MIN_CORRECTION_DEG and abs(tilt) < MIN_CORRECTION_DEG:
+            return {"method": method, "pan_offset_deg": round(total_pan + pan, 2),
+                    "tilt_offset_deg": round(total_tilt + tilt, 2), "rehomed": False}
+        # The camera is really at estimate + offset; a relative move brings it back onto the preset
+        print(f"'{name}': off by pan {pan:+.2f}, tilt {tilt:+.2f} deg ({method}), correcting")
+        control.est_pan_angle_deg += pan
+        control.est_tilt_angle_deg += tilt
+        if abs(pan) >= MIN_CORRECTION_DEG:
+            control.rel_pan(-pan)
+        if abs(tilt) >= MIN_CORRECTION_DEG:
+            control.rel_tilt(-tilt)
+        control.wait_settled()
+        total_pan += pan
+        total_tilt += tilt
+        frame = grab()
+    else:
+        return {"method": method, "pan_offset_deg": round(total_pan, 2),
+                "tilt_offset_deg": round(total_tilt, 2), "rehomed": False}
+
+    if method is None and stability.sharpness(stability.small_gray(frame, ANALYSIS_WIDTH)) < MIN_SHARPNESS:
+        print(f"'{name}': view too flat to match against the reference, leaving the estimate as is")
+        return {"method": "skipped (no detail)"}
+    print(f"'{name}': no match with the reference image, re-homing")
+    control.hard_origin(blocking=True)
+    control.abs_pantilt((preset["pan"], preset["tilt"]))
+    return {"method": "failed", "pan_offset_deg": round(total_pan, 2),
+            "tilt_offset_deg": round(total_tilt, 2), "rehomed": True}
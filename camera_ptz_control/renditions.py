@@ -0,0 +1,150 @@
+from collections import OrderedDict
+import os
+import threading
+
+import cv2
+
+# format -> (extension, media type, quality flag)
+FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "jpg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "png": (".png", "image/png", None),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+DEFAULT_QUALITY = 90
+DEFAULT_CACHE_MB = 64
+
+
+def check(format, width=None, quality=None):
+    """Raise ValueError for a rendition that can't be produced."""
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format '{format}'. Available formats: {sorted(FORMATS)}")
+    if width is not None and width <= 0:
+        raise ValueError("Width must be positive")
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError("Quality must be between 1 and 100")
+
+
+def is_original(path, format="jpeg", width=None, quality=None):
+    """True when the rendition is the stored file itself: same format, no resize or quality asked."""
+    extension = os.path.splitext(path)[1].lower()
+    return width is None and quality is None and FORMATS[format][0] == (".jpg" if extension == ".jpeg" else extension)
+
+
+def encode(frame, format="jpeg", width=None, quality=None):
+    """Encode a frame, downscaled to width (never upscaled). Returns (bytes, media type)."""
+    check(format, width, quality)
+    extension, media_type, quality_flag = FORMATS[format]
+    if width and width < frame.shape[1]:
+        height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    params = [quality_flag, quality or DEFAULT_QUALITY] if quality_flag is not None else []
+    ok, encoded = cv2.imencode(extension, frame, params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {format}")
+    return encoded.tobytes(), media_type
+
+
+class RenditionCache:
+    """
+    In-memory LRU cache of encoded pictures, bounded by their total size.
+
+    Keys are (path, format, width, quality), so repeated requests for the same
+    rendition of a stored picture (dashboards refreshing the latest picture of
+    a preset) are answered without decoding and encoding it again.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, data, media_type):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self._entries[key] = (data, media_type)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    @staticmethod
+    def key(path, format="jpeg", width=None, quality=None):
+        # "jpg" and "jpeg" are the same rendition
+        return path, FORMATS[format][0], width, quality
+
+    def cached(self, path, format="jpeg", width=None, quality=None):
+        """A rendition only if it is in the cache, e.g. for a picture still being written."""
+        check(format, width, quality)
+        return self.get(self.key(path, format, width, quality))
+
+    def put_original(self, path, data):
+        """Cache the bytes of a stored picture as its original rendition."""
+        format = os.path.splitext(path)[1].lower().lstrip(".")
+        self.put(self.key(path, format), data, FORMATS[format][1])
+
+    def render(self, path, format="jpeg", width=None, quality=None, frame=None):
+        """
+        (bytes, media type) of a rendition of the picture at path, from the cache,
+        the file itself when nothing about it changes, or encoded from frame (read
+        from path if not given). None if the file can't be read.
+        """
+        check(format, width, quality)
+        key = self.key(path, format, width, quality)
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        if frame is None and is_original(path, format, width, quality):
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                return None
+            self.put(key, data, FORMATS[format][1])
+            return data, FORMATS[format][1]
+        if frame is None:
+            frame = cv2.imread(path)
+            if frame is None:
+                return None
+        data, media_type = encode(frame, format, width, quality)
+        self.put(key, data, media_type)
+        return data, media_type
+
+    def invalidate(self, paths):
+        paths = set(paths)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in paths]:
+                self.size -= len(self._entries.pop(key)[0])
+
+    def on_retention(self, location, removed, rewritten):
+        """Retention listener: removed and re-encoded pictures must be rendered again."""
+        self.invalidate(removed + rewritten)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,290 @@
+"""
+Tiered retention for the picture archive.
+
+Tiers come from the "retention" list in environ.json (the add-on's "retention"
+option); pictures older than a tier's after_days are thinned to one per hour
+or day, optionally re-encoded at a lower JPEG quality:
+
+    "retention": [
+        {"after_days": 7, "keep": "hour", "quality": 70},
+        {"after_days": 90, "keep": "day"}
+    ]
+
+keeps everything for 7 days, then one picture per hour at quality 70, then
+after 90 days one per day (the one closest to noon, as filter_one_per_day in
+stopmotion_gui.py). An empty list disables compaction.
+
+Each run picks up where the last one stopped: a watermark per location and
+tier (in .retention.json in the pictures folder) means only the days that
+became due are listed. Files are deleted and re-encoded in batches, throttled
+to max_mb_per_s of reads and writes. Listeners are told which files were
+removed or rewritten, so indexes can follow. A dry run reports what would be
+deleted and the space it would reclaim without touching anything:
+
+    python retention.py /config/pictures/cam_api [--layout ...] [--tiers '<json>'] [--dry-run]
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+import os
+import threading
+import time
+
+import cv2
+
+from picture_store import DEFAULT_LAYOUT, PictureStore
+from scheduler import CronRule
+
+BUCKETS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+DEFAULT_TIERS = [{"after_days": 7, "keep": "hour", "quality": 70}, {"after_days": 90, "keep": "day"}]
+DEFAULT_CRON = "30 3 * * *"
+BATCH_SIZE = 100
+MAX_MB_PER_S = 20.0
+ESTIMATE_SAMPLES = 20      # re-encodes measured per tier in a dry run
+STATE_FILE = ".retention.json"
+MAX_REPORTS = 10
+
+
+class Tier:
+    def __init__(self, config):
+        self.after_days = config["after_days"]
+        self.keep = config.get("keep", "day")
+        if self.keep not in BUCKETS:
+            raise ValueError(f"Retention tier keeps one per 'hour' or 'day', not '{self.keep}'")
+        self.bucket = BUCKETS[self.keep]
+        self.quality = config.get("quality")
+        self.key = f"{self.keep}@{self.after_days}d" + (f"/q{self.quality}" if self.quality else "")
+
+    def cutoff(self, now):
+        """End of the last whole bucket older than after_days; buckets are never split across runs."""
+        t = now - timedelta(days=self.after_days)
+        t = t.replace(minute=0, second=0, microsecond=0)
+        return t.replace(hour=0) if self.keep == "day" else t
+
+    def _bucket_start(self, timestamp):
+        start = timestamp.replace(minute=0, second=0, microsecond=0)
+        return start.replace(hour=0) if self.keep == "day" else start
+
+    def select(self, pictures):
+        """(kept, dropped): per bucket, the picture closest to its middle (noon for days) is kept."""
+        buckets = {}
+        for picture in pictures:
+            buckets.setdefault(self._bucket_start(picture.timestamp), []).append(picture)
+        kept, dropped = [], []
+        for start, members in buckets.items():
+            middle = start + self.bucket / 2
+            best = min(members, key=lambda p: abs((p.timestamp - middle).total_seconds()))
+            kept.append(best)
+            dropped += [p for p in members if p is not best]
+        return kept, dropped
+
+    def to_dict(self):
+        return {"after_days": self.after_days, "keep": self.keep, "quality": self.quality}
+
+
+class _Throttle:
+    """Sleeps after every batch so the I/O stays under max_mb_per_s."""
+
+    def __init__(self, batch_size, max_mb_per_s):
+        self.batch_size = batch_size
+        self.max_bytes_per_s = max_mb_per_s * 1024 * 1024
+        self._reset()
+
+    def _reset(self):
+        self.count = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+
+    def add(self, nbytes):
+        self.count += 1
+        self.bytes += nbytes
+        if self.count >= self.batch_size:
+            wait = self.bytes / self.max_bytes_per_s - (time.perf_counter() - self.start)
+            if wait > 0:
+                time.sleep(wait)
+            self._reset()
+
+
+def reencode(path, quality, dry_run=False):
+    """Re-encode a JPEG at quality. Returns bytes saved (0 if it wouldn't be smaller)."""
+    before = os.path.getsize(path)
+    frame = cv2.imread(path)
+    if frame is None:
+        return 0
+    ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok or encoded.nbytes >= before:
+        return 0
+    if not dry_run:
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(encoded.tobytes())
+        os.replace(tmp, path)
+    return before - encoded.nbytes
+
+
+class Compactor:
+    def __init__(self, store, tiers, batch_size=BATCH_SIZE, max_mb_per_s=MAX_MB_PER_S, listeners=()):
+        """
+        store: the camera's PictureStore. tiers: the "retention" list.
+        listeners: callables (location, removed_paths, rewritten_paths) run after each tier.
+        """
+        self.store = store
+        # Oldest tier first, so pictures it drops are not re-encoded by a younger tier first
+        self.tiers = sorted((Tier(t) for t in tiers), key=lambda t: -t.after_days)
+        self.batch_size = batch_size
+        self.max_mb_per_s = max_mb_per_s
+        self.listeners = list(listeners)
+
+    def _state_path(self):
+        return os.path.join(self.store.root, STATE_FILE)
+
+    def _load_state(self):
+        try:
+            with open(self._state_path(), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_state(self, state):
+        with open(self._state_path(), "w") as f:
+            json.dump(state, f, indent=4)
+
+    def run(self, dry_run=False, now=None, log=print):
+        """Apply the tiers to every location. Returns a report of what was (or would be) done."""
+        now = now or datetime.now()
+        started = time.perf_counter()
+        state = self._load_state()
+        throttle = _Throttle(self.batch_size, self.max_mb_per_s)
+        report = {"dry_run": dry_run, "started": now.isoformat(), "locations": {}}
+        if not os.path.isdir(self.store.root):
+            return {**report, "deleted": 0, "reencoded": 0, "reclaimed_bytes": 0, "duration_s": 0.0}
+
+        for location in self.store.locations():
+            totals = {"deleted": 0, "reencoded": 0, "reclaimed_bytes": 0}
+            dropped_earlier = set()   # a dry run leaves them in place, later tiers must not count them again
+            for tier in self.tiers:
+                key = f"{location}|{tier.key}"
+                since = datetime.fromisoformat(state[key]) if key in state else None
+                cutoff = tier.cutoff(now)
+                if since and since >= cutoff:
+                    continue
+                pictures = [p for p in self.store.pictures(location, since, cutoff)
+                            if p.timestamp < cutoff and p.path not in dropped_earlier]
+                kept, dropped = tier.select(pictures)
+                removed, rewritten = self._apply(tier, kept, dropped, totals, throttle, dry_run)
+                dropped_earlier.update(removed)
+                if not dry_run:
+                    state[key] = cutoff.isoformat()
+                    self._save_state(state)
+                    for listener in self.listeners:
+                        listener(location, removed, rewritten)
+            if any(totals.values()):
+                report["locations"][location] = totals
+                log(f"[retention] {location}: {'would delete' if dry_run else 'deleted'} {totals['deleted']}, "
+                    f"re-encoded {totals['reencoded']}, {totals['reclaimed_bytes'] / 1e6:.1f} MB")
+
+        for field in ("deleted", "reencoded", "reclaimed_bytes"):
+            report[field] = sum(t[field] for t in report["locations"].values())
+        report["duration_s"] = round(time.perf_counter() - started, 1)
+        return report
+
+    def _apply(self, tier, kept, dropped, totals, throttle, dry_run):
+        removed = []
+        for picture in dropped:
+            try:
+                size = os.path.getsize(picture.path)
+                if not dry_run:
+                    os.remove(picture.path)
+            except FileNotFoundError:
+                continue
+            removed.append(picture.path)
+            totals["deleted"] += 1
+            totals["reclaimed_bytes"] += size
+            throttle.add(0)
+
+        rewritten = []
+        if tier.quality:
+            # A dry run re-encodes a sample in memory and extrapolates
+            sample = kept[:ESTIMATE_SAMPLES] if dry_run else kept
+            saved = 0
+            for picture in sample:
+                try:
+                    size = os.path.getsize(picture.path)
+                    saving = reencode(picture.path, tier.quality, dry_run)
+                except FileNotFoundError:
+                    continue
+                throttle.add(size + (size - saving if not dry_run else 0))
+                if saving:
+                    saved += saving
+                    rewritten.append(picture.path)
+            if dry_run and sample:
+                saved = int(saved * len(kept) / len(sample))
+                totals["reencoded"] += int(len(rewritten) * len(kept) / len(sample))
+            else:
+                totals["reencoded"] += len(rewritten)
+            totals["reclaimed_bytes"] += saved
+        return removed, rewritten
+
+
+class RetentionJob:
+    """Runs a Compactor per camera on a cron schedule, in a background thread."""
+
+    def __init__(self, cameras, tiers, cron=DEFAULT_CRON, listeners=(), **options):
+        # Each camera's hash index follows the files its compactor removes, as do the given listeners
+        self.compactors = {camera.id: Compactor(camera.pictures, tiers or [],
+                                                listeners=[camera.index.on_retention, *listeners], **options)
+                           for camera in cameras}
+        self.enabled = bool(tiers)
+        self.cron = CronRule(cron)
+        self.reports = []
+        self._lock = threading.Lock()   # one run at a time
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.enabled:
+            threading.Thread(target=self._loop, name="retention", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while True:
+            next_run = self.cron.next_after(datetime.now())
+            if next_run is None or self._stop.wait((next_run - datetime.now()).total_seconds()):
+                return
+            try:
+                self.run()
+            except Exception as e:
+                print(f"[retention] Run failed: {e}")
+
+    def run(self, dry_run=False):
+        """Compact every camera's pictures now. Returns {camera id: report}."""
+        with self._lock:
+            reports = {camera_id: compactor.run(dry_run) for camera_id, compactor in self.compactors.items()}
+        if not dry_run:
+            self.reports = (self.reports + [reports])[-MAX_REPORTS:]
+        return reports
+
+    def status(self):
+        next_run = self.cron.next_after(datetime.now()) if self.enabled else None
+        tiers = next(iter(self.compactors.values())).tiers if self.compactors else []
+        return {
+            "enabled": self.enabled,
+            "tiers": [tier.to_dict() for tier in tiers],
+            "next_run": next_run.isoformat() if next_run else None,
+            "recent": list(reversed(self.reports)),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Thin out and re-encode old pictures by retention tiers")
+    parser.add_argument("root", help="Pictures folder (pictures_path)")
+    parser.add_argument("--layout", default=DEFAULT_LAYOUT, help=f"Folder layout (default: {DEFAULT_LAYOUT})")
+    parser.add_argument("--tiers", default=json.dumps(DEFAULT_TIERS), help="Retention tiers as a JSON list")
+    parser.add_argument("--rate", type=float, default=MAX_MB_PER_S, help="Maximum MB/s read and written")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted and reclaimed")
+    args = parser.parse_args()
+    compactor = Compactor(PictureStore(args.root, args.layout), json.loads(args.tiers), max_mb_per_s=args.rate)
+    report = compactor.run(args.dry_run)
+    print(f"{'Would delete' if args.dry_run else 'Deleted'} {report['deleted']}, re-encoded {report['reencoded']}, "
+          f"{report['reclaimed_bytes'] / 1e6:.1f} MB reclaimed")
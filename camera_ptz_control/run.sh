@@ -4,8 +4,29 @@
 CAMERA_IP=$(bashio::config 'camera_ip')
 CAMERA_PASSWORD=$(bashio::config 'password')
 
+# Folder layout for pictures under pictures_path, as a JSON string ("" keeps them in one folder)
+PICTURES_LAYOUT=$(jq -c '.pictures_layout // "{location}/{YYYY}/{MM}/{DD}"' /data/options.json)
+
+# Horizontal field of view of the camera at zoom 0, in degrees
+HFOV_DEG=$(jq -c '.hfov_deg // 60' /data/options.json)
+
+# Extra cameras are passed through as a JSON list (empty for a single camera)
+CAMERAS=$(jq -c '.cameras // []' /data/options.json)
+
+# RTSP paths of the main stream and substream, which one stills and analysis read, and how long to keep them connected
+STREAM_PATHS=$(jq -c '.stream_paths // {}' /data/options.json)
+STREAM_CONSUMERS=$(jq -c '.stream_consumers // {}' /data/options.json)
+STREAM_HOLD_S=$(jq -c '.stream_hold_s // 0' /data/options.json)
+
+# Capture schedule rules, also as a JSON list
+SCHEDULE=$(jq -c '.schedule // []' /data/options.json)
+
+# Retention tiers for the picture archive (empty: keep everything) and when compaction runs
+RETENTION=$(jq -c '.retention // []' /data/options.json)
+RETENTION_CRON=$(jq -c '.retention_cron // "30 3 * * *"' /data/options.json)
+
 # Create environ.json with the configuration
-echo "{\"camera_ip\": \"$CAMERA_IP\", \"pw\": \"$CAMERA_PASSWORD\"}" > /app/environ.json
+echo "{\"camera_ip\": \"$CAMERA_IP\", \"pw\": \"$CAMERA_PASSWORD\", \"pictures_layout\": $PICTURES_LAYOUT, \"hfov_deg\": $HFOV_DEG, \"cameras\": $CAMERAS, \"stream_paths\": $STREAM_PATHS, \"stream_consumers\": $STREAM_CONSUMERS, \"stream_hold_s\": $STREAM_HOLD_S, \"schedule\": $SCHEDULE, \"retention\": $RETENTION, \"retention_cron\": $RETENTION_CRON}" > /app/environ.json
 
 # Start the FastAPI application
 python3 main.py
@@ -0,0 +1,103 @@
+"""
+Scene change between captures at a preset.
+
+The last stored picture of each preset is kept in memory as a small blurred
+grayscale frame. A new capture is aligned to it (phase correlation, for the
+small offset left after a preset move), matched in overall brightness, and
+differenced; pixels that differ by more than PIXEL_THRESHOLD grey levels, after
+removing isolated specks, are the changed region. The score is the changed
+share of the view in percent, and the region's bounding box is given in
+full-frame pixels. It takes a few milliseconds per capture.
+
+After a restart the last picture of the preset is read back from disk, so
+the first capture still gets a score.
+"""
+import math
+import threading
+
+import cv2
+import numpy as np
+
+from stability import small_gray
+
+ANALYSIS_WIDTH = 320
+BLUR = (5, 5)
+PIXEL_THRESHOLD = 25         # grey levels
+MIN_RESPONSE = 0.05          # phase correlation peak needed to align
+MAX_SHIFT_FRACTION = 0.1     # larger shifts aren't a preset's residual offset; compared unaligned
+
+
+def prepare(frame):
+    """Small blurred grayscale version of a frame, as kept per preset."""
+    return cv2.GaussianBlur(small_gray(frame, ANALYSIS_WIDTH), BLUR, 0).astype(np.float32)
+
+
+def compare(previous, current, scale=1.0):
+    """
+    Change between two prepared frames. scale converts analysis pixels to
+    full-frame pixels for the bounding box. Returns a summary dict.
+    """
+    height, width = current.shape
+    # Windowed copies: phaseCorrelate applies its window argument to the inputs in place
+    window = cv2.createHanningWindow((width, height), cv2.CV_32F)
+    (dx, dy), response = cv2.phaseCorrelate(previous * window, current * window)
+    if response < MIN_RESPONSE or abs(dx) > MAX_SHIFT_FRACTION * width or abs(dy) > MAX_SHIFT_FRACTION * height:
+        dx = dy = 0.0
+    aligned = cv2.warpAffine(previous, np.float32([[1, 0, dx], [0, 1, dy]]), (width, height),
+                             borderMode=cv2.BORDER_REPLICATE)
+    # Leave out the border the shift brought in
+    x0, y0 = math.ceil(max(dx, 0)), math.ceil(max(dy, 0))
+    x1, y1 = width - math.ceil(max(-dx, 0)), height - math.ceil(max(-dy, 0))
+    a, b = aligned[y0:y1, x0:x1], current[y0:y1, x0:x1]
+    # Exposure changes and passing clouds shift the whole view; they aren't scene changes
+    a = a * (float(b.mean()) / max(float(a.mean()), 1.0))
+    diff = cv2.absdiff(a, b)
+    mask = cv2.morphologyEx((diff > PIXEL_THRESHOLD).astype(np.uint8), cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+    changed = cv2.countNonZero(mask)
+    bbox = None
+    if changed:
+        x, y, w, h = cv2.boundingRect(mask)
+        bbox = [round((x + x0) * scale), round((y + y0) * scale), round(w * scale), round(h * scale)]
+    return {
+        "score": round(100.0 * changed / mask.size, 2),
+        "mean_diff": round(float(diff.mean()), 2),
+        "bbox": bbox,
+        "shift_px": [round(dx * scale, 1), round(dy * scale, 1)],
+    }
+
+
+class SceneTracker:
+    """Last stored frame per preset of one camera, for scene change scores."""
+
+    def __init__(self, index=None):
+        self.index = index      # PictureIndex, to find the last picture after a restart
+        self._last = {}         # location -> (prepared frame, timestamp)
+        self._lock = threading.Lock()
+
+    def _previous(self, location):
+        with self._lock:
+            if location in self._last:
+                return self._last[location]
+        latest = self.index.latest(location) if self.index else None
+        if latest is None:
+            return None
+        frame = cv2.imread(latest[0].path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if frame is None:
+            return None
+        with self._lock:
+            return self._last.setdefault(location, (prepare(frame), latest[0].timestamp))
+
+    def score(self, location, frame):
+        """(summary, prepared frame); the summary's score is None without an earlier picture to compare with."""
+        prepared = prepare(frame)
+        previous = self._previous(location)
+        if previous is None or previous[0].shape != prepared.shape:
+            return {"score": None, "previous": None}, prepared
+        result = compare(previous[0], prepared, frame.shape[1] / prepared.shape[1])
+        result["previous"] = previous[1].isoformat()
+        return result, prepared
+
+    def remember(self, location, prepared, when):
+        """Make a stored capture the one the next capture at location is compared with."""
+        with self._lock:
+            self._last[location] = (prepared, when)
@@ -0,0 +1,318 @@
+"""
+In-process capture scheduler.
+
+Rules come from the "schedule" list in environ.json (the add-on's "schedule"
+option):
+
+    "schedule": [
+        {"cron": "*/15 7-20 * * *", "locations": "gate,patio"},
+        {"cron": "0 * * * *", "group": "garden", "camera": "garage", "stable": true}
+    ]
+
+"cron" is a standard 5-field expression (minute hour day month weekday) in
+local time. "locations" names presets, as a list or comma-separated ("*" or
+omitted: all presets of the camera); "group" picks the presets whose
+locations.json entry has that "group". "camera" defaults to the default camera.
+"min_change" (percent of the view, see scene_change.py) skips storing captures
+that changed less than that since the preset's last stored picture.
+
+All rules due for a camera are merged into one round that visits each preset
+once, ordered by pan. Presets that fall due while a round is still waiting are
+added to it; presets still ahead in the running round are not queued again.
+Rounds run on the camera's executor through the same move and capture path as
+/take_picture/{location}, so they queue behind API requests instead of
+fighting over the camera. While the camera has more than MAX_BUSY requests in
+flight a round is held back, and one that can't start within max_delay seconds
+of its due time is skipped.
+"""
+from collections import deque
+from datetime import datetime, timedelta
+import threading
+import time
+
+import metrics
+import tracing
+
+MAX_BUSY = 1                 # requests in flight on the camera before a round is held back
+DEFAULT_MAX_DELAY_S = 120
+POLL_S = 1.0
+MAX_RECENT = 50
+
+# (name, lowest, highest) of the five cron fields
+CRON_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 7))
+
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(","):
+        part, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-"))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"Cron field '{text}' out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronRule:
+    """A 5-field cron expression (minute hour day month weekday, 0 or 7 = Sunday)."""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expected 5 fields in cron expression '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(text, low, high) for text, (_, low, high) in zip(fields, CRON_FIELDS))
+        self.weekdays = {d % 7 for d in weekdays}
+        # As in cron, a restricted day and weekday match if either does
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, when):
+        if when.month not in self.months:
+            return False
+        day = when.day in self.days
+        weekday = (when.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def matches(self, when):
+        return when.minute in self.minutes and when.hour in self.hours and self._day_matches(when)
+
+    def next_after(self, when):
+        """First matching minute after `when`, or None within a year (e.g. Feb 30)."""
+        t = when.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366)
+        while t < limit:
+            if not self._day_matches(t):
+                t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+            elif t.hour not in self.hours:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        return None
+
+
+class Job:
+    """One schedule rule."""
+
+    def __init__(self, config, index, default_camera_id):
+        self.name = config.get("name", f"rule{index + 1}")
+        self.cron = CronRule(config["cron"])
+        self.camera_id = config.get("camera") or default_camera_id
+        locations = config.get("locations", "*")
+        if isinstance(locations, str):
+            locations = [name.strip().lower() for name in locations.split(",") if name.strip()]
+        self.locations = [name.lower() for name in locations]
+        self.group = config.get("group")
+        self.stable = bool(config.get("stable", False))
+        self.max_delay_s = config.get("max_delay", DEFAULT_MAX_DELAY_S)
+        self.min_change = config.get("min_change")
+
+    def presets(self, camera):
+        if self.group:
+            return [name for name, preset in camera.presets.items() if preset.get("group") == self.group]
+        if not self.locations or "*" in self.locations:
+            return camera.presets.names()
+        missing = [name for name in self.locations if name not in camera.presets]
+        if missing:
+            print(f"[schedule] {self.name}: unknown locations {missing} on camera '{camera.id}'")
+        return [name for name in self.locations if name in camera.presets]
+
+    def to_dict(self, now):
+        next_run = self.cron.next_after(now)
+        return {
+            "name": self.name,
+            "cron": self.cron.expression,
+            "camera": self.camera_id,
+            "locations": self.locations,
+            "group": self.group,
+            "stable": self.stable,
+            "min_change": self.min_change,
+            "next_run": next_run.isoformat() if next_run else None,
+        }
+
+
+class Round:
+    """The presets due for one camera, captured in one pass."""
+
+    def __init__(self, camera, due):
+        self.camera = camera
+        self.due = due
+        self.jobs = []
+        self.locations = []
+        self.stable = False
+        self.max_delay_s = 0
+        self.min_changes = []
+        self.state = "pending"
+        self.started = None
+        self.finished = None
+        self.reason = None
+        self.captures = []
+
+    def add(self, job, locations):
+        if job.name not in self.jobs:
+            self.jobs.append(job.name)
+        self.locations += [name for name in locations if name not in self.locations]
+        self.stable = self.stable or job.stable
+        self.max_delay_s = max(self.max_delay_s, job.max_delay_s)
+        self.min_changes.append(job.min_change)
+
+    @property
+    def min_change(self):
+        """Captures are stored if any merged rule wants them; a rule without min_change always does."""
+        if not self.min_changes or None in self.min_changes:
+            return None
+        return min(self.min_changes)
+
+    def remaining(self):
+        return self.locations[len(self.captures):]
+
+    def to_dict(self):
+        return {
+            "camera": self.camera.id,
+            "jobs": self.jobs,
+            "locations": self.locations,
+            "state": self.state,
+            "reason": self.reason,
+            "due": self.due.isoformat(),
+            "started": self.started.isoformat() if self.started else None,
+            "delay_s": round((self.started - self.due).total_seconds(), 1) if self.started else None,
+            "duration_s": round((self.finished - self.started).total_seconds(), 1) if self.finished and self.started else None,
+            "captures": self.captures,
+        }
+
+
+class Scheduler:
+    def __init__(self, cameras, rules, capture):
+        """
+        cameras: the CameraRegistry. rules: the "schedule" list from environ.json.
+        capture(camera, location, stable, min_change): moves to a preset and saves a picture.
+        """
+        self.cameras = cameras
+        self.capture = capture
+        self.jobs = [Job(config, i, cameras.default_id) for i, config in enumerate(rules or [])]
+        for job in self.jobs:
+            if job.camera_id not in cameras.ids():
+                raise ValueError(f"Schedule rule '{job.name}' refers to unknown camera '{job.camera_id}'")
+        self._pending = {}     # camera id -> Round waiting to start
+        self._running = {}     # camera id -> Round being captured
+        self.recent = deque(maxlen=MAX_RECENT)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self.jobs or self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+        print(f"[schedule] {len(self.jobs)} rule(s) active")
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        last_minute = datetime.now().replace(second=0, microsecond=0)
+        while not self._stop.wait(POLL_S):
+            now = datetime.now()
+            minute = now.replace(second=0, microsecond=0)
+            if minute > last_minute:
+                last_minute = minute
+                self._tick(minute)
+            self._dispatch(now)
+
+    def _tick(self, minute):
+        for job in self.jobs:
+            if not job.cron.matches(minute):
+                continue
+            camera = self.cameras.get(job.camera_id)
+            with self._lock:
+                running = self._running.get(camera.id)
+                ahead = running.remaining() if running else []
+                locations = [name for name in job.presets(camera) if name not in ahead]
+                if not locations:
+                    continue
+                pending = self._pending.setdefault(camera.id, Round(camera, minute))
+                pending.add(job, locations)
+
+    def _dispatch(self, now):
+        with self._lock:
+            for camera_id, pending in list(self._pending.items()):
+                if camera_id in self._running:
+                    continue
+                camera = pending.camera
+                late = (now - pending.due).total_seconds() > pending.max_delay_s
+                if camera.ptz_control is None or camera.busy > MAX_BUSY:
+                    if late:
+                        reason = "camera not connected" if camera.ptz_control is None else "camera busy"
+                        self._skip(self._pending.pop(camera_id), reason)
+                    continue
+                del self._pending[camera_id]
+                if late:
+                    self._skip(pending, "late")
+                    continue
+                # Visit presets in pan order so the round sweeps instead of zig-zagging
+                pending.locations.sort(key=lambda name: camera.presets[name]["pan"] if name in camera.presets else 0)
+                pending.state = "queued"
+                self._running[camera_id] = pending
+                camera.submit(self._run, pending)
+
+    def _skip(self, pending, reason):
+        pending.state = "skipped"
+        pending.reason = reason
+        print(f"[schedule] [{pending.camera.id}] skipped round due {pending.due:%H:%M} ({reason})")
+        metrics.SCHEDULED_CAPTURES.labels(pending.camera.id, "skipped").inc(len(pending.locations))
+        self.recent.append(pending)
+
+    def _run(self, pending):
+        camera = pending.camera
+        pending.state = "running"
+        pending.started = datetime.now()
+        print(f"[schedule] [{camera.id}] round due {pending.due:%H:%M}: {pending.locations}")
+        try:
+            with tracing.trace(f"schedule {camera.id}") as round_trace:
+                for location in list(pending.locations):
+                    start = time.perf_counter()
+                    capture = {"location": location}
+                    try:
+                        result = self.capture(camera, location, pending.stable, pending.min_change)
+                        capture["filename"] = result["picture"]["filename"]
+                        capture["scene_change"] = result["scene_change"]["score"]
+                        outcome = "ok" if capture["filename"] else "unchanged"
+                    except Exception as e:
+                        capture["error"] = str(getattr(e, "detail", e))
+                        outcome = "failed"
+                        print(f"[schedule] [{camera.id}] {location}: {capture['error']}")
+                    capture["seconds"] = round(time.perf_counter() - start, 2)
+                    metrics.SCHEDULED_CAPTURES.labels(camera.id, outcome).inc()
+                    pending.captures.append(capture)
+                failed = sum("error" in c for c in pending.captures)
+                pending.state = "failed" if failed == len(pending.captures) else "done"
+                round_trace.finish(pending.state)
+        finally:
+            pending.finished = datetime.now()
+            with self._lock:
+                self._running.pop(camera.id, None)
+                self.recent.append(pending)
+
+    def status(self, limit=MAX_RECENT):
+        now = datetime.now()
+        with self._lock:
+            return {
+                "now": now.isoformat(),
+                "jobs": [job.to_dict(now) for job in self.jobs],
+                "pending": [r.to_dict() for r in self._pending.values()],
+                "running": [r.to_dict() for r in self._running.values()],
+                "recent": [r.to_dict() for r in reversed(list(self.recent)[-limit:])] if limit > 0 else [],
+            }
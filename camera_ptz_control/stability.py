@@ -0,0 +1,66 @@
+import time
+
+import cv2
+import numpy as np
+
+MAX_WAIT_S = 2.0
+SAMPLE_WIDTH = 160           # frames are compared downscaled to this width
+MAX_DIFF = 2.0               # mean absolute grey-level difference between consecutive frames
+SHARPNESS_TOLERANCE = 0.05   # relative change of the Laplacian variance between consecutive frames
+STABLE_PAIRS = 2             # consecutive frame pairs that must pass both checks
+
+
+def small_gray(frame, width=SAMPLE_WIDTH):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    height = max(1, round(gray.shape[0] * width / gray.shape[1]))
+    return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def sharpness(gray):
+    """Variance of the Laplacian: drops when the image is blurred by motion or focus hunting."""
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def wait_for_stable(read, max_wait_s=MAX_WAIT_S, max_diff=MAX_DIFF,
+                    sharpness_tolerance=SHARPNESS_TOLERANCE, stable_pairs=STABLE_PAIRS):
+    """
+    Read frames with read() (cv2.VideoCapture.read style) until consecutive frames
+    stop changing and their sharpness stops moving, then return that frame. After
+    max_wait_s the sharpest frame seen is returned instead.
+
+    Returns (frame, stats); frame is None if no frame could be read.
+    """
+    start = time.perf_counter()
+    previous = previous_sharpness = None
+    best = best_sharpness = None
+    diff = None
+    frames = passed = 0
+    while True:
+        ret, frame = read()
+        if not ret:
+            break
+        frames += 1
+        gray = small_gray(frame)
+        current_sharpness = sharpness(gray)
+        if best is None or current_sharpness > best_sharpness:
+            best, best_sharpness = frame, current_sharpness
+        if previous is not None:
+            diff = float(np.mean(cv2.absdiff(gray, previous)))
+            sharpness_change = abs(current_sharpness - previous_sharpness) / max(previous_sharpness, 1e-6)
+            passed = passed + 1 if diff <= max_diff and sharpness_change <= sharpness_tolerance else 0
+            if passed >= stable_pairs:
+                return frame, _stats(True, start, frames, diff, current_sharpness)
+        if time.perf_counter() - start >= max_wait_s:
+            break
+        previous, previous_sharpness = gray, current_sharpness
+    return best, _stats(False, start, frames, diff, best_sharpness)
+
+
+def _stats(stable, start, frames, diff, frame_sharpness):
+    return {
+        "stable": stable,
+        "waited_ms": round((time.perf_counter() - start) * 1000, 1),
+        "frames": frames,
+        "diff": round(diff, 3) if diff is not None else None,
+        "sharpness": round(frame_sharpness, 1) if frame_sharpness is not None else None,
+    }
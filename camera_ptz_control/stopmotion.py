@@ -2,6 +2,8 @@ import os
 import cv2
 import datetime
 
+from frame_source import FrameSource
+
 def create_stopmotion_video(input_folder, fps=30):
     """
     Create a stop-motion video from images in the specified folder.
@@ -49,21 +51,18 @@ def create_stopmotion_video(input_folder, fps=30):
     frame = cv2.imread(first_image_path)
     height, width, layers = frame.shape
 
-    video_path = os.path.join(input_folder, f'{input_folder.split('/')[-1]}_{duration}{duration_unit}.mp4')
+    video_path = os.path.join(input_folder, f"{input_folder.split('/')[-1]}_{duration}{duration_unit}.mp4")
     # if video_path exists, remove it
     if os.path.exists(video_path):
         os.remove(video_path)
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # Codec for MP4 format
     video = cv2.VideoWriter(video_path, fourcc, fps, (width, height))
 
-    progress=0
-    for image in images:
-        progress += 1
-        print(f'Processing image: {progress}/{len(images)}', end='\r')
-        image_path = os.path.join(pictures_folder, image)
-        frame = cv2.imread(image_path)
-        if frame is not None:
-            video.write(frame)
+    # The next images are read and decoded while the current one is encoded
+    frames = FrameSource(os.path.join(pictures_folder, image) for image in images)
+    for i, frame in frames:
+        print(f'Processing image: {i + 1}/{len(images)}', end='\r')
+        video.write(frame)
 
     video.release()
     print(f"Stop-motion video created at {video_path}")
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+RTSP streams of a camera, and which stream each consumer reads.
+
+The camera serves its profiles on separate RTSP paths: the main stream
+(full resolution, "11") and the substream (low resolution, "12"). Decoding
+the substream is cheap, so it feeds everything that only looks at the image:
+the GUI preview, plate detection and the analysis behind relocalization and
+calibration (whose reference images were taken from it). The main stream is
+only opened for the stills that are stored, so they never need upscaling.
+
+Consumers and their default profiles:
+
+    stills     main   pictures from /capture, /take_picture and the GUI
+    analysis   sub    relocalization, reference images, calibration
+    preview    sub    GUI display
+    detection  sub    plate detection
+
+Both are configurable in environ.json, for all cameras or per camera:
+
+    "stream_paths": {"main": "11", "sub": "12"},
+    "stream_consumers": {"stills": "main"},
+    "stream_hold_s": 0
+
+A path can also be a full URL (or a video file, for tests). With
+stream_hold_s > 0 a stream stays connected that long after its last use,
+draining frames in the background so the next read is current; rounds of
+captures then skip the RTSP connect.
+
+LatestFrame reads a stream on its own thread and keeps only the newest frame,
+for consumers slower than the stream (the GUI preview).
+"""
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+import cv2
+
+import metrics
+
+DEFAULT_PATHS = {"main": "11", "sub": "12"}
+DEFAULT_CONSUMERS = {"stills": "main", "analysis": "sub", "preview": "sub", "detection": "sub"}
+READ_RETRY_S = 0.1
+DRAIN_PAUSE_S = 0.005        # between grabs of a held stream, outside the lock, so open() gets a turn
+
+
+class Stream:
+    def __init__(self, name, url, hold_s=0.0):
+        self.name = name
+        self.url = url
+        self.hold_s = hold_s
+        self._cap = None          # connection held between uses
+        self._release_at = 0.0
+        self._draining = False    # a drainer thread is running; there is at most one
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def open(self):
+        """
+        Yield a cv2.VideoCapture of the stream (check isOpened()), one user at a
+        time. Connects, or reuses the held connection.
+        """
+        with self._lock:
+            cap, self._cap = self._cap, None
+            if cap is None:
+                with metrics.stage("connect"):
+                    cap = cv2.VideoCapture(self.url)
+            try:
+                yield cap
+            finally:
+                if self.hold_s > 0 and cap.isOpened():
+                    self._cap = cap
+                    self._release_at = time.monotonic() + self.hold_s
+                    if not self._draining:
+                        self._draining = True
+                        threading.Thread(target=self._drain, name=f"stream-{self.name}", daemon=True).start()
+                else:
+                    cap.release()
+
+    def _drain(self):
+        """
+        Keep grabbing the held connection so it doesn't serve stale frames, and
+        release it once idle for hold_s. Waits on the lock while a user has it.
+        """
+        while True:
+            with self._lock:
+                cap = self._cap
+                if cap is not None and (time.monotonic() >= self._release_at or not cap.grab()):
+                    self._cap = None
+                    cap.release()
+                    cap = None
+                if cap is None:
+                    self._draining = False
+                    return
+            time.sleep(DRAIN_PAUSE_S)
+
+    def release(self):
+        with self._lock:
+            if self._cap is not None:
+                self._cap.release()
+                self._cap = None
+
+
+class StreamManager:
+    def __init__(self, url_for, paths=None, consumers=None, hold_s=0.0):
+        """
+        url_for(path) builds the URL of a profile path, e.g. "12"; paths that
+        already are URLs or files are used as they are.
+        """
+        self.paths = {name: str(path) for name, path in {**DEFAULT_PATHS, **(paths or {})}.items()}
+        self.consumers = {**DEFAULT_CONSUMERS, **(consumers or {})}
+        unknown = {profile for profile in self.consumers.values() if profile not in self.paths}
+        if unknown:
+            raise ValueError(f"Stream consumers refer to unknown profiles {sorted(unknown)}; known: {sorted(self.paths)}")
+        self.streams = {
+            name: Stream(name, path if "://" in path or os.path.exists(path) else url_for(path), hold_s)
+            for name, path in self.paths.items()
+        }
+
+    @classmethod
+    def single(cls, url):
+        """Every consumer reads the same URL (a camera's "rtsp_url", or a video file)."""
+        return cls(lambda path: path, {"main": url, "sub": url})
+
+    def stream(self, consumer):
+        return self.streams[self.consumers.get(consumer, consumer)]
+
+    def url(self, consumer):
+        return self.stream(consumer).url
+
+    def open(self, consumer):
+        """Context manager yielding a cv2.VideoCapture of the consumer's stream."""
+        return self.stream(consumer).open()
+
+    def release(self):
+        for stream in self.streams.values():
+            stream.release()
+
+
+class LatestFrame:
+    """
+    Reads a cv2.VideoCapture on a background thread, as fast as the stream delivers,
+    keeping only the newest frame: a consumer that looks less often gets a current
+    frame, and frames it skips don't pile up in the RTSP buffer as latency.
+    """
+
+    def __init__(self, cap, name="preview"):
+        self.cap = cap
+        self._seq = 0             # counts frames read, so consumers can tell a new one
+        self._frame = None
+        self._lock = threading.Lock()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"latest-{name}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(READ_RETRY_S)
+                continue
+            with self._lock:
+                self._frame = frame
+                self._seq += 1
+
+    def get(self):
+        """(sequence number, newest frame); the frame is None until the first one arrives. Don't modify it."""
+        with self._lock:
+            return self._seq, self._frame
+
+    def stop(self):
+        self._running = False
+        self._thread.join(timeout=2)
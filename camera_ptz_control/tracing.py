@@ -0,0 +1,112 @@
+from collections import deque
+from contextlib import contextmanager
+import contextvars
+from datetime import datetime
+import itertools
+import os
+import threading
+import time
+
+MAX_TRACES = 200
+
+_current = contextvars.ContextVar("cam_api_trace", default=None)
+_depth = contextvars.ContextVar("cam_api_trace_depth", default=0)
+_traces = deque(maxlen=MAX_TRACES)
+_lock = threading.Lock()
+_ids = itertools.count(1)
+
+
+class Trace:
+    """Timings of one request: a list of named spans relative to its start."""
+
+    def __init__(self, name):
+        self.id = next(_ids)
+        self.name = name
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.spans = []
+
+    def add_span(self, name, start, duration, depth):
+        self.spans.append((name, start - self._t0, duration, depth, threading.get_ident()))
+
+    def finish(self, status=None):
+        self.duration = time.perf_counter() - self._t0
+        self.status = status
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "start": datetime.fromtimestamp(self.started_at).isoformat(),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "status": self.status,
+            "spans": [
+                {"name": name, "offset_ms": round(offset * 1000, 3), "duration_ms": round(duration * 1000, 3),
+                 "depth": depth}
+                for name, offset, duration, depth, _ in self.spans
+            ],
+        }
+
+    def chrome_events(self):
+        pid = os.getpid()
+        start_us = self.started_at * 1e6
+        events = [{"name": self.name, "cat": "request", "ph": "X", "ts": start_us,
+                   "dur": (self.duration or 0) * 1e6, "pid": pid, "tid": self.id,
+                   "args": {"trace_id": self.id, "status": self.status}}]
+        for name, offset, duration, depth, thread in self.spans:
+            # One row per request so concurrent requests don't overlap
+            events.append({"name": name, "cat": "stage", "ph": "X", "ts": start_us + offset * 1e6,
+                           "dur": duration * 1e6, "pid": pid, "tid": self.id,
+                           "args": {"trace_id": self.id, "thread": thread}})
+        return events
+
+
+@contextmanager
+def trace(name):
+    """Record a request trace; spans opened inside it (in this context) are attached to it."""
+    current = Trace(name)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        if current.duration is None:
+            current.finish()
+        _current.reset(token)
+        with _lock:
+            _traces.append(current)
+
+
+@contextmanager
+def span(name):
+    """Time a block as a span of the current trace. No-op outside a trace."""
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.add_span(name, start, time.perf_counter() - start, depth)
+        _depth.reset(token)
+
+
+def recent(limit=50):
+    """Most recent finished traces, newest first."""
+    with _lock:
+        traces = list(_traces)[-limit:]
+    return [t.to_dict() for t in reversed(traces)]
+
+
+def chrome_trace(limit=50):
+    """Recent traces in Chrome trace-event format (load in chrome://tracing or Perfetto)."""
+    with _lock:
+        traces = list(_traces)[-limit:]
+    events = []
+    for t in traces:
+        events.extend(t.chrome_events())
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
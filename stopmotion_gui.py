@@ -1,30 +1,31 @@
 PATH="Z:/pictures/cam_api"
+# Same as the add-on's pictures_layout option ("" for one flat folder)
+LAYOUT="{location}/{YYYY}/{MM}/{DD}"
 
 import os
+import sys
 
-file_count = len([f for f in os.listdir(PATH) if os.path.isfile(os.path.join(PATH, f))])
-
-file_names = [f for f in os.listdir(PATH) if os.path.isfile(os.path.join(PATH, f))]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'camera_ptz_control'))
+from frame_source import FrameSource
+from picture_index import PictureIndex, skip_near_duplicates
+from picture_store import PictureStore
 
 import pandas as pd
 
-data = []
-for fname in file_names:
-    if fname.endswith('.jpg'):
-        parts = fname[:-4].split('_')
-        timestamp = f"{parts[0]}_{parts[1]}"
-        location = '_'.join(parts[2:])
-        data.append({'timestamp': timestamp, 'location': location, 'path': os.path.join(PATH, fname)})
-
-df = pd.DataFrame(data)
+store = PictureStore(PATH, LAYOUT)
+# Perceptual hashes the add-on keeps for every capture, to skip near-duplicate frames
+index = PictureIndex(store)
 
-df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y%m%d_%H%M%S')
+# Only the location folders are listed up front; a location's pictures are read when it is selected
+locations = store.locations()
+_location_frames = {}
 
-summary_df = df.groupby('location').agg(
-    picture_count=('timestamp', 'size'),
-    since=('timestamp', 'min'),
-    until=('timestamp', 'max')
-).reset_index()
+def load_location(location: str) -> pd.DataFrame:
+    """Pictures of one location (timestamp, location, path), read from its folders once."""
+    if location not in _location_frames:
+        pictures = store.pictures(location)
+        _location_frames[location] = pd.DataFrame(pictures, columns=['timestamp', 'location', 'path'])
+    return _location_frames[location]
 
 import cv2
 import numpy as np
@@ -147,7 +148,7 @@ def validate_transformation(M, width, height, max_rotation=10, max_translation_p
     
     return True
 
-def create_stopmotion_video(df: pd.DataFrame, location: str, since: datetime, until: datetime, fps=30, progress_callback=None):
+def create_stopmotion_video(df: pd.DataFrame, location: str, since: datetime, until: datetime, fps=30, progress_callback=None, skip_duplicates=False):
     OUTPUT_PATH = "Z:/videos/stopmotion"
     os.makedirs(OUTPUT_PATH, exist_ok=True)
 
@@ -158,6 +159,12 @@ def create_stopmotion_video(df: pd.DataFrame, location: str, since: datetime, un
     
     # Reset index to ensure proper indexing
     selected_df = selected_df.sort_values('timestamp').reset_index(drop=True)
+
+    if skip_duplicates:
+        # Drop frames that look the same as the previous kept one (static night scenes, stuck camera)
+        keep = skip_near_duplicates(index.hashes_for(location, list(selected_df.itertuples())))
+        print(f"Skipping {int((~keep).sum())} near-duplicate images")
+        selected_df = selected_df[keep].reset_index(drop=True)
     total_images = len(selected_df)
     
     if progress_callback:
@@ -202,66 +209,64 @@ def create_stopmotion_video(df: pd.DataFrame, location: str, since: datetime, un
     aligned_count = 0
     skipped_count = 0
     
-    for i, (_, row) in enumerate(selected_df.iterrows()):
+    # The next images are read from the share and decoded while this one is aligned and encoded
+    frames = FrameSource(selected_df['path'])
+    for i, img in frames:
         if progress_callback:
             progress_callback(f"Processing image {i+1}/{total_images}...", i, total_images)
         
-        img = cv2.imread(row['path'])
-        if img is not None:
-            aligned_img = img
-            
-            # Convert to grayscale and detect edges
-            gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            edges_img = cv2.Canny(gray_img, 50, 150)
-            
-            # Convert edges to 3-channel for video output
-            edges_colored = cv2.cvtColor(edges_img, cv2.COLOR_GRAY2BGR)
-            
-            if i == ref_idx:
-                # For reference frame, overlay original image with transparency
-                edges_with_ref = cv2.addWeighted(img, 0.7, edges_colored, 0.3, 0)
-                out_edges.write(edges_with_ref)
-            else:
-                out_edges.write(edges_colored)
-            
-            if use_alignment and i != ref_idx:  # Skip alignment for reference image
-                try:
-                    kp, des = orb.detectAndCompute(edges_img, None)
+        aligned_img = img
+        
+        # Convert to grayscale and detect edges
+        gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        edges_img = cv2.Canny(gray_img, 50, 150)
+        
+        # Convert edges to 3-channel for video output
+        edges_colored = cv2.cvtColor(edges_img, cv2.COLOR_GRAY2BGR)
+        
+        if i == ref_idx:
+            # For reference frame, overlay original image with transparency
+            edges_with_ref = cv2.addWeighted(img, 0.7, edges_colored, 0.3, 0)
+            out_edges.write(edges_with_ref)
+        else:
+            out_edges.write(edges_colored)
+        
+        if use_alignment and i != ref_idx:  # Skip alignment for reference image
+            try:
+                kp, des = orb.detectAndCompute(edges_img, None)
+                
+                if des is not None:
+                    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+                    matches = matcher.match(des, des_ref)
+                    matches = sorted(matches, key=lambda x: x.distance)
                     
-                    if des is not None:
-                        matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-                        matches = matcher.match(des, des_ref)
-                        matches = sorted(matches, key=lambda x: x.distance)
+                    if len(matches) > 15:  # Increased minimum matches for better reliability
+                        src_pts = np.float32([kp[m.queryIdx].pt for m in matches]).reshape(-1,1,2)
+                        dst_pts = np.float32([kp_ref[m.trainIdx].pt for m in matches]).reshape(-1,1,2)
                         
-                        if len(matches) > 15:  # Increased minimum matches for better reliability
-                            src_pts = np.float32([kp[m.queryIdx].pt for m in matches]).reshape(-1,1,2)
-                            dst_pts = np.float32([kp_ref[m.trainIdx].pt for m in matches]).reshape(-1,1,2)
-                            
-                            # Use affine transformation for alignment
-                            M, _ = cv2.estimateAffinePartial2D(src_pts, dst_pts)
-                            
-                            # Validate transformation limits
-                            if validate_transformation(M, width, height):
-                                aligned_img = cv2.warpAffine(img, M, (width, height))
-                                aligned_count += 1
-                            else:
-                                print(f"Warning: Transformation rejected for image {i+1} (outside limits)")
-                                skipped_count += 1
+                        # Use affine transformation for alignment
+                        M, _ = cv2.estimateAffinePartial2D(src_pts, dst_pts)
+                        
+                        # Validate transformation limits
+                        if validate_transformation(M, width, height):
+                            aligned_img = cv2.warpAffine(img, M, (width, height))
+                            aligned_count += 1
                         else:
-                            print(f"Warning: Not enough edge matches for alignment in image {i+1} ({len(matches)} matches)")
+                            print(f"Warning: Transformation rejected for image {i+1} (outside limits)")
                             skipped_count += 1
                     else:
-                        print(f"Warning: No edge features detected in image {i+1}")
+                        print(f"Warning: Not enough edge matches for alignment in image {i+1} ({len(matches)} matches)")
                         skipped_count += 1
-                        
-                except Exception as e:
-                    print(f"Warning: Edge-based alignment failed for image {i+1}: {e}")
+                else:
+                    print(f"Warning: No edge features detected in image {i+1}")
                     skipped_count += 1
-            
-            out.write(aligned_img)
-            processed_count += 1
-        else:
-            print(f"Warning: Could not read image {row['path']}.")
+                    
+            except Exception as e:
+                print(f"Warning: Edge-based alignment failed for image {i+1}: {e}")
+                skipped_count += 1
+        
+        out.write(aligned_img)
+        processed_count += 1
     
     out.release()
     out_edges.release()
@@ -272,6 +277,8 @@ def create_stopmotion_video(df: pd.DataFrame, location: str, since: datetime, un
     print(f"Main video created: {video_path}")
     print(f"Edge debug video created: {edges_video_path}")
     print(f"Processed {processed_count} of {total_images} images")
+    if frames.unreadable:
+        print(f"Could not read {len(frames.unreadable)} images")
     print(f"Reference frame: {ref_idx + 1}")
     if use_alignment:
         print(f"Successfully aligned: {aligned_count} images")
@@ -280,7 +287,7 @@ def create_stopmotion_video(df: pd.DataFrame, location: str, since: datetime, un
 
 
 # test
-# create_stopmotion_video(df, location='skyline', since=pd.Timestamp('2023-01-01'), until=pd.Timestamp('2027-01-31'), fps=3)
+# create_stopmotion_video(load_location('skyline'), location='skyline', since=pd.Timestamp('2023-01-01'), until=pd.Timestamp('2027-01-31'), fps=3)
 
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
@@ -295,10 +302,6 @@ class StopmotionGUI:
         self.master = master
         master.title("Stopmotion Video Creator")
 
-        # Calculate overall date range
-        self.overall_min_date = summary_df['since'].min()
-        self.overall_max_date = summary_df['until'].max()
-        
         # Initialize current location data
         self.current_location_timestamps = []
         self.current_location_paths = []  # Store image paths
@@ -307,10 +310,8 @@ class StopmotionGUI:
         self.label = tk.Label(master, text="Select Location:")
         self.label.pack(pady=10)
 
-        # Create location options with picture counts
-        location_options = []
-        for _, row in summary_df.iterrows():
-            location_options.append(f"{row['location']} ({row['picture_count']} pictures)")
+        # Picture counts are shown once a location is selected
+        location_options = list(locations)
         
         self.location_var = tk.StringVar()
         self.location_dropdown = ttk.Combobox(master, textvariable=self.location_var, 
@@ -418,6 +419,11 @@ class StopmotionGUI:
                                                     variable=self.limit_per_day_var, onvalue=True, offvalue=False)
         self.limit_per_day_checkbox.pack(pady=(0, 10))
 
+        self.skip_duplicates_var = tk.BooleanVar(value=False)
+        self.skip_duplicates_checkbox = tk.Checkbutton(master, text="Skip near-duplicate images",
+                                                       variable=self.skip_duplicates_var, onvalue=True, offvalue=False)
+        self.skip_duplicates_checkbox.pack(pady=(0, 10))
+
         self.create_button = tk.Button(master, text="Create Video", command=self.create_video, 
                                       bg='green', fg='white', font=('Arial', 12, 'bold'))
         self.create_button.pack(pady=30)
@@ -583,12 +589,12 @@ class StopmotionGUI:
             # Get all timestamps and paths for this location, sorted
             # Optionally filter to 1 image per day (closest to noon)
             if self.limit_per_day_var.get():
-                location_df = df[df['location'] == location].sort_values('timestamp')
+                location_df = load_location(location)
                 filtered_df = self.filter_one_per_day(location_df)
                 self.current_location_timestamps = filtered_df['timestamp'].tolist()
                 self.current_location_paths = filtered_df['path'].tolist()
             else:
-                location_df = df[df['location'] == location].sort_values('timestamp')
+                location_df = load_location(location)
                 self.current_location_timestamps = location_df['timestamp'].tolist()
                 self.current_location_paths = location_df['path'].tolist()
             
@@ -684,10 +690,12 @@ class StopmotionGUI:
                 # Create video with progress callback
                 # If limiting per day, pass filtered DataFrame to video function
                 if self.limit_per_day_var.get():
-                    filtered_df = self.filter_one_per_day(df[df['location'] == location].sort_values('timestamp'))
-                    create_stopmotion_video(filtered_df, location, since, until, fps, self.update_progress)
+                    filtered_df = self.filter_one_per_day(load_location(location))
+                    create_stopmotion_video(filtered_df, location, since, until, fps, self.update_progress,
+                                            self.skip_duplicates_var.get())
                 else:
-                    create_stopmotion_video(df, location, since, until, fps, self.update_progress)
+                    create_stopmotion_video(load_location(location), location, since, until, fps, self.update_progress,
+                                            self.skip_duplicates_var.get())
                 selected_count = until_idx - since_idx + 1
                 
                 self.update_progress("Complete!", selected_count, selected_count)
@@ -0,0 +1,73 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'camera_ptz_control'))
+import dynamodb
+
+
+class StubTable:
+    """The query of the plate/timestamp index, over items kept in a list."""
+
+    def __init__(self, items=()):
+        self.items = list(items)
+        self.queries = []
+
+    def query(self, IndexName, KeyConditionExpression):
+        plate_condition, since_condition = KeyConditionExpression.get_expression()['values']
+        plate = plate_condition.get_expression()['values'][1]
+        since = since_condition.get_expression()['values'][1]
+        self.queries.append((plate, since))
+        return {'Items': [item for item in self.items
+                          if item['texto_matricula'] == plate and item['timestamp'] > since]}
+
+
+def sighting(plate, seconds_ago):
+    return {'texto_matricula': plate, 'timestamp': (datetime.now() - timedelta(seconds=seconds_ago)).isoformat()}
+
+
+@pytest.fixture
+def table():
+    table = StubTable()
+    dynamodb.set_table(table)
+    dynamodb.configure_cache()
+    yield table
+    dynamodb.set_table(None)
+    dynamodb.configure_cache()
+
+
+def test_cache_hit_skips_the_query(table):
+    dynamodb.plate_cache.put('1234ABC', datetime.now() - timedelta(seconds=10))
+    assert dynamodb.check_plate_exists('1234ABC', dynamodb.DEDUPE_PERIOD_S)
+    assert table.queries == []
+
+
+def test_cache_miss_queries_the_table(table):
+    table.items.append(sighting('1234ABC', 10))
+    assert dynamodb.check_plate_exists('1234ABC', dynamodb.DEDUPE_PERIOD_S)
+    assert [plate for plate, _ in table.queries] == ['1234ABC']
+    # The sighting found is cached, so asking again stays local
+    assert dynamodb.check_plate_exists('1234ABC', dynamodb.DEDUPE_PERIOD_S)
+    assert len(table.queries) == 1
+
+
+def test_unknown_plate(table):
+    table.items.append(sighting('1234ABC', 10))
+    assert not dynamodb.check_plate_exists('9999ZZZ', dynamodb.DEDUPE_PERIOD_S)
+    assert [plate for plate, _ in table.queries] == ['9999ZZZ']
+
+
+def test_stale_entry_falls_through_to_the_table(table):
+    dynamodb.plate_cache.put('1234ABC', datetime.now() - timedelta(seconds=dynamodb.DEDUPE_PERIOD_S + 5))
+    table.items.append(sighting('1234ABC', dynamodb.DEDUPE_PERIOD_S + 5))
+    assert not dynamodb.check_plate_exists('1234ABC', dynamodb.DEDUPE_PERIOD_S)
+    assert len(table.queries) == 1
+
+
+def test_stale_entry_finds_a_sighting_from_another_process(table):
+    dynamodb.plate_cache.put('1234ABC', datetime.now() - timedelta(seconds=dynamodb.DEDUPE_PERIOD_S + 5))
+    table.items.append(sighting('1234ABC', 5))
+    assert dynamodb.check_plate_exists('1234ABC', dynamodb.DEDUPE_PERIOD_S)
+    assert len(table.queries) == 1
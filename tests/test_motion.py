@@ -0,0 +1,112 @@
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'camera_ptz_control'))
+from motion import MotionActor
+from ptz_commands import MotionPreempted
+
+MOVE_S = 0.3
+
+
+class FakeControl:
+    """Timed pan/tilt moves that can be interrupted halfway, like PTZCommands."""
+
+    def __init__(self):
+        self.est_pan_angle_deg = 0.0
+        self.est_tilt_angle_deg = 0.0
+        self.est_zoom_level = 0.0
+        self.interrupted = threading.Event()
+        self.moves = []
+        self.started = threading.Event()
+
+    def abs_pantilt(self, target):
+        self.moves.append(tuple(target))
+        self.started.set()
+        start = (self.est_pan_angle_deg, self.est_tilt_angle_deg)
+        if self.interrupted.wait(MOVE_S):
+            self.est_pan_angle_deg = (start[0] + target[0]) / 2
+            self.est_tilt_angle_deg = (start[1] + target[1]) / 2
+            raise MotionPreempted("Move interrupted")
+        self.est_pan_angle_deg, self.est_tilt_angle_deg = target
+
+    def abs_zoom(self, zoom):
+        self.est_zoom_level = zoom
+
+    def stop_ptz(self):
+        pass
+
+
+@pytest.fixture
+def actor():
+    control = FakeControl()
+    camera = SimpleNamespace(id="test", ptz_control=control,
+                             position=lambda: (control.est_pan_angle_deg, control.est_tilt_angle_deg))
+    return MotionActor(camera), control
+
+
+def target_pan(future):
+    return future.result(timeout=5)["target_position"]["pan"]
+
+
+def test_queued_moves_coalesce(actor):
+    motion, control = actor
+    release = threading.Event()
+    blocker = motion.call(release.wait)
+    first = motion.move_by(pan=10)
+    second = motion.move_by(pan=5)
+    release.set()
+    blocker.result(timeout=5)
+    assert target_pan(first) == target_pan(second) == 15
+    assert control.moves == [(15, 0)]
+
+
+def test_running_move_is_replanned(actor):
+    motion, control = actor
+    first = motion.move_by(pan=10)
+    assert control.started.wait(5)
+    second = motion.move_by(pan=20)
+    assert target_pan(first) == target_pan(second) == 30
+    assert control.moves == [(10, 0), (30, 0)]
+    assert control.est_pan_angle_deg == 30
+
+
+def test_goto_preempts_running_move(actor):
+    motion, control = actor
+    move = motion.move_by(pan=10)
+    assert control.started.wait(5)
+    goto = motion.goto(lambda: "arrived")
+    with pytest.raises(MotionPreempted):
+        move.result(timeout=5)
+    assert goto.result(timeout=5) == "arrived"
+
+
+def test_out_of_range_move_leaves_running_move_alone(actor):
+    motion, control = actor
+    first = motion.move_by(pan=10)
+    assert control.started.wait(5)
+    rejected = motion.move_by(pan=400)
+    with pytest.raises(ValueError):
+        rejected.result(timeout=0)
+    assert target_pan(first) == 10
+    assert control.moves == [(10, 0)]
+    assert control.est_pan_angle_deg == 10
+
+
+def test_out_of_range_move_leaves_queued_move_alone(actor):
+    motion, control = actor
+    release = threading.Event()
+    motion.call(release.wait)
+    first = motion.move_by(pan=10)
+    rejected = motion.move_by(pan=345)
+    with pytest.raises(ValueError):
+        rejected.result(timeout=0)
+    release.set()
+    assert target_pan(first) == 10
+    # Give a wrongly collapsed move the chance to show up
+    time.sleep(0.05)
+    assert control.moves == [(10, 0)]
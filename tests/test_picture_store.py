@@ -0,0 +1,37 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'camera_ptz_control'))
+from picture_store import PictureStore
+
+NAME = "20261019_120000_terraza.jpg"
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PictureStore(str(tmp_path / "pictures"))
+    open(store.path_for("terraza", datetime(2026, 10, 19, 12)), "w").close()
+    return store
+
+
+def test_resolve_by_name_and_path(store):
+    path = store.layout_path(NAME)
+    assert store.resolve(NAME) == path
+    assert store.resolve(path) == path
+    # An earlier path, e.g. from before the files were migrated into the layout
+    assert store.resolve(os.path.join(store.root, NAME)) == path
+
+
+def test_resolve_stays_inside_the_pictures_folder(store, tmp_path):
+    outside = tmp_path / NAME
+    outside.write_text("")
+    assert store.resolve(str(outside)) == store.layout_path(NAME)
+    assert store.resolve(os.path.join(store.root, "..", NAME)) == store.layout_path(NAME)
+    other = tmp_path / "other.jpg"
+    other.write_text("")
+    assert store.resolve(str(other)) is None
+    os.symlink(str(tmp_path), os.path.join(store.root, "link"))
+    assert store.resolve(os.path.join(store.root, "link", "other.jpg")) is None
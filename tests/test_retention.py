@@ -0,0 +1,108 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'camera_ptz_control'))
+from picture_store import PictureStore
+from retention import Compactor
+
+LOCATION = "terraza"
+FIRST = datetime(2026, 10, 15, 0, 7)
+NOW = datetime(2026, 10, 20, 3, 30)
+# Listed youngest first: the compactor must still apply the oldest tier first
+TIERS = [{"after_days": 1, "keep": "hour", "quality": 50}, {"after_days": 3, "keep": "day"}]
+
+
+def at(day, hour, minute, second=0):
+    return datetime(2026, 10, day, hour, minute, second)
+
+
+def hourly(start, end, minute=27):
+    """One picture per hour at minute past, from the hour of start up to end."""
+    t = start.replace(minute=minute, second=0)
+    found = []
+    while t < end:
+        found.append(t)
+        t += timedelta(hours=1)
+    return found
+
+
+@pytest.fixture
+def jpeg():
+    noise = np.random.default_rng(0).integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", noise, [cv2.IMWRITE_JPEG_QUALITY, 100])[1].tobytes()
+
+
+@pytest.fixture
+def store(tmp_path, jpeg):
+    """A picture every 10 minutes (at :07, :17...) until NOW, plus one on the hour tier's first cutoff."""
+    store = PictureStore(str(tmp_path))
+    t = FIRST
+    while t <= NOW:
+        add(store, t, jpeg)
+        t += timedelta(minutes=10)
+    add(store, at(19, 3, 0), jpeg)
+    return store
+
+
+def add(store, when, data):
+    with open(store.path_for(LOCATION, when), "wb") as f:
+        f.write(data)
+
+
+def timestamps(store):
+    return [p.timestamp for p in store.pictures(LOCATION)]
+
+
+def every_ten_minutes(start, end):
+    found = []
+    t = start
+    while t <= end:
+        found.append(t)
+        t += timedelta(minutes=10)
+    return found
+
+
+def compact(store, now, dry_run=False):
+    return Compactor(store, TIERS, max_mb_per_s=1000).run(dry_run=dry_run, now=now, log=lambda message: None)
+
+
+def test_one_run(store, jpeg):
+    report = compact(store, NOW)
+    expected = ([at(15, 11, 57), at(16, 11, 57)] +           # older than 3 days: the one closest to noon
+                hourly(at(17, 0, 0), at(19, 3, 0)) +          # older than 1 day: the one closest to half past
+                [at(19, 3, 0)] +                              # the cutoff itself is not older
+                every_ten_minutes(at(19, 3, 7), NOW))         # the hour the cutoff falls in stays whole
+    assert timestamps(store) == expected
+    assert report["deleted"] == len(every_ten_minutes(FIRST, NOW)) + 1 - len(expected)
+    # Everything older than the hour tier is re-encoded at its quality, the day tier's pictures too
+    assert report["reencoded"] == len(expected[:expected.index(at(19, 3, 0))])
+    assert os.path.getsize(store.layout_path(f"20261016_115700_{LOCATION}.jpg")) < len(jpeg)
+    assert os.path.getsize(store.layout_path(f"20261019_030700_{LOCATION}.jpg")) == len(jpeg)
+
+
+def test_two_runs_a_day_apart(store, jpeg):
+    compact(store, NOW)
+    # Arrives late in a range already compacted; the watermark keeps it out of later runs
+    add(store, at(15, 8, 0), jpeg)
+    compact(store, NOW + timedelta(days=1))
+    expected = ([at(15, 8, 0), at(15, 11, 57), at(16, 11, 57),
+                 at(17, 12, 27)] +                            # the 17th's hourly pictures, down to one
+                hourly(at(18, 0, 0), at(20, 3, 0)) +          # the 19th 03:00 picture joins its hour
+                every_ten_minutes(at(20, 3, 7), NOW))
+    assert timestamps(store) == expected
+
+
+def test_dry_run_touches_nothing(store):
+    files = {p.path: (os.path.getsize(p.path), os.path.getmtime(p.path)) for p in store.pictures()}
+    dry = compact(store, NOW, dry_run=True)
+    assert {p.path: (os.path.getsize(p.path), os.path.getmtime(p.path)) for p in store.pictures()} == files
+    assert not os.path.exists(os.path.join(store.root, ".retention.json"))
+    # Pictures the day tier would drop are not counted again by the hour tier
+    real = compact(store, NOW)
+    assert dry["deleted"] == real["deleted"]
+    assert dry["reencoded"] == real["reencoded"]
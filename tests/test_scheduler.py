@@ -0,0 +1,74 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'camera_ptz_control'))
+from scheduler import CronRule, _parse_field
+
+
+@pytest.mark.parametrize("text, low, high, values", [
+    ("*", 0, 6, set(range(0, 7))),
+    ("*/15", 0, 59, {0, 15, 30, 45}),
+    ("7-20", 0, 23, set(range(7, 21))),
+    ("5/10", 0, 59, {5, 15, 25, 35, 45, 55}),
+    ("8-18/5", 0, 23, {8, 13, 18}),
+    ("1,3-5,30", 1, 31, {1, 3, 4, 5, 30}),
+    ("0", 0, 7, {0}),
+    ("7", 0, 7, {7}),
+])
+def test_parse_field(text, low, high, values):
+    assert _parse_field(text, low, high) == values
+
+
+@pytest.mark.parametrize("text, low, high", [
+    ("60", 0, 59),
+    ("0", 1, 31),
+    ("20-7", 0, 23),
+    ("*/0", 0, 59),
+    ("x", 0, 59),
+])
+def test_parse_field_rejects(text, low, high):
+    with pytest.raises(ValueError):
+        _parse_field(text, low, high)
+
+
+@pytest.mark.parametrize("expression, when, expected", [
+    ("*/15 7-20 * * *", datetime(2026, 10, 19, 6, 50), datetime(2026, 10, 19, 7, 0)),
+    ("*/15 7-20 * * *", datetime(2026, 10, 19, 7, 0), datetime(2026, 10, 19, 7, 15)),
+    ("*/15 7-20 * * *", datetime(2026, 10, 19, 20, 45, 30), datetime(2026, 10, 20, 7, 0)),
+    ("5/10 * * * *", datetime(2026, 10, 19, 10, 0), datetime(2026, 10, 19, 10, 5)),
+    ("5/10 * * * *", datetime(2026, 10, 19, 10, 55), datetime(2026, 10, 19, 11, 5)),
+    # 0 and 7 are both Sunday
+    ("0 12 * * 0", datetime(2026, 10, 19, 12, 0), datetime(2026, 10, 25, 12, 0)),
+    ("0 12 * * 7", datetime(2026, 10, 19, 12, 0), datetime(2026, 10, 25, 12, 0)),
+    # Restricted day and weekday: either matches (the 1st, or a Monday)
+    ("0 12 1 * 1", datetime(2026, 10, 20, 12, 0), datetime(2026, 10, 26, 12, 0)),
+    ("0 12 1 * 1", datetime(2026, 10, 27, 12, 0), datetime(2026, 11, 1, 12, 0)),
+    ("0 12 13 * 5", datetime(2026, 10, 19, 12, 0), datetime(2026, 10, 23, 12, 0)),
+    # Only the weekday restricted: it must match, along with the month
+    ("0 12 * 10 1", datetime(2026, 10, 26, 13, 0), datetime(2027, 10, 4, 12, 0)),
+    ("0 0 29 2 *", datetime(2026, 10, 19, 0, 0), None),
+    ("0 0 30 2 *", datetime(2026, 10, 19, 0, 0), None),
+])
+def test_next_after(expression, when, expected):
+    assert CronRule(expression).next_after(when) == expected
+
+
+@pytest.mark.parametrize("expression, when, matches", [
+    ("0 12 1 * 1", datetime(2026, 10, 19, 12, 0), True),      # a Monday
+    ("0 12 1 * 1", datetime(2026, 11, 1, 12, 0), True),       # the 1st, a Sunday
+    ("0 12 1 * 1", datetime(2026, 10, 20, 12, 0), False),
+    ("0 12 1 * *", datetime(2026, 10, 19, 12, 0), False),
+    ("0 12 * * 1", datetime(2026, 11, 1, 12, 0), False),
+    ("*/15 7-20 * * *", datetime(2026, 10, 19, 21, 0), False),
+])
+def test_matches(expression, when, matches):
+    assert CronRule(expression).matches(when) == matches
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "* * * * * *", "* 24 * * *", "* * * 13 *", "* * * * 8"])
+def test_cron_rule_rejects(expression):
+    with pytest.raises(ValueError):
+        CronRule(expression)